@@ -0,0 +1,114 @@
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from inventory.models import Branch, Inventory
+from .models import LowStockAlert, Notification
+
+
+def check_stock(branch_id, product_ids):
+    """
+    Record which of a branch's products crossed their reorder level.
+
+    Runs after the stock change commits. Rows that stayed on the same side
+    of the threshold cost one read and no writes; only a crossing touches
+    LowStockAlert. The state flips are conditional updates, so concurrent
+    checks of the same row record each crossing once.
+    """
+    rows = Inventory.objects.filter(branch_id=branch_id, product_id__in=product_ids).values_list(
+        'pk', 'quantity', 'reorder_level', 'low_stock_alert__is_low',
+    )
+    went_low, recovered = [], []
+    for pk, quantity, reorder_level, is_low in rows:
+        if quantity <= reorder_level and not is_low:
+            went_low.append(pk)
+        elif quantity > reorder_level and is_low:
+            recovered.append(pk)
+
+    now = timezone.now()
+    if went_low:
+        LowStockAlert.objects.bulk_create([LowStockAlert(inventory_id=pk) for pk in went_low],
+                                          ignore_conflicts=True)
+        LowStockAlert.objects.filter(inventory_id__in=went_low, is_low=False).update(
+            is_low=True, crossed_at=now, notified_at=None, times_crossed=F('times_crossed') + 1,
+        )
+    if recovered:
+        LowStockAlert.objects.filter(inventory_id__in=recovered, is_low=True).update(is_low=False, cleared_at=now)
+    return len(went_low), len(recovered)
+
+
+def _line(row):
+    quantity = row['inventory__quantity']
+    state = 'OUT OF STOCK' if quantity == 0 else f'{quantity} left'
+    return (f"- {row['inventory__branch__name']}: {row['inventory__product__name']} "
+            f"({row['inventory__product__sku']}), {state}, reorder level {row['inventory__reorder_level']}")
+
+
+def _plural(count, noun):
+    return f"{count} {noun}{'s' if count != 1 else ''}"
+
+
+def send_digests():
+    """
+    Queue one low stock notification per branch manager.
+
+    Each digest lists the products at the manager's branches that went low
+    since the previous digest and are still low now. A product that dipped
+    and was restocked in between is left out. Returns the number of
+    notifications created.
+    """
+    started = timezone.now()
+    managers = dict(Branch.objects.filter(manager__isnull=False).values_list('pk', 'manager_id'))
+    alerts = LowStockAlert.objects.filter(
+        is_low=True, notified_at__isnull=True, inventory__branch_id__in=list(managers),
+    ).order_by('inventory__branch__name', 'inventory__product__name').values(
+        'pk', 'inventory__branch_id', 'inventory__branch__name', 'inventory__product__name',
+        'inventory__product__sku', 'inventory__quantity', 'inventory__reorder_level',
+    )
+
+    digests = {}
+    for row in alerts:
+        digests.setdefault(managers[row['inventory__branch_id']], []).append(row)
+    if not digests:
+        return 0
+
+    notifications = []
+    for manager_id, rows in digests.items():
+        lines = [_line(row) for row in rows]
+        # Products reported by an earlier digest and still waiting for stock
+        still_low = LowStockAlert.objects.filter(
+            is_low=True, notified_at__isnull=False,
+            inventory__branch_id__in={row['inventory__branch_id'] for row in rows},
+        ).count()
+        if still_low:
+            lines.append(f"{_plural(still_low, 'product')} from earlier alerts still below the reorder level.")
+        notifications.append(Notification(
+            notification_type='low_stock',
+            title=f"Low Stock Alert: {_plural(len(rows), 'product')} to reorder",
+            message='\n'.join(lines),
+            recipient_id=manager_id,
+            delivery_method='both',
+            related_object_type='low_stock_digest',
+        ))
+
+    reported = [row['pk'] for rows in digests.values() for row in rows]
+    with transaction.atomic():
+        Notification.objects.bulk_create(notifications)
+        # Batches keep the IN list under SQLite's bound parameter limit. A row that
+        # recovered and fell again since it was read is left for the next digest.
+        for offset in range(0, len(reported), 10000):
+            LowStockAlert.objects.filter(
+                pk__in=reported[offset:offset + 10000], notified_at__isnull=True, crossed_at__lt=started,
+            ).update(notified_at=timezone.now())
+    return len(notifications)
+
+
+def rescan():
+    """Check every inventory row, e.g. to pick up rows that were already low before alerting was enabled"""
+    changed = [0, 0]
+    for branch_id in Branch.objects.values_list('pk', flat=True):
+        product_ids = list(Inventory.objects.filter(branch_id=branch_id).values_list('product_id', flat=True))
+        for offset in range(0, len(product_ids), 10000):
+            for index, count in enumerate(check_stock(branch_id, product_ids[offset:offset + 10000])):
+                changed[index] += count
+    return tuple(changed)
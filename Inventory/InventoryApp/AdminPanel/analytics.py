@@ -0,0 +1,340 @@
+import datetime
+import os
+import threading
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import Count, F, Max, Min, Sum
+from django.utils import timezone
+
+from .models import SalesFact, SalesFactDirtyDay, SalesFactRefresh
+
+try:
+    import numpy as np
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    np = pd = pa = pq = None
+
+DIMENSIONS = ('branch', 'product', 'category', 'brand')
+GRAINS = ('day', 'week', 'month', 'year')
+CHUNK_DAYS = 31
+EXPORT_BATCH = 100000
+EPOCH = datetime.date(1970, 1, 1)
+# Most rows one report query may return
+MAX_LIMIT = 5000
+
+
+class AnalyticsError(ValueError):
+    """Raised for report queries the cube cannot answer"""
+
+
+def is_available():
+    return pq is not None
+
+
+def _require():
+    if not is_available():
+        raise ImproperlyConfigured('The sales analytics store needs numpy, pandas and pyarrow installed.')
+
+
+def store_path():
+    default = Path(settings.BASE_DIR) / 'analytics' / 'sales_facts.parquet'
+    return Path(getattr(settings, 'ANALYTICS_STORE_PATH', default))
+
+
+# Refreshing the fact table
+
+def _day_runs(days):
+    """Split a set of dates into contiguous runs of at most CHUNK_DAYS"""
+    runs = []
+    for day in sorted(days):
+        if runs and day - runs[-1][1] == datetime.timedelta(days=1) and (day - runs[-1][0]).days < CHUNK_DAYS:
+            runs[-1][1] = day
+        else:
+            runs.append([day, day])
+    return runs
+
+
+def _rebuild_days(first, last):
+    """Recompute the facts for trading days first..last from completed sale lines"""
+    from Sales.models import SaleItem
+
+    rows = SaleItem.objects.filter(
+        sale__is_completed=True, sale__business_date__gte=first, sale__business_date__lte=last,
+    ).annotate(
+        day=F('sale__business_date'),
+    ).values(
+        'day', 'sale__branch_id', 'product_id', 'product__category_id', 'product__brand_id',
+    ).annotate(
+        units=Sum('quantity'), amount=Sum('total_price'), lines=Count('id'),
+    ).order_by()
+
+    facts = [
+        SalesFact(
+            day=row['day'],
+            branch_id=row['sale__branch_id'],
+            product_id=row['product_id'],
+            category_id=row['product__category_id'],
+            brand_id=row['product__brand_id'],
+            quantity=row['units'],
+            revenue=row['amount'],
+            line_count=row['lines'],
+        )
+        for row in rows.iterator(chunk_size=5000)
+    ]
+
+    with transaction.atomic():
+        SalesFact.objects.filter(day__gte=first, day__lte=last).delete()
+        SalesFact.objects.bulk_create(facts, batch_size=2000)
+    return len(facts)
+
+
+def _changed_days(since, trailing_days):
+    """Trading days touched by sales edited after `since`, plus the trailing window"""
+    from inventory.models import Branch
+    from Sales.models import Sale
+
+    today = max(Branch.business_days(), default=timezone.localdate())
+    days = {today - datetime.timedelta(days=offset) for offset in range(trailing_days)}
+    if since is not None:
+        days.update(
+            Sale.objects.filter(updated_at__gt=since).values_list('business_date', flat=True).distinct().order_by()
+        )
+    return days
+
+
+def refresh_sales_facts(full=False, trailing_days=2, export=True):
+    """
+    Bring the sales fact table up to date and rewrite the columnar export.
+
+    Only days holding sales edited since the last refresh are recomputed,
+    together with the days of deleted sales queued in SalesFactDirtyDay
+    and the most recent `trailing_days`. Each contiguous run of days is
+    replaced in one transaction, at most CHUNK_DAYS at a time.
+    """
+    from Sales.models import Sale
+
+    # Take the watermark and the queued days first so changes made while refreshing are seen next time
+    watermark = Sale.objects.aggregate(latest=Max('updated_at'))['latest'] or timezone.now()
+    queued_at = timezone.now()
+    dirty = set(SalesFactDirtyDay.objects.filter(marked_at__lte=queued_at).values_list('day', flat=True))
+    previous = SalesFactRefresh.objects.order_by('-started_at').first()
+
+    if full or previous is None:
+        full = True
+        bounds = Sale.objects.aggregate(first=Min('business_date'), last=Max('business_date'))
+        SalesFact.objects.all().delete()
+        days = set()
+        if bounds['first']:
+            first, last = bounds['first'], bounds['last']
+            days = {first + datetime.timedelta(days=n) for n in range((last - first).days + 1)}
+    else:
+        days = _changed_days(previous.watermark, trailing_days) | dirty
+
+    rows = 0
+    for first, last in _day_runs(days):
+        rows += _rebuild_days(first, last)
+    SalesFactDirtyDay.objects.filter(marked_at__lte=queued_at).delete()
+
+    path = export_sales_facts() if export else None
+    return SalesFactRefresh.objects.create(
+        watermark=watermark,
+        full=full,
+        days_refreshed=len(days),
+        rows_written=rows,
+        export_path=str(path or ''),
+    )
+
+
+# Columnar export
+
+def export_schema():
+    _require()
+    label = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ('day', pa.date32()),
+        ('branch_id', pa.int32()),
+        ('product_id', pa.int32()),
+        ('category_id', pa.int32()),
+        ('brand_id', pa.int32()),
+        ('quantity', pa.int64()),
+        ('revenue_cents', pa.int64()),
+        ('line_count', pa.int64()),
+        ('branch_name', label),
+        ('product_name', label),
+        ('category_name', label),
+        ('brand_name', label),
+    ])
+
+
+def _record_batch(schema, rows):
+    columns = list(zip(*rows))
+    arrays = []
+    for field, values in zip(schema, columns):
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(values, pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(values, field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def write_parquet(path, batches, schema):
+    """Write record batches to `path` through a temporary file so readers never see a partial store"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f'.{path.name}.tmp')
+    with pq.ParquetWriter(tmp, schema, compression='zstd') as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+    os.replace(tmp, path)
+    return path
+
+
+def export_sales_facts(path=None):
+    """Dump the whole fact table, with dimension labels, to the Parquet store"""
+    _require()
+    schema = export_schema()
+    facts = SalesFact.objects.order_by('day', 'branch_id', 'product_id').values_list(
+        'day', 'branch_id', 'product_id', 'category_id', 'brand_id', 'quantity', 'revenue', 'line_count',
+        'branch__name', 'product__name', 'category__name', 'brand__name',
+    )
+
+    def batches():
+        rows = []
+        for row in facts.iterator(chunk_size=EXPORT_BATCH):
+            row = list(row)
+            row[6] = int(row[6] * 100)
+            rows.append(row)
+            if len(rows) == EXPORT_BATCH:
+                yield _record_batch(schema, rows)
+                rows = []
+        if rows:
+            yield _record_batch(schema, rows)
+
+    return write_parquet(path or store_path(), batches(), schema)
+
+
+# Querying the store
+
+def _to_days(value):
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.date.fromisoformat(value)
+    return (value - EPOCH).days
+
+
+class SalesCube:
+    """The exported sales facts held as NumPy columns for vectorised slicing and rollups"""
+
+    def __init__(self, table):
+        _require()
+        self.rows = table.num_rows
+        self.day = table.column('day').cast(pa.int32()).to_numpy()
+        self.measures = {
+            name: table.column(name).to_numpy()
+            for name in ('quantity', 'revenue_cents', 'line_count')
+        }
+        self.ids = {}
+        self.labels = {}
+        self.periods = {}
+        for dimension in DIMENSIONS:
+            ids = table.column(f'{dimension}_id').to_numpy()
+            self.ids[dimension] = ids
+            names = table.column(f'{dimension}_name').to_pandas()
+            # One label per id, taken from the first row that carries it
+            unique, first = np.unique(ids, return_index=True)
+            self.labels[dimension] = pd.Series(np.asarray(names)[first], index=unique)
+
+    @classmethod
+    def read(cls, path):
+        _require()
+        return cls(pq.read_table(path))
+
+    def period(self, grain):
+        """Start day (days since epoch) of the period each row falls in"""
+        if grain == 'day':
+            return self.day
+        if grain not in self.periods:
+            if grain == 'week':
+                # 1970-01-01 was a Thursday; shift so weeks start on Monday
+                starts = (self.day + 3) // 7 * 7 - 3
+            else:
+                unit = 'M' if grain == 'month' else 'Y'
+                starts = self.day.astype('datetime64[D]').astype(f'datetime64[{unit}]').astype('datetime64[D]')
+            self.periods[grain] = starts.astype(np.int32)
+        return self.periods[grain]
+
+    def query(self, group_by=(), grain=None, start=None, end=None, filters=None, limit=None):
+        """
+        Aggregate quantity, revenue and line count over a slice of the cube.
+
+        `group_by` names any of DIMENSIONS, `grain` adds a time period
+        column, `start`/`end` bound the day inclusively and `filters` maps a
+        dimension to the ids it is restricted to. Rows come back with the
+        period ascending, then by revenue, largest first.
+        """
+        group_by = list(group_by)
+        for dimension in list(group_by) + list(filters or {}):
+            if dimension not in DIMENSIONS:
+                raise AnalyticsError(f"Unknown dimension '{dimension}'.")
+        if grain is not None and grain not in GRAINS:
+            raise AnalyticsError(f"Unknown grain '{grain}'.")
+
+        mask = np.ones(self.rows, dtype=bool)
+        if start is not None:
+            mask &= self.day >= _to_days(start)
+        if end is not None:
+            mask &= self.day <= _to_days(end)
+        for dimension, ids in (filters or {}).items():
+            mask &= np.isin(self.ids[dimension], np.asarray(list(ids), dtype=self.ids[dimension].dtype))
+
+        columns = {}
+        if grain:
+            columns['period'] = self.period(grain)[mask]
+        for dimension in group_by:
+            columns[f'{dimension}_id'] = self.ids[dimension][mask]
+        for name, values in self.measures.items():
+            columns[name] = values[mask]
+        frame = pd.DataFrame(columns, copy=False)
+
+        keys = [name for name in columns if name not in self.measures]
+        if keys:
+            result = frame.groupby(keys, sort=False).sum().reset_index()
+        else:
+            result = frame.sum().to_frame().T
+        order = (['period'] if grain else []) + ['revenue_cents']
+        result = result.sort_values(order, ascending=[True] * (len(order) - 1) + [False], kind='stable')
+        if limit:
+            result = result.head(limit)
+
+        if grain:
+            result['period'] = result['period'].astype('datetime64[D]').dt.date
+        for dimension in group_by:
+            result[dimension] = result[f'{dimension}_id'].map(self.labels[dimension])
+        result['revenue'] = result['revenue_cents'] / 100
+        return result.reset_index(drop=True)
+
+
+_lock = threading.Lock()
+_loaded = {'key': None, 'cube': None}
+
+
+def get_cube(path=None):
+    """Return the cube for the current store file, reloading it only after a new export"""
+    path = Path(path or store_path())
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        raise AnalyticsError('The sales analytics store has not been built yet.')
+
+    key = (str(path), stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        if _loaded['key'] != key:
+            _loaded['cube'] = SalesCube.read(path)
+            _loaded['key'] = key
+        return _loaded['cube']
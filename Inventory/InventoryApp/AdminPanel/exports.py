@@ -0,0 +1,269 @@
+import csv
+import datetime
+import itertools
+import re
+import zipfile
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from . import profit
+
+# Rows buffered before a chunk is handed to the response
+FLUSH_ROWS = 1000
+ITERATOR_CHUNK = 2000
+
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'excel': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+EXTENSIONS = {'csv': 'csv', 'excel': 'xlsx'}
+
+
+class _Echo:
+    """File-like object whose write() hands the value back, so csv.writer can format single rows"""
+
+    def write(self, value):
+        return value
+
+
+def csv_chunks(header, rows):
+    """Yield CSV text for `header` and `rows`, FLUSH_ROWS lines at a time"""
+    writer = csv.writer(_Echo())
+    buffer = [writer.writerow(header)]
+    for row in rows:
+        buffer.append(writer.writerow(row))
+        if len(buffer) >= FLUSH_ROWS:
+            yield ''.join(buffer)
+            buffer = []
+    if buffer:
+        yield ''.join(buffer)
+
+
+# Minimal SpreadsheetML package around a single worksheet
+XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '</Relationships>'
+    ),
+}
+WORKBOOK_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets></workbook>'
+)
+SHEET_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+SHEET_TAIL = '</sheetData></worksheet>'
+
+# Characters XML 1.0 does not allow, even escaped
+INVALID_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+class _Sink:
+    """Write-only buffer the zip archive streams into; drain() hands over what has accumulated"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _cell(value):
+    if value is None:
+        return '<c/>'
+    if isinstance(value, bool):
+        return f'<c t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float, Decimal)):
+        return f'<c><v>{value}</v></c>'
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        value = value.isoformat(sep=' ') if isinstance(value, datetime.datetime) else value.isoformat()
+    text = escape(INVALID_XML.sub('', str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def xlsx_chunks(header, rows, sheet_name='Export'):
+    """
+    Yield an .xlsx workbook for `header` and `rows` as a stream of bytes.
+
+    Cells are written as inline strings, so there is no shared string table
+    to hold in memory, and the worksheet is deflated straight into the
+    archive as rows arrive. The zip is written with data descriptors,
+    which needs no seeking, so memory use does not depend on the row count.
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, content in XLSX_PARTS.items():
+            archive.writestr(name, content)
+        archive.writestr('xl/workbook.xml', WORKBOOK_XML.format(name=escape(sheet_name[:31])))
+
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(SHEET_HEAD.encode())
+            buffer = []
+            for count, row in enumerate(itertools.chain([header], rows), 1):
+                buffer.append('<row>' + ''.join(_cell(value) for value in row) + '</row>')
+                if count % FLUSH_ROWS == 0:
+                    sheet.write(''.join(buffer).encode())
+                    buffer = []
+                    yield sink.drain()
+            sheet.write((''.join(buffer) + SHEET_TAIL).encode())
+    yield sink.drain()
+
+
+def stream(header, rows, export_format):
+    """Encoded chunks of `rows` in `export_format` ('csv' or 'excel')"""
+    if export_format == 'csv':
+        return (chunk.encode() for chunk in csv_chunks(header, rows))
+    if export_format == 'excel':
+        return xlsx_chunks(header, rows)
+    raise ValueError(f"Cannot export as '{export_format}'")
+
+
+def streaming_response(header, rows, export_format, filename):
+    """A download of `rows` that is generated while it is being sent"""
+    response = StreamingHttpResponse(stream(header, rows, export_format),
+                                     content_type=CONTENT_TYPES[export_format])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{EXTENSIONS[export_format]}"'
+    return response
+
+
+# Row sources
+
+SALE_HEADER = ('Invoice', 'Date', 'Customer', 'Staff', 'Payment method', 'Subtotal', 'Tax', 'Discount', 'Total')
+
+
+def sale_rows(sales):
+    """Export rows for a Sale queryset, read in chunks without building model instances"""
+    methods = dict(sales.model.PAYMENT_METHOD_CHOICES)
+    for row in sales.values_list(
+            'invoice_number', 'sale_date', 'customer__name', 'staff__username', 'payment_method',
+            'subtotal', 'tax_amount', 'discount_amount', 'total_amount').iterator(chunk_size=ITERATOR_CHUNK):
+        yield (row[0], _local(row[1]), row[2], row[3], methods.get(row[4], row[4]), *row[5:])
+
+
+def date_range(params):
+    """The `start` and `end` trading days in `params`, both included; None where not given"""
+    return [datetime.date.fromisoformat(params[name]) if params.get(name) else None for name in ('start', 'end')]
+
+
+def _branch(params):
+    return int(params['branch']) if params.get('branch') else None
+
+
+def profit_summary(params):
+    """Run the profit computation for report parameters taken from a GET, a POST or a saved report"""
+    start, end = date_range(params)
+    return profit.profit_by(params.get('group_by') or 'product', start, end, _branch(params))
+
+
+REPORT_TYPES = ('sales', 'inventory', 'purchase', 'profit')
+PROFIT_COLUMNS = ('label', 'quantity', 'lines', 'revenue', 'cost', 'profit', 'margin')
+INVENTORY_HEADER = ('Branch', 'Product', 'SKU', 'Quantity', 'Reorder level', 'Average cost', 'Last restocked')
+PURCHASE_HEADER = ('Reference', 'Date', 'Supplier', 'Branch', 'Status', 'Total')
+
+
+def _local(value):
+    return timezone.localtime(value).replace(tzinfo=None, microsecond=0) if value else None
+
+
+def _report_queryset(report_type, params):
+    """The filtered, ordered queryset behind a detail report, or None for aggregated reports"""
+    from inventory.models import Inventory, Purchase
+    from Sales.models import Sale
+
+    start, end = date_range(params)
+    branch = _branch(params)
+
+    # Dated reports filter on the stored trading day, and order by it first so the index serves both
+    if report_type == 'sales':
+        queryset = Sale.objects.filter(is_completed=True).order_by('business_date', 'sale_date', 'pk')
+        dated = True
+    elif report_type == 'purchase':
+        queryset = Purchase.objects.order_by('business_date', 'purchase_date', 'pk')
+        dated = True
+    elif report_type == 'inventory':
+        queryset = Inventory.objects.order_by('branch_id', 'product_id')
+        dated = False
+    elif report_type == 'profit':
+        return None
+    else:
+        raise ValueError(f"Cannot export {report_type} reports")
+
+    if dated and start:
+        queryset = queryset.filter(business_date__gte=start)
+    if dated and end:
+        queryset = queryset.filter(business_date__lte=end)
+    if branch:
+        queryset = queryset.filter(branch=branch)
+    return queryset
+
+
+def report_size(report_type, params):
+    """Rows a report will produce, for progress reporting; None when it is not known up front"""
+    queryset = _report_queryset(report_type, params)
+    return queryset.count() if queryset is not None else None
+
+
+def report_rows(report_type, params):
+    """
+    Header and row iterator for a report type and its parameters.
+
+    Detail reports read the database lazily as the rows are consumed, so
+    they can be fed straight into a streaming response.
+    """
+    queryset = _report_queryset(report_type, params)
+
+    if report_type == 'sales':
+        return SALE_HEADER, sale_rows(queryset)
+
+    if report_type == 'inventory':
+        rows = queryset.values_list('branch__name', 'product__name', 'product__sku', 'quantity', 'reorder_level',
+                                    'average_cost', 'last_restock_date').iterator(chunk_size=ITERATOR_CHUNK)
+        return INVENTORY_HEADER, ((*row[:6], _local(row[6])) for row in rows)
+
+    if report_type == 'purchase':
+        statuses = dict(queryset.model.STATUS_CHOICES)
+        rows = queryset.values_list('reference_number', 'purchase_date', 'supplier__name', 'branch__name',
+                                    'status', 'total_amount').iterator(chunk_size=ITERATOR_CHUNK)
+        return PURCHASE_HEADER, ((row[0], _local(row[1]), row[2], row[3], statuses.get(row[4], row[4]), row[5])
+                                 for row in rows)
+
+    summary = profit_summary(params)
+    return ([column.title() for column in PROFIT_COLUMNS],
+            ([row[column] for column in PROFIT_COLUMNS] for row in summary['rows'] + [summary['totals']]))
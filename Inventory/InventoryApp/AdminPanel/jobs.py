@@ -0,0 +1,180 @@
+import datetime
+import os
+import socket
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import exports, report_cache
+from .models import Report, ReportJob
+
+# Seconds between progress writes while a report is being generated
+PROGRESS_INTERVAL = 1.0
+
+
+class JobLimitError(ValueError):
+    """Raised when a user already has as many reports queued as they are allowed"""
+
+
+def max_workers():
+    return getattr(settings, 'REPORT_WORKERS', 2)
+
+
+def max_jobs_per_user():
+    return getattr(settings, 'REPORT_JOBS_PER_USER', 3)
+
+
+def max_attempts():
+    return getattr(settings, 'REPORT_JOB_MAX_ATTEMPTS', 3)
+
+
+def stale_after():
+    return datetime.timedelta(seconds=getattr(settings, 'REPORT_JOB_STALE_SECONDS', 900))
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def enqueue(report_type, export_format, parameters, user, title=None):
+    """
+    Find or queue the report for a request.
+
+    Returns (report, created). When an identical report (same type, format,
+    parameters and underlying data) is already generated or on its way, that
+    one is returned with created False. Otherwise a new report is created
+    with an empty file that a worker fills in. Raises JobLimitError when
+    `user` already has REPORT_JOBS_PER_USER reports waiting or running.
+    """
+    if report_type not in exports.REPORT_TYPES:
+        raise ValueError(f"Cannot generate {report_type} reports")
+    if export_format not in exports.CONTENT_TYPES:
+        raise ValueError(f"Reports cannot be generated as '{export_format}'")
+
+    key = report_cache.cache_key(report_type, export_format, parameters)
+    with transaction.atomic():
+        existing = report_cache.find(key)
+        if existing is not None:
+            return existing, False
+
+        pending = ReportJob.objects.filter(report__created_by=user, status__in=('queued', 'running')).count()
+        if pending >= max_jobs_per_user():
+            raise JobLimitError(f"You already have {pending} reports being generated. "
+                                f"Please wait for one to finish.")
+
+        report = Report.objects.create(
+            title=title or dict(Report.REPORT_TYPE_CHOICES)[report_type],
+            report_type=report_type,
+            format=export_format,
+            parameters=parameters,
+            created_by=user,
+            cache_key=key,
+        )
+        ReportJob.objects.create(report=report)
+    return report, True
+
+
+def claim_next(worker):
+    """
+    Mark the oldest queued job as running for `worker` and return it, or None.
+
+    The claim is a conditional UPDATE on the job's status, so when several
+    dispatchers race for the same row exactly one of them gets it. This
+    needs no row locks and works the same on SQLite.
+    """
+    while True:
+        candidate = ReportJob.objects.filter(status='queued').order_by('created_at', 'pk').values_list(
+            'pk', flat=True).first()
+        if candidate is None:
+            return None
+
+        now = timezone.now()
+        claimed = ReportJob.objects.filter(pk=candidate, status='queued').update(
+            status='running', claimed_by=worker, started_at=now, heartbeat_at=now, attempts=F('attempts') + 1,
+            rows_total=None, rows_written=0, error='',
+        )
+        if claimed:
+            return ReportJob.objects.select_related('report').get(pk=candidate)
+
+
+def requeue_stale():
+    """
+    Hand back jobs whose worker stopped sending heartbeats, e.g. after a crash.
+
+    Jobs that have used up their attempts are failed instead. Returns the
+    number of jobs touched.
+    """
+    cutoff = timezone.now() - stale_after()
+    stale = ReportJob.objects.filter(status='running', heartbeat_at__lt=cutoff)
+    failed = stale.filter(attempts__gte=max_attempts()).update(
+        status='failed', finished_at=timezone.now(), error='The worker stopped responding.',
+    )
+    requeued = stale.filter(attempts__lt=max_attempts()).update(status='queued', claimed_by='')
+    return failed + requeued
+
+
+class _Progress:
+    """Counts rows on their way to the file and writes the count back at most once per interval"""
+
+    def __init__(self, job_id, rows):
+        self.job_id = job_id
+        self.rows = rows
+        self.count = 0
+        self.saved_at = time.monotonic()
+
+    def __iter__(self):
+        for row in self.rows:
+            self.count += 1
+            yield row
+            if time.monotonic() - self.saved_at >= PROGRESS_INTERVAL:
+                self.save()
+
+    def save(self):
+        ReportJob.objects.filter(pk=self.job_id).update(rows_written=self.count, heartbeat_at=timezone.now())
+        self.saved_at = time.monotonic()
+
+
+def run_job(job_id):
+    """
+    Generate a claimed job's report file. Runs inside a worker process.
+
+    The export is streamed into a temporary file and then copied into
+    Report.file, so memory use does not grow with the report. Failures
+    are recorded on the job; one that still has attempts left is queued
+    again. Returns the job's final status.
+    """
+    job = ReportJob.objects.select_related('report').get(pk=job_id)
+    report = job.report
+    parameters = report.parameters or {}
+
+    try:
+        total = exports.report_size(report.report_type, parameters)
+        ReportJob.objects.filter(pk=job.pk).update(rows_total=total)
+
+        header, rows = exports.report_rows(report.report_type, parameters)
+        progress = _Progress(job.pk, rows)
+        with tempfile.TemporaryFile() as output:
+            for chunk in exports.stream(header, progress, report.format):
+                output.write(chunk)
+            output.seek(0)
+            extension = exports.EXTENSIONS[report.format]
+            name = f"{report.report_type}-{report.pk}-{timezone.now():%Y%m%d-%H%M%S}.{extension}"
+            report.file.save(name, File(output), save=False)
+        Report.objects.filter(pk=report.pk).update(file=report.file.name)
+    except Exception as e:
+        status = 'queued' if job.attempts < max_attempts() else 'failed'
+        ReportJob.objects.filter(pk=job.pk).update(
+            status=status, error=f'{type(e).__name__}: {e}', claimed_by='',
+            finished_at=timezone.now() if status == 'failed' else None,
+        )
+        return status
+
+    ReportJob.objects.filter(pk=job.pk).update(
+        status='done', rows_written=progress.count, finished_at=timezone.now(), heartbeat_at=timezone.now(),
+    )
+    return 'done'
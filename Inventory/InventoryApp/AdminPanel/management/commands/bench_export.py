@@ -0,0 +1,73 @@
+import os
+import resource
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from AdminPanel import exports
+from inventory.models import Branch
+from Sales.models import Sale
+
+
+def _rss_mb():
+    """Current resident set size, falling back to the peak where /proc is unavailable"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Command(BaseCommand):
+    help = 'Stream a large sales export as CSV and XLSX and check memory stays under a fixed ceiling'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000000, help='Sales to synthesise and export')
+        parser.add_argument('--max-growth', type=float, default=64,
+                            help='MB resident memory may grow by while an export streams')
+
+    def handle(self, *args, **options):
+        total = options['rows']
+        tag = uuid.uuid4().hex[:8]
+        failures = []
+
+        # Fixtures live in a transaction that is rolled back at the end
+        with transaction.atomic():
+            branch = Branch.objects.create(name=f'bench-{tag}', address='-', phone_number='-')
+            started = time.perf_counter()
+            today = branch.today()
+            for first in range(0, total, 20000):
+                Sale.objects.bulk_create([
+                    Sale(invoice_number=f'BENCH-{tag}-{n}', branch=branch, business_date=today, payment_method='cash',
+                         subtotal=n % 997, total_amount=n % 997, is_completed=True)
+                    for n in range(first, min(first + 20000, total))
+                ])
+            self.stdout.write(f'Sales:            {total}')
+            self.stdout.write(f'Synthesised in:   {time.perf_counter() - started:.1f} s')
+
+            sales = Sale.objects.filter(branch=branch).order_by('pk')
+            for export_format in ('csv', 'excel'):
+                response = exports.streaming_response(exports.SALE_HEADER, exports.sale_rows(sales),
+                                                      export_format, 'bench')
+                baseline = peak = _rss_mb()
+                size = 0
+                started = time.perf_counter()
+                for count, chunk in enumerate(response.streaming_content):
+                    size += len(chunk)
+                    if count % 100 == 0:
+                        peak = max(peak, _rss_mb())
+                elapsed = time.perf_counter() - started
+                growth = max(peak, _rss_mb()) - baseline
+
+                self.stdout.write(f'{export_format.upper() + ":":<18}{elapsed:.1f} s, {size / 2 ** 20:.0f} MB written, '
+                                  f'{total / elapsed:,.0f} rows/s, RSS +{growth:.1f} MB')
+                if growth > options['max_growth']:
+                    failures.append(f'{export_format} grew RSS by {growth:.1f} MB')
+
+            transaction.set_rollback(True)
+
+        if failures:
+            raise CommandError('; '.join(failures) + f' (ceiling {options["max_growth"]:.0f} MB)')
+        self.stdout.write(self.style.SUCCESS(f'Both exports stayed within +{options["max_growth"]:.0f} MB'))
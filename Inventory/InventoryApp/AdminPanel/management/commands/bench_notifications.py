@@ -0,0 +1,139 @@
+import datetime
+import os
+import socketserver
+import tempfile
+import threading
+import time
+import uuid
+
+from django.core import mail
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from AdminPanel import notifications
+from AdminPanel.models import Notification
+from CustomUser.models import CustomUser
+
+
+class _SMTPSink(socketserver.StreamRequestHandler):
+    """Just enough of SMTP to accept and discard mail, so the bench pays for real sessions"""
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.server.sessions += 1
+        self.reply('220 bench ESMTP')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command in (b'EHLO', b'HELO'):
+                self.reply('250 bench')
+            elif command == b'DATA':
+                self.reply('354 go ahead')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                self.server.messages += 1
+                self.reply('250 queued')
+            elif command == b'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('250 ok')
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    sessions = 0
+    messages = 0
+
+
+class Command(BaseCommand):
+    help = 'Measure notification delivery throughput against a local SMTP sink and the file SMS backend'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=100000, help='Notifications to queue and deliver')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--recipients', type=int, default=200)
+        parser.add_argument('--sample', type=int, default=1000,
+                            help='Emails the connection-per-message baseline sends')
+
+    def handle(self, *args, **options):
+        total = options['count']
+        tag = uuid.uuid4().hex[:8]
+        server = _Server(('127.0.0.1', 0), _SMTPSink)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        outbox = tempfile.NamedTemporaryFile(suffix='.jsonl', delete=False)
+        outbox.close()
+
+        overrides = override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST='127.0.0.1', EMAIL_PORT=server.server_address[1], EMAIL_USE_TLS=False,
+            EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='',
+            SMS_BACKEND='AdminPanel.sms.FileBackend', SMS_FILE_PATH=outbox.name,
+        )
+        try:
+            # Fixtures live in a transaction that is rolled back at the end
+            with overrides, transaction.atomic():
+                self._run(tag, total, server, outbox.name, options)
+                transaction.set_rollback(True)
+        finally:
+            server.shutdown()
+            server.server_close()
+            os.unlink(outbox.name)
+
+    def _run(self, tag, total, server, outbox, options):
+        # Hold back real pending notifications so only the bench's are delivered; rolled back afterwards
+        Notification.objects.filter(status='pending').update(
+            next_attempt_at=timezone.now() + datetime.timedelta(days=365))
+        recipients = CustomUser.objects.bulk_create([
+            CustomUser(username=f'bench-{tag}-{n}', email=f'bench-{tag}-{n}@example.com',
+                       phone_number=f'0803{n:07d}')
+            for n in range(options['recipients'])
+        ])
+        methods = ('email', 'email', 'sms', 'both')
+        for first in range(0, total, 20000):
+            Notification.objects.bulk_create([
+                Notification(notification_type='system', title=f'Bench notification {n}',
+                             message='Stock levels changed at your branch.',
+                             recipient=recipients[n % len(recipients)], delivery_method=methods[n % len(methods)])
+                for n in range(first, min(first + 20000, total))
+            ])
+        self.stdout.write(f'Notifications:    {total}')
+
+        started = time.perf_counter()
+        sent = batches = 0
+        while True:
+            claimed, delivered, retrying, failed = notifications.send_pending(f'bench-{tag}', options['batch_size'])
+            if not claimed:
+                break
+            if retrying or failed:
+                raise CommandError(f'{retrying + failed} notifications were not delivered')
+            sent += delivered
+            batches += 1
+        elapsed = time.perf_counter() - started
+
+        with open(outbox) as texts:
+            text_count = sum(1 for _ in texts)
+        self.stdout.write(f'Delivered in:     {elapsed:.1f} s, {sent / elapsed:,.0f} notifications/s')
+        self.stdout.write(f'Batches:          {batches}, {server.sessions} SMTP sessions')
+        self.stdout.write(f'Emails / texts:   {server.messages} / {text_count}')
+        if sent != total:
+            raise CommandError(f'Expected {total} delivered, got {sent}')
+
+        # Baseline: a new SMTP session for every message, as a naive send_mail() loop does
+        sample = options['sample']
+        started = time.perf_counter()
+        for n in range(sample):
+            mail.EmailMessage('Bench', 'Baseline', to=[recipients[n % len(recipients)].email]).send()
+        per_message = (time.perf_counter() - started) / sample
+        emails = server.messages - sample
+        self.stdout.write(f'Session per mail: {1 / per_message:,.0f} emails/s (from {sample} emails)')
+        self.stdout.write(self.style.SUCCESS(
+            f'{total} notifications delivered at {sent / elapsed:,.0f}/s; '
+            f'{emails} emails over {server.sessions - sample} SMTP sessions'))
@@ -0,0 +1,102 @@
+import random
+import resource
+import time
+import uuid
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from AdminPanel import profit
+from inventory.models import Branch, Brand, Category, Product
+from Sales.models import Sale, SaleItem
+
+
+class Command(BaseCommand):
+    help = 'Time the vectorised profit computation over millions of sale lines against a per-object loop'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, default=5000000, help='Sale lines to synthesise')
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--lines-per-sale', type=int, default=10)
+        parser.add_argument('--sample', type=int, default=100000, help='Lines the per-object baseline reads')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def _synthesise(self, tag, options, rng):
+        category = Category.objects.create(name=f'bench-{tag}')
+        brands = Brand.objects.bulk_create([Brand(name=f'bench-{tag}-{i}') for i in range(20)])
+        branch = Branch.objects.create(name=f'bench-{tag}', address='-', phone_number='-')
+        products = Product.objects.bulk_create([
+            Product(product_type='accessory', name=f'Bench {tag} #{i}', sku=f'BENCH-{tag}-{i}',
+                    category=category, brand=brands[i % len(brands)],
+                    cost_price=Decimal(rng.randint(100, 50000)) / 100, selling_price=1)
+            for i in range(options['products'])
+        ])
+
+        per_sale = options['lines_per_sale']
+        sale_count = -(-options['lines'] // per_sale)
+        written = 0
+        today = branch.today()
+        for first in range(0, sale_count, 10000):
+            sales = Sale.objects.bulk_create([
+                Sale(invoice_number=f'BENCH-{tag}-{n}', branch=branch, business_date=today, is_completed=True)
+                for n in range(first, min(first + 10000, sale_count))
+            ])
+            items = []
+            for sale in sales:
+                for _ in range(min(per_sale, options['lines'] - written)):
+                    product = rng.choice(products)
+                    quantity = rng.randint(1, 3)
+                    unit_price = product.cost_price * Decimal('1.3')
+                    items.append(SaleItem(
+                        sale=sale, product=product, quantity=quantity, unit_price=unit_price,
+                        unit_cost=product.cost_price, total_price=unit_price * quantity,
+                    ))
+                    written += 1
+            SaleItem.objects.bulk_create(items, batch_size=5000)
+            self.stdout.write(f'  {written} lines', ending='\r')
+        self.stdout.write('')
+        return branch
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        tag = uuid.uuid4().hex[:8]
+
+        # Everything runs in one transaction that is rolled back, which is far
+        # cheaper than deleting millions of lines through the ORM afterwards
+        with transaction.atomic():
+            started = time.perf_counter()
+            branch = self._synthesise(tag, options, rng)
+            self.stdout.write(f'Sale lines:       {options["lines"]}')
+            self.stdout.write(f'Synthesised in:   {time.perf_counter() - started:.1f} s')
+
+            timings = {}
+            for group_by in ('product', 'brand'):
+                rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                started = time.perf_counter()
+                summary = profit.profit_by(group_by, branch=branch)
+                timings[group_by] = time.perf_counter() - started
+                rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+                self.stdout.write(f'By {group_by + ":":<14}{timings[group_by]:6.2f} s  '
+                                  f'({len(summary["rows"])} rows, peak RSS +{rss_growth / 1024:.0f} MB)')
+
+            totals = summary['totals']
+            if totals['lines'] != options['lines']:
+                raise CommandError(f'Expected {options["lines"]} lines, summed {totals["lines"]}')
+
+            # Baseline: a Python loop over model instances, as a report joining to the product would do
+            sample = options['sample']
+            started = time.perf_counter()
+            revenue = cost = Decimal('0')
+            for item in SaleItem.objects.filter(sale__branch=branch).select_related('product')[:sample]:
+                revenue += item.total_price
+                cost += item.quantity * item.product.cost_price
+            baseline = (time.perf_counter() - started) * options['lines'] / sample
+            self.stdout.write(f'Per-object loop:  {baseline:6.2f} s (extrapolated from {sample} lines)')
+            self.stdout.write(f'Gross profit:     {totals["profit"]} on {totals["revenue"]} '
+                              f'({totals["margin"]}% margin)')
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Vectorised profit by product is {baseline / timings["product"]:.1f}x faster than the loop'))
@@ -0,0 +1,105 @@
+import datetime
+import tempfile
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from AdminPanel import analytics
+
+
+class Command(BaseCommand):
+    help = 'Time slice and rollup queries against a synthetic two-year sales analytics store'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=730, help='Days of history to synthesise')
+        parser.add_argument('--branches', type=int, default=20)
+        parser.add_argument('--products', type=int, default=5000)
+        parser.add_argument('--lines', type=int, default=150, help='Products sold per branch per day')
+        parser.add_argument('--budget', type=float, default=1.0, help='Seconds any single query may take')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def _synthesise(self, path, options):
+        """Write fact rows straight to Parquet; the OLTP tables are never touched"""
+        np, pa = analytics.np, analytics.pa
+        rng = np.random.default_rng(options['seed'])
+        days, branches, products, lines = options['days'], options['branches'], options['products'], options['lines']
+        categories, brands = 12, 40
+
+        first = (datetime.date.today() - datetime.timedelta(days=days - 1) - analytics.EPOCH).days
+        rows = days * branches * lines
+        day = np.repeat(np.arange(first, first + days, dtype=np.int32), branches * lines)
+        branch = np.tile(np.repeat(np.arange(1, branches + 1, dtype=np.int32), lines), days)
+        # A long tail: most lines come from a few hundred popular products
+        product = np.minimum(rng.zipf(1.3, rows), products).astype(np.int32)
+        product_category = rng.integers(1, categories + 1, products + 1, dtype=np.int32)
+        product_brand = rng.integers(1, brands + 1, products + 1, dtype=np.int32)
+        quantity = rng.integers(1, 6, rows)
+        revenue = quantity * rng.integers(500, 150000, rows) * 100
+
+        def labels(ids, count, prefix):
+            names = pa.array([f'{prefix} {n}' for n in range(count + 1)])
+            return pa.DictionaryArray.from_arrays(pa.array(ids, pa.int32()), names)
+
+        schema = analytics.export_schema()
+        batch = pa.RecordBatch.from_arrays([
+            pa.array(day, pa.int32()).cast(pa.date32()),
+            pa.array(branch),
+            pa.array(product),
+            pa.array(product_category[product]),
+            pa.array(product_brand[product]),
+            pa.array(quantity, pa.int64()),
+            pa.array(revenue, pa.int64()),
+            pa.array(rng.integers(1, 4, rows), pa.int64()),
+            labels(branch, branches, 'Branch'),
+            labels(product, products, 'Product'),
+            labels(product_category[product], categories, 'Category'),
+            labels(product_brand[product], brands, 'Brand'),
+        ], schema=schema)
+        analytics.write_parquet(path, [batch], schema)
+        return rows
+
+    def handle(self, *args, **options):
+        if not analytics.is_available():
+            raise CommandError('numpy, pandas and pyarrow are required for the analytics store')
+
+        today = datetime.date.today()
+        quarter_ago = today - datetime.timedelta(days=90)
+        year_ago = today - datetime.timedelta(days=365)
+        queries = [
+            ('Total by month', dict(grain='month')),
+            ('By branch', dict(group_by=['branch'])),
+            ('Brand by month', dict(group_by=['brand'], grain='month')),
+            ('Category, 3 branches, 90 days', dict(group_by=['category'], start=quarter_ago,
+                                                   filters={'branch': [1, 2, 3]})),
+            ('Top 50 products', dict(group_by=['product'], limit=50)),
+            ('Product x branch by week, 1 brand', dict(group_by=['product', 'branch'], grain='week',
+                                                       filters={'brand': [7]})),
+            ('Branch x category by day, 1 year', dict(group_by=['branch', 'category'], grain='day',
+                                                      start=year_ago)),
+        ]
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'sales_facts.parquet'
+            started = time.perf_counter()
+            rows = self._synthesise(path, options)
+            self.stdout.write(f'Fact rows:        {rows}')
+            self.stdout.write(f'Store size:       {path.stat().st_size / 1e6:.1f} MB')
+            self.stdout.write(f'Synthesised in:   {time.perf_counter() - started:.2f} s')
+
+            started = time.perf_counter()
+            cube = analytics.get_cube(path)
+            self.stdout.write(f'Cold load:        {time.perf_counter() - started:.2f} s')
+
+            slowest = 0
+            for label, query in queries:
+                started = time.perf_counter()
+                result = cube.query(**query)
+                elapsed = time.perf_counter() - started
+                slowest = max(slowest, elapsed)
+                self.stdout.write(f'{label + ":":<38}{elapsed * 1000:8.1f} ms  ({len(result)} rows)')
+
+        if slowest >= options['budget']:
+            raise CommandError(f'Slowest query took {slowest:.2f} s, over the {options["budget"]:.2f} s budget')
+        self.stdout.write(self.style.SUCCESS(f'All {len(queries)} queries under {options["budget"]:.2f} s '
+                                             f'(slowest {slowest * 1000:.1f} ms)'))
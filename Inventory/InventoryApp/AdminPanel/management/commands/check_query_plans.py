@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from AdminPanel import query_plans
+
+
+class Command(BaseCommand):
+    help = ('Check that the hot list, dashboard and worker queries search an index, and only walk a whole one '
+            'where the query says why that is fine')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--show', action='store_true', help='Print every plan, not only the failing ones')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError(f'Query plans are checked with SQLite EXPLAIN QUERY PLAN, not {connection.vendor}')
+
+        failures = 0
+        for query in query_plans.hot_queries():
+            plan = query.plan()
+            problems = query.problems(plan)
+            if problems:
+                failures += 1
+                self.stdout.write(self.style.ERROR(f'FAIL  {query.name}'))
+                for problem in problems:
+                    self.stdout.write(f'      {problem}')
+            else:
+                self.stdout.write(f'ok    {query.name}' + (f' (scans: {query.scan})' if query.scan else ''))
+            if options['show'] or problems:
+                for step in plan:
+                    self.stdout.write(f'        | {step}')
+
+        if failures:
+            raise CommandError(f'{failures} queries would scan or sort more than they need')
+        self.stdout.write(self.style.SUCCESS('Every hot query uses an index'))
@@ -0,0 +1,25 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from AdminPanel import report_cache
+
+
+class Command(BaseCommand):
+    help = 'Delete generated reports that are stale, or that push report storage over its size limit'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age-days', type=float,
+                            help='Remove reports unused for this long (default REPORT_CACHE_MAX_AGE_DAYS)')
+        parser.add_argument('--max-mb', type=float,
+                            help='Then remove the least recently used until this much is left (default REPORT_CACHE_MAX_MB)')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be removed without deleting')
+
+    def handle(self, *args, **options):
+        age = datetime.timedelta(days=options['max_age_days']) if options['max_age_days'] is not None else None
+        limit = int(options['max_mb'] * 2 ** 20) if options['max_mb'] is not None else None
+
+        removed, freed = report_cache.evict(age, limit, dry_run=options['dry_run'])
+
+        verb = 'Would remove' if options['dry_run'] else 'Removed'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {removed} reports, {freed / 2 ** 20:.1f} MB'))
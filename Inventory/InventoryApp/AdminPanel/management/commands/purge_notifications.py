@@ -0,0 +1,23 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+
+from AdminPanel import notifications
+
+
+class Command(BaseCommand):
+    help = 'Delete old sent and failed notifications in small batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float,
+                            help='Keep notifications newer than this (default NOTIFICATION_RETENTION_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=notifications.PURGE_BATCH)
+
+    def handle(self, *args, **options):
+        older_than = datetime.timedelta(days=options['days']) if options['days'] is not None else None
+
+        started = time.perf_counter()
+        deleted = notifications.purge(older_than, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {deleted} notifications in {time.perf_counter() - started:.1f} s'))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from AdminPanel import analytics
+
+
+class Command(BaseCommand):
+    help = 'Fold new and edited sales into the analytics fact table and rewrite the Parquet store'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rebuild every day instead of only changed ones')
+        parser.add_argument('--trailing-days', type=int, default=2,
+                            help='Most recent days always recomputed, to pick up same-day cancellations')
+        parser.add_argument('--no-export', action='store_true', help='Update the fact table but skip the export')
+
+    def handle(self, *args, **options):
+        refresh = analytics.refresh_sales_facts(
+            full=options['full'],
+            trailing_days=options['trailing_days'],
+            export=not options['no_export'],
+        )
+
+        self.stdout.write(f'Days refreshed:   {refresh.days_refreshed}')
+        self.stdout.write(f'Fact rows:        {refresh.rows_written}')
+        self.stdout.write(f'Watermark:        {refresh.watermark:%Y-%m-%d %H:%M:%S}')
+        if refresh.export_path:
+            self.stdout.write(f'Exported to:      {refresh.export_path}')
+        self.stdout.write(self.style.SUCCESS('Sales facts refreshed'))
@@ -0,0 +1,75 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from AdminPanel import jobs
+
+
+def _start_worker():
+    """Set up Django in a pool process and drop any connections inherited from the dispatcher"""
+    django.setup()
+    connections.close_all()
+
+
+def _run(job_id):
+    try:
+        return jobs.run_job(job_id)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Generate queued reports in a pool of worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, help='Reports generated at once (default REPORT_WORKERS)')
+        parser.add_argument('--poll', type=float, default=2.0, help='Seconds between checks of an idle queue')
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        workers = options['workers'] or jobs.max_workers()
+        name = jobs.worker_name()
+        running = {}
+
+        # Forked pool processes must not share the dispatcher's database connection
+        connections.close_all()
+        self.stdout.write(f'Report workers:   {workers} ({name})')
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_start_worker) as pool:
+            try:
+                while True:
+                    requeued = jobs.requeue_stale()
+                    if requeued:
+                        self.stdout.write(f'Recovered {requeued} stalled jobs')
+
+                    # Only claim what there is a free process for, so queued jobs stay claimable elsewhere
+                    while len(running) < workers:
+                        job = jobs.claim_next(name)
+                        if job is None:
+                            break
+                        self.stdout.write(f'Started job #{job.pk}: {job.report.title}')
+                        running[pool.submit(_run, job.pk)] = job.pk
+
+                    if not running:
+                        if options['once']:
+                            break
+                        time.sleep(options['poll'])
+                        continue
+
+                    done, _ = wait(running, timeout=options['poll'], return_when=FIRST_COMPLETED)
+                    for future in done:
+                        job_id = running.pop(future)
+                        try:
+                            status = future.result()
+                        except Exception as e:
+                            # The process itself died; the heartbeat check will hand the job back
+                            self.stderr.write(f'Job #{job_id} crashed its worker: {e}')
+                        else:
+                            self.stdout.write(f'Finished job #{job_id}: {status}')
+            except KeyboardInterrupt:
+                self.stdout.write('Stopping; waiting for running reports to finish')
+
+        self.stdout.write(self.style.SUCCESS('Report workers stopped'))
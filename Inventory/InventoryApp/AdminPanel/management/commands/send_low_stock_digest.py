@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from AdminPanel import alerts
+
+
+class Command(BaseCommand):
+    help = 'Queue one low stock digest per branch manager covering products that went low since the last run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rescan', action='store_true',
+                            help='Check every inventory row first, not only those changed since the last digest')
+
+    def handle(self, *args, **options):
+        if options['rescan']:
+            went_low, recovered = alerts.rescan()
+            self.stdout.write(f'Rescanned:        {went_low} went low, {recovered} recovered')
+
+        sent = alerts.send_digests()
+        self.stdout.write(self.style.SUCCESS(f'Queued {sent} low stock digests'))
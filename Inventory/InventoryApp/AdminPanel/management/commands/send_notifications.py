@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from AdminPanel import jobs, notifications
+
+
+class Command(BaseCommand):
+    help = 'Deliver pending email and SMS notifications in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Notifications per batch (default NOTIFICATION_BATCH_SIZE)')
+        parser.add_argument('--poll', type=float, default=5.0, help='Seconds between checks of an empty queue')
+        parser.add_argument('--once', action='store_true', help='Exit once nothing is due')
+
+    def handle(self, *args, **options):
+        worker = jobs.worker_name()
+        totals = [0, 0, 0]
+        self.stdout.write(f'Notification worker {worker}')
+
+        try:
+            while True:
+                claimed, *outcome = notifications.send_pending(worker, options['batch_size'])
+                if not claimed:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll'])
+                    continue
+                totals = [total + count for total, count in zip(totals, outcome)]
+                sent, retrying, failed = outcome
+                self.stdout.write(f'Batch of {claimed}: {sent} sent, {retrying} to retry, {failed} failed')
+        except KeyboardInterrupt:
+            pass
+
+        sent, retrying, failed = totals
+        self.stdout.write(self.style.SUCCESS(f'Sent {sent}, {retrying} queued for retry, {failed} failed'))
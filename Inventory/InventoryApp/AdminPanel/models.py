@@ -1,12 +1,14 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Q
 from django.conf import settings
 from django.core.validators import MinValueValidator
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.utils import timezone
 import uuid
 
-from inventory.models import Inventory, Purchase
+from inventory.models import Inventory
+from inventory.stock import stock_changed
 
 
 # notifications/models.py
@@ -42,10 +44,48 @@ class Notification(models.Model):
     sent_at = models.DateTimeField(blank=True, null=True)
     related_object_type = models.CharField(max_length=50, blank=True, null=True)  # ContentType reference
     related_object_id = models.PositiveIntegerField(blank=True, null=True)  # Object ID
+    # Delivery bookkeeping for the send_notifications worker
+    claimed_by = models.CharField(max_length=100, blank=True)  # host:pid plus batch token while being sent
+    claimed_at = models.DateTimeField(blank=True, null=True)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(blank=True, null=True)  # Unset means as soon as possible
+    delivered_via = models.CharField(max_length=20, blank=True)  # Channels already sent, e.g. "email,sms"
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            # Pending rows in id order, so the worker claims the oldest without sorting the queue
+            models.Index(fields=['status']),
+            models.Index(fields=['recipient', 'status']),
+        ]
 
     def __str__(self):
         return f"{self.title} - {self.recipient.get_full_name()} ({self.status})"
 
+    def channels(self):
+        """Channels this notification goes out on, in delivery order"""
+        return ['email', 'sms'] if self.delivery_method == 'both' else [self.delivery_method]
+
+
+class LowStockAlert(models.Model):
+    """Low stock state of one inventory row, written only when the row crosses its reorder level"""
+    inventory = models.OneToOneField(Inventory, on_delete=models.CASCADE, related_name='low_stock_alert')
+    is_low = models.BooleanField(default=False)
+    crossed_at = models.DateTimeField(blank=True, null=True)  # When it last fell to the reorder level
+    cleared_at = models.DateTimeField(blank=True, null=True)
+    notified_at = models.DateTimeField(blank=True, null=True)  # Digest that reported the current crossing
+    times_crossed = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # The digest's worklist; a bare boolean filter cannot use an ordinary index
+            models.Index(fields=['inventory'], condition=Q(is_low=True, notified_at__isnull=True),
+                         name='lowstockalert_undigested'),
+        ]
+
+    def __str__(self):
+        return f"Inventory #{self.inventory_id} ({'low' if self.is_low else 'ok'})"
+
 
 # reports/models.py
 class Report(models.Model):
@@ -72,46 +112,151 @@ class Report(models.Model):
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True,
                                    related_name='reports')
     created_at = models.DateTimeField(auto_now_add=True)
+    # Hash of type, format, parameters and data watermark; equal keys mean an identical file
+    cache_key = models.CharField(max_length=64, blank=True, db_index=True)
+    last_used_at = models.DateTimeField(default=timezone.now)  # Bumped on reuse and download, for eviction
 
     def __str__(self):
         return f"{self.title} ({self.created_at.strftime('%Y-%m-%d')})"
 
 
+class ReportJob(models.Model):
+    """Queued generation of a report file, picked up by the run_report_workers processes"""
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+
+    report = models.OneToOneField(Report, on_delete=models.CASCADE, related_name='job')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued', db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    claimed_by = models.CharField(max_length=100, blank=True)  # host:pid of the dispatcher running it
+    started_at = models.DateTimeField(blank=True, null=True)
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    attempts = models.PositiveIntegerField(default=0)
+    rows_total = models.PositiveIntegerField(blank=True, null=True)
+    rows_written = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    def __str__(self):
+        return f"{self.report.title} ({self.status})"
+
+    @property
+    def progress(self):
+        """Percentage complete, or None while the size of the report is unknown"""
+        if self.status == 'done':
+            return 100
+        if not self.rows_total:
+            return None
+        return min(99, self.rows_written * 100 // self.rows_total)
+
+
+# analytics/models.py
+class SalesFact(models.Model):
+    """Units and revenue sold per business day, branch and product, denormalised for the analytics export"""
+    day = models.DateField()
+    branch = models.ForeignKey('inventory.Branch', on_delete=models.CASCADE, related_name='+')
+    product = models.ForeignKey('inventory.Product', on_delete=models.CASCADE, related_name='+')
+    category = models.ForeignKey('inventory.Category', on_delete=models.CASCADE, related_name='+')
+    brand = models.ForeignKey('inventory.Brand', on_delete=models.CASCADE, related_name='+')
+    quantity = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    line_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('day', 'branch', 'product')
+
+    def __str__(self):
+        return f"{self.day} {self.branch_id}/{self.product_id}: {self.quantity}"
+
+
+class SalesFactRefresh(models.Model):
+    """One run of the sales fact refresh; the latest watermark decides what the next run re-reads"""
+    started_at = models.DateTimeField(default=timezone.now)
+    watermark = models.DateTimeField()  # Latest Sale.updated_at folded into the facts
+    full = models.BooleanField(default=False)
+    days_refreshed = models.IntegerField(default=0)
+    rows_written = models.IntegerField(default=0)
+    export_path = models.CharField(max_length=500, blank=True)
+
+    class Meta:
+        get_latest_by = 'started_at'
+
+    def __str__(self):
+        return f"Refresh {self.started_at:%Y-%m-%d %H:%M} ({self.days_refreshed} days)"
+
+
+class SalesFactDirtyDay(models.Model):
+    """A trading day that lost a completed sale, which leaves no edited row for the incremental refresh to find"""
+    day = models.DateField(unique=True)
+    marked_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.day} (since {self.marked_at:%Y-%m-%d %H:%M})"
+
+
+class DataVersion(models.Model):
+    """Changes to a table that leave no newer timestamp behind, counted so the report cache watermark sees them"""
+    name = models.CharField(max_length=50, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name}: {self.version}"
+
+    @classmethod
+    def bump(cls, name):
+        counter = cls.objects.filter(name=name)
+        with transaction.atomic():
+            if counter.update(version=F('version') + 1):
+                return
+            try:
+                with transaction.atomic():
+                    cls.objects.create(name=name, version=1)
+            except IntegrityError:
+                # Another worker counted the first change at the same moment
+                counter.update(version=F('version') + 1)
+
+
 # Signal handlers
+@receiver(post_delete, sender='Sales.Sale')
+def mark_sales_fact_day(sender, instance, **kwargs):
+    """Queue the trading day of a deleted completed sale for the next sales fact refresh"""
+    if instance.is_completed:
+        # Re-marking a queued day moves marked_at on, so a refresh already running leaves it queued
+        SalesFactDirtyDay.objects.bulk_create([SalesFactDirtyDay(day=instance.business_date)],
+                                              update_conflicts=True, unique_fields=['day'],
+                                              update_fields=['marked_at'])
+
+
+@receiver(stock_changed)
+def queue_low_stock_check(sender, branch_id, product_ids, **kwargs):
+    """Look for rows that crossed their reorder level once the stock change is committed"""
+    from . import alerts
+
+    def check_stock():
+        alerts.check_stock(branch_id, product_ids)
+
+    # robust=True logs a failed check by the callback's __qualname__, which a functools.partial lacks
+    transaction.on_commit(check_stock, robust=True)
+
+
+@receiver(post_save, sender=Inventory)
+def queue_low_stock_check_on_save(sender, instance, raw=False, **kwargs):
+    """Direct edits, including changes to the reorder level, can cross the threshold too"""
+    if not raw:
+        queue_low_stock_check(sender, instance.branch_id, [instance.product_id])
+
+
+# Deleting these rows, or editing a reorder level in place, changes reports without moving any updated_at
+@receiver(post_delete, sender='Sales.Sale')
+@receiver(post_delete, sender='Sales.Customer')
+@receiver(post_delete, sender='inventory.Purchase')
+@receiver(post_delete, sender=Inventory)
 @receiver(post_save, sender=Inventory)
-def check_low_stock(sender, instance, **kwargs):
-    """Send notification when inventory is low"""
-    if instance.is_low_stock():
-        # Find branch manager and admin users
-        recipients = []
-        if instance.branch.manager:
-            recipients.append(instance.branch.manager)
-
-        # Create notification for each recipient
-        for recipient in recipients:
-            Notification.objects.create(
-                notification_type='low_stock',
-                title=f'Low Stock Alert: {instance.product.name}',
-                message=f'The inventory for {instance.product.name} at {instance.branch.name} is low. '
-                        f'Current quantity: {instance.quantity}, Reorder level: {instance.reorder_level}',
-                recipient=recipient,
-                delivery_method='both',
-                related_object_type='inventory',
-                related_object_id=instance.id
-            )
-
-
-@receiver(post_save, sender=Purchase)
-def update_inventory_on_purchase_received(sender, instance, created, **kwargs):
-    """Update inventory when a purchase is marked as received"""
-    if instance.status == 'received':
-        # Update inventory quantities for each item in the purchase
-        for item in instance.items.all():
-            inventory, created = Inventory.objects.get_or_create(
-                product=item.product,
-                branch=instance.branch,
-                defaults={'quantity': 0}
-            )
-            inventory.quantity += item.quantity
-            inventory.last_restock_date = timezone.now()
-            inventory.save()
\ No newline at end of file
+def count_report_source_change(sender, raw=False, **kwargs):
+    """Move the report cache watermark on for a change it cannot see from timestamps"""
+    if not raw:
+        DataVersion.bump(sender._meta.label)
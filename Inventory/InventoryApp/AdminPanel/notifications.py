@@ -0,0 +1,205 @@
+import datetime
+import uuid
+
+from django.conf import settings
+from django.core import mail
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import sms
+from .jobs import worker_name
+from .models import Notification
+
+PURGE_BATCH = 5000
+
+
+def retention():
+    return datetime.timedelta(days=getattr(settings, 'NOTIFICATION_RETENTION_DAYS', 90))
+
+
+def batch_size():
+    return getattr(settings, 'NOTIFICATION_BATCH_SIZE', 200)
+
+
+def max_attempts():
+    return getattr(settings, 'NOTIFICATION_MAX_ATTEMPTS', 5)
+
+
+def claim_timeout():
+    return datetime.timedelta(seconds=getattr(settings, 'NOTIFICATION_CLAIM_SECONDS', 300))
+
+
+def retry_delay(attempts):
+    """Exponential backoff: NOTIFICATION_RETRY_SECONDS after the first failure, doubling up to an hour"""
+    base = getattr(settings, 'NOTIFICATION_RETRY_SECONDS', 60)
+    return datetime.timedelta(seconds=min(base * 2 ** (attempts - 1), 3600))
+
+
+class Undeliverable(ValueError):
+    """Raised for a channel that can never succeed, such as a recipient without an email address"""
+
+
+def claim_batch(worker, size=None):
+    """
+    Claim up to `size` due notifications for `worker` and return them.
+
+    Rows are marked with a token unique to this batch by a conditional
+    UPDATE that skips anything another worker holds, which gives the effect
+    of SELECT ... FOR UPDATE SKIP LOCKED on SQLite as well. A claim older
+    than NOTIFICATION_CLAIM_SECONDS is treated as abandoned.
+    """
+    now = timezone.now()
+    token = f'{worker}/{uuid.uuid4().hex[:8]}'
+    claimable = Notification.objects.filter(
+        Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now),
+        Q(claimed_at__isnull=True) | Q(claimed_at__lt=now - claim_timeout()),
+        status='pending',
+    )
+    ids = list(claimable.order_by('pk').values_list('pk', flat=True)[:size or batch_size()])
+    if not ids:
+        return []
+    claimable.filter(pk__in=ids).update(claimed_by=token, claimed_at=now)
+    return list(Notification.objects.filter(pk__in=ids, claimed_by=token).select_related('recipient'))
+
+
+class _Channel:
+    """A backend connection opened on first use and kept for the rest of the batch"""
+
+    def __init__(self, get_connection, backend):
+        self.get_connection = get_connection
+        self.backend = backend
+        self.connection = None
+        self.error = None
+
+    def send(self, message):
+        if self.connection is None and self.error is None:
+            try:
+                self.connection = self.get_connection(self.backend)
+                self.connection.open()
+            except Exception as e:
+                # Every message on this channel fails the same way until the next batch
+                self.error = e
+        if self.error is not None:
+            raise self.error
+        if not self.connection.send_messages([message]):
+            raise RuntimeError('The backend did not accept the message')
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+
+
+def _message(channel, notification):
+    recipient = notification.recipient
+    if channel == 'email':
+        if not recipient.email:
+            raise Undeliverable('recipient has no email address')
+        return mail.EmailMessage(notification.title, notification.message, to=[recipient.email])
+    if not recipient.phone_number:
+        raise Undeliverable('recipient has no phone number')
+    return sms.SMSMessage(recipient.phone_number, f'{notification.title}: {notification.message}')
+
+
+def send_batch(notifications, email_backend=None, sms_backend=None):
+    """
+    Deliver claimed notifications and record the outcome of each.
+
+    One connection per channel serves the whole batch, so an SMTP session
+    is set up once rather than per message. A channel that fails is
+    retried with backoff; one already delivered is not sent again on the
+    retry. Returns (sent, retrying, failed), counting only the rows this
+    batch still held when the outcome was written.
+    """
+    token = notifications[0].claimed_by if notifications else ''
+    channels = {
+        'email': _Channel(mail.get_connection, email_backend),
+        'sms': _Channel(sms.get_connection, sms_backend),
+    }
+    results = []
+    try:
+        for notification in notifications:
+            delivered = [channel for channel in notification.delivered_via.split(',') if channel]
+            errors, skipped = [], []
+            for channel in notification.channels():
+                if channel in delivered:
+                    continue
+                try:
+                    channels[channel].send(_message(channel, notification))
+                    delivered.append(channel)
+                except Undeliverable as e:
+                    skipped.append(f'{channel}: {e}')
+                except Exception as e:
+                    errors.append(f'{channel}: {type(e).__name__}: {e}')
+            results.append((notification, delivered, errors, skipped))
+    finally:
+        for channel in channels.values():
+            channel.close()
+
+    now = timezone.now()
+    sent, retry = {}, []
+    for notification, delivered, errors, skipped in results:
+        notification.delivered_via = ','.join(delivered)
+        notification.last_error = '; '.join(errors + skipped)
+        if not errors and delivered:
+            sent.setdefault((notification.delivered_via, notification.last_error), []).append(notification.pk)
+            continue
+        notification.attempts += 1
+        if errors and notification.attempts < max_attempts():
+            notification.next_attempt_at = now + retry_delay(notification.attempts)
+        else:
+            notification.status = 'failed'
+        retry.append(notification)
+
+    # Every write is conditional on the claim token: a row whose claim timed out
+    # and was taken by another worker belongs to that worker now
+    counts = {'sent': 0, 'pending': 0, 'failed': 0}
+    with transaction.atomic():
+        # Sent rows share a handful of outcomes, so they are written one UPDATE per outcome
+        for (delivered_via, last_error), ids in sent.items():
+            counts['sent'] += Notification.objects.filter(pk__in=ids, claimed_by=token).update(
+                status='sent', sent_at=now, attempts=F('attempts') + 1, delivered_via=delivered_via,
+                last_error=last_error, claimed_by='', claimed_at=None,
+            )
+        # Failures are rare and each has its own backoff, so they are written one by one
+        for notification in retry:
+            counts[notification.status] += Notification.objects.filter(pk=notification.pk, claimed_by=token).update(
+                status=notification.status, attempts=notification.attempts,
+                next_attempt_at=notification.next_attempt_at, delivered_via=notification.delivered_via,
+                last_error=notification.last_error, claimed_by='', claimed_at=None,
+            )
+
+    return counts['sent'], counts['pending'], counts['failed']
+
+
+def send_pending(worker=None, size=None, email_backend=None, sms_backend=None):
+    """Claim and deliver one batch. Returns (claimed, sent, retrying, failed)"""
+    batch = claim_batch(worker or worker_name(), size)
+    if not batch:
+        return 0, 0, 0, 0
+    return (len(batch), *send_batch(batch, email_backend, sms_backend))
+
+
+def purge(older_than=None, batch_size=PURGE_BATCH):
+    """
+    Delete sent and failed notifications created before now - `older_than`.
+
+    Works through the table in id order, one short transaction per batch,
+    so the purge never holds a long write lock. Pending notifications are
+    kept whatever their age. Returns the number of rows deleted.
+    """
+    cutoff = timezone.now() - (older_than if older_than is not None else retention())
+    expired = Notification.objects.filter(created_at__lt=cutoff, status__in=('sent', 'failed'))
+
+    deleted = 0
+    last = 0
+    while True:
+        ids = list(expired.filter(pk__gt=last).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        with transaction.atomic():
+            deleted += Notification.objects.filter(pk__in=ids).delete()[0]
+        last = ids[-1]
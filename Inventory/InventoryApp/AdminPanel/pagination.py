@@ -0,0 +1,146 @@
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+MAX_LIMIT = 200
+
+
+class InvalidCursor(ValueError):
+    """Raised when a cursor was not issued by paginate() for this ordering"""
+
+
+def default_limit():
+    return getattr(settings, 'LIST_PAGE_SIZE', 50)
+
+
+class KeysetPage:
+    """One page of a keyset-paginated queryset, with opaque cursors for its neighbours"""
+
+    def __init__(self, object_list, next_cursor, prev_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.prev_cursor is not None
+
+    def cursors(self):
+        """The cursor fields a JSON response carries"""
+        return {'next_cursor': self.next_cursor, 'prev_cursor': self.prev_cursor}
+
+
+def _field(model, path):
+    """The model field at the end of a lookup path such as 'product__name'"""
+    field = None
+    for name in path.split('__'):
+        field = model._meta.pk if name == 'pk' else model._meta.get_field(name)
+        model = field.related_model or model
+    return field
+
+
+def _value(instance, path):
+    for name in path.split('__'):
+        instance = getattr(instance, name)
+    return instance
+
+
+def _encode(direction, values):
+    payload = json.dumps([direction, [None if value is None else str(value) for value in values]])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def _decode(cursor, fields):
+    """(direction, key values) from a cursor, or None when it is not one of ours"""
+    # to_python() raises ValidationError for values of the wrong type, e.g. a bad date
+    try:
+        payload = base64.urlsafe_b64decode((cursor + '=' * (-len(cursor) % 4)).encode())
+        direction, values = json.loads(payload)
+        if direction not in ('next', 'prev') or len(values) != len(fields):
+            return None
+        return direction, [field.to_python(value) for field, value in zip(fields, values)]
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError, ValidationError):
+        return None
+
+
+def _beyond(ordering, values):
+    """
+    Rows strictly after `values` in `ordering`, spelled out as
+    (a > x) OR (a = x AND b > y) OR ... so each branch is an index range.
+    """
+    condition = Q()
+    for index, term in enumerate(ordering):
+        name = term.lstrip('-')
+        lookup = 'lt' if term.startswith('-') else 'gt'
+        branch = Q(**{f'{name}__{lookup}': values[index]})
+        for earlier, value in zip(ordering[:index], values):
+            branch &= Q(**{earlier.lstrip('-'): value})
+        condition |= branch
+    return condition
+
+
+def _reverse(ordering):
+    return [term[1:] if term.startswith('-') else f'-{term}' for term in ordering]
+
+
+def paginate(queryset, ordering, cursor=None, limit=None):
+    """
+    Return a KeysetPage of `queryset` sorted by `ordering`.
+
+    `ordering` is a list of order_by() terms ending in a unique one, e.g.
+    ['-sale_date', '-pk'], and none of the columns may be null. Each page
+    continues from the sort key of the row before it instead of an OFFSET,
+    so with an index on those columns page 500 costs the same as page 1.
+    Raises InvalidCursor when `cursor` does not decode.
+    """
+    try:
+        limit = max(1, min(int(limit or default_limit()), MAX_LIMIT))
+    except (TypeError, ValueError):
+        limit = default_limit()
+
+    names = [term.lstrip('-') for term in ordering]
+    fields = [_field(queryset.model, name) for name in names]
+    position = _decode(cursor, fields) if cursor else None
+    if cursor and position is None:
+        raise InvalidCursor('Invalid cursor')
+
+    if position is None:
+        rows = list(queryset.order_by(*ordering)[:limit + 1])
+        more, before = len(rows) > limit, False
+        rows = rows[:limit]
+    elif position[0] == 'next':
+        rows = list(queryset.filter(_beyond(ordering, position[1])).order_by(*ordering)[:limit + 1])
+        more, before = len(rows) > limit, True
+        rows = rows[:limit]
+    else:
+        # Walk backwards from the first row of the page being left, then restore the order
+        backwards = _reverse(ordering)
+        rows = list(queryset.filter(_beyond(backwards, position[1])).order_by(*backwards)[:limit + 1])
+        more, before = True, len(rows) > limit
+        rows = rows[:limit][::-1]
+
+    if not rows:
+        return KeysetPage([], None, None)
+
+    def key(row):
+        return [_value(row, name) for name in names]
+
+    return KeysetPage(
+        rows,
+        _encode('next', key(rows[-1])) if more else None,
+        _encode('prev', key(rows[0])) if before else None,
+    )
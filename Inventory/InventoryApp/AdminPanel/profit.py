@@ -0,0 +1,145 @@
+from decimal import Decimal
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.db.models import BigIntegerField, F, Max, Min
+from django.db.models.functions import Cast, Coalesce, Round
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Group key for each dimension, as a SaleItem lookup
+GROUPS = {
+    'product': 'product_id',
+    'branch': 'sale__branch_id',
+    'category': 'product__category_id',
+    'brand': 'product__brand_id',
+}
+CHUNK_SIZE = 100000
+CENT = Decimal('0.01')
+
+
+def _require():
+    if np is None:
+        raise ImproperlyConfigured('Profit reports need numpy installed.')
+
+
+def sale_lines(start=None, end=None):
+    """Completed sale lines on trading days start..end, with money as integers so rows skip Decimal conversion"""
+    from Sales.models import SaleItem
+
+    lines = SaleItem.objects.filter(sale__is_completed=True)
+    if start is not None:
+        lines = lines.filter(sale__business_date__gte=start)
+    if end is not None:
+        lines = lines.filter(sale__business_date__lte=end)
+
+    # Lines sold before costs were captured fall back to the product's list cost
+    return lines.annotate(
+        revenue_cents=Cast(Round(F('total_price') * 100), BigIntegerField()),
+        cost_units=Cast(Round(Coalesce('unit_cost', 'product__cost_price') * 10000), BigIntegerField()),
+    )
+
+
+def _chunks(lines, key, branch_id=None):
+    """
+    Yield (keys, quantity, revenue in cents, cost in 1/10000) arrays for
+    successive windows of CHUNK_SIZE line ids.
+
+    Plain id windows keep every query a range scan of the line table.
+    Filtering on the sale's branch in SQL lets the planner drive the join
+    from the branch index instead, re-reading the whole branch per window,
+    so the branch is masked out here.
+    """
+    bounds = lines.model.objects.aggregate(first=Min('pk'), last=Max('pk'))
+    if bounds['first'] is None:
+        return
+    for low in range(bounds['first'] - 1, bounds['last'], CHUNK_SIZE):
+        window = lines.filter(pk__gt=low, pk__lte=low + CHUNK_SIZE).values_list(
+            key, 'quantity', 'revenue_cents', 'cost_units', 'sale__branch_id',
+        )
+        # Every column is already an integer, so skip the ORM's per-row converters
+        with connection.cursor() as cursor:
+            cursor.execute(*window.query.sql_with_params())
+            rows = cursor.fetchall()
+        if not rows:
+            continue
+        block = np.array(rows, dtype=np.int64)
+        if branch_id is not None:
+            block = block[block[:, 4] == branch_id]
+        yield block[:, 0], block[:, 1], block[:, 2], block[:, 1] * block[:, 3]
+
+
+def _grow(totals, size):
+    if len(totals[0]) >= size:
+        return totals
+    size = max(size, 2 * len(totals[0]))
+    return [np.concatenate([column, np.zeros(size - len(column), dtype=np.int64)]) for column in totals]
+
+
+def profit_by(group_by='product', start=None, end=None, branch=None):
+    """
+    Revenue, cost and gross profit of completed sales, per `group_by` key.
+
+    Lines are read in primary key windows and summed with NumPy into arrays
+    indexed by the group id, so memory stays flat however many lines the
+    range covers. Cost is the unit cost captured on each line when it was
+    sold. Returns {'rows': [...], 'totals': {...}}, rows by profit, largest
+    first.
+    """
+    _require()
+    if group_by not in GROUPS:
+        raise ValueError(f"Cannot group profit by '{group_by}'")
+
+    # quantity, revenue cents, cost 1/10000ths and line count, indexed by group id
+    totals = [np.zeros(0, dtype=np.int64) for _ in range(4)]
+    branch_id = getattr(branch, 'pk', branch)
+    for keys, quantity, revenue, cost in _chunks(sale_lines(start, end), GROUPS[group_by], branch_id):
+        if not len(keys):
+            continue
+        totals = _grow(totals, int(keys.max()) + 1)
+        # Unbuffered integer adds keep the sums exact; bincount would go through float64
+        for column, values in zip(totals, (quantity, revenue, cost, 1)):
+            np.add.at(column, keys, values)
+
+    quantity, revenue, cost, lines = totals
+    ids = np.flatnonzero(lines)
+    names = _names(group_by, ids.tolist())
+    rows = [
+        _row(names.get(key, str(key)), quantity[key], revenue[key], cost[key], lines[key], id=key)
+        for key in ids.tolist()
+    ]
+    rows.sort(key=lambda row: row['profit'], reverse=True)
+    return {
+        'rows': rows,
+        'totals': _row('Total', quantity.sum(), revenue.sum(), cost.sum(), lines.sum()),
+    }
+
+
+def _row(label, quantity, revenue_cents, cost_units, lines, **extra):
+    revenue = (Decimal(int(revenue_cents)) / 100).quantize(CENT)
+    cost = (Decimal(int(cost_units)) / 10000).quantize(CENT)
+    profit = revenue - cost
+    return {
+        **extra,
+        'label': label,
+        'quantity': int(quantity),
+        'lines': int(lines),
+        'revenue': revenue,
+        'cost': cost,
+        'profit': profit,
+        'margin': (profit * 100 / revenue).quantize(Decimal('0.1')) if revenue else None,
+    }
+
+
+def _names(group_by, ids):
+    from inventory.models import Branch, Brand, Category, Product
+
+    model = {'product': Product, 'branch': Branch, 'category': Category, 'brand': Brand}[group_by]
+    names = {}
+    # Batches keep the IN list under SQLite's bound parameter limit
+    for offset in range(0, len(ids), 10000):
+        names.update(model.objects.filter(pk__in=ids[offset:offset + 10000]).values_list('pk', 'name'))
+    return names
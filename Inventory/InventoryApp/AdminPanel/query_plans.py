@@ -0,0 +1,114 @@
+import datetime
+import re
+
+from django.db import connection
+from django.db.models import F, Q
+from django.utils import timezone
+
+# Plan steps that read a table through one of its b-trees; anything else, such as a plain
+# table scan or an AUTOMATIC index SQLite builds for the one query, is a problem
+INDEXED = re.compile(r'(SEARCH|SCAN) \S+( AS \S+)? USING (COVERING INDEX|INDEX|INTEGER PRIMARY KEY|PRIMARY KEY) ')
+SORT = 'USE TEMP B-TREE FOR ORDER BY'
+
+
+class HotQuery:
+    """A query the views run on every request, and what its plan must avoid"""
+
+    def __init__(self, name, queryset, ordered=False, scan=None):
+        self.name = name
+        self.queryset = queryset
+        # Keyset-paginated lists must read in index order; sorting every row would defeat the cursor
+        self.ordered = ordered
+        # Why walking a whole index is fine here, e.g. a LIMITed page or a small partial index.
+        # Without a reason every step must SEARCH an index.
+        self.scan = scan
+
+    def plan(self):
+        """EXPLAIN QUERY PLAN rows for the query, as their detail strings"""
+        sql, params = self.queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def problems(self, plan=None):
+        found = []
+        for step in plan if plan is not None else self.plan():
+            if step.startswith(('SEARCH ', 'SCAN ')) and not INDEXED.match(f'{step} '):
+                found.append(f'not indexed: {step}')
+            elif step.startswith('SCAN ') and not self.scan:
+                found.append(f'walks a whole index: {step}')
+            elif self.ordered and step.startswith(SORT):
+                found.append(f'sorts every row: {step}')
+        return found
+
+
+def hot_queries(branch_id=1, user_id=1):
+    """The filters behind Staff.views, AdminPanel.views and the background workers, with sample values"""
+    from inventory.models import Accessory, Inventory, Phone, Product, Purchase
+    from Sales.models import Customer, Sale, SaleItem, SalesDailyRollup
+    from .models import LowStockAlert, Notification, Report, ReportJob
+
+    now = timezone.now()
+    today = timezone.localdate()
+    month_ago = today - datetime.timedelta(days=30)
+    completed = Sale.objects.filter(branch_id=branch_id, is_completed=True)
+    newest_first = ('-business_date', '-sale_date', '-pk')
+
+    return [
+        # Staff.views
+        HotQuery('staff dashboard: sales today', SalesDailyRollup.objects.filter(branch_id=branch_id,
+                                                                                 business_date=today)),
+        HotQuery('staff dashboard: stock', Inventory.objects.filter(branch_id=branch_id)),
+        HotQuery('sales history', completed.order_by(*newest_first), ordered=True),
+        HotQuery('sales history: next page', completed.filter(
+            Q(business_date__lt=today) | Q(business_date=today, sale_date__lt=now)
+            | Q(business_date=today, sale_date=now, pk__lt=1000)).order_by(*newest_first), ordered=True),
+        HotQuery('sales history: date range', completed.filter(
+            business_date__gte=month_ago, business_date__lte=today).order_by(*newest_first), ordered=True),
+        HotQuery('sales history: own sales', completed.filter(staff_id=user_id).order_by(*newest_first)),
+        HotQuery('product detail: recent sales', SaleItem.objects.filter(
+            product_id=1, sale__branch_id=branch_id, sale__is_completed=True).order_by('-sale__sale_date')),
+        HotQuery('inventory list', Inventory.objects.filter(branch_id=branch_id).order_by('product__name', 'pk')),
+        HotQuery('inventory list: low stock', Inventory.objects.filter(
+            branch_id=branch_id, quantity__lte=F('reorder_level'), quantity__gt=0)),
+        HotQuery('customer list', Customer.objects.order_by('-created_at', '-pk'), ordered=True,
+                 scan='keyset pages stop after LIMIT rows of the index'),
+        HotQuery('customer search: phone', Customer.objects.filter(
+            phone_key__gte='+234803', phone_key__lt='+234804').order_by('phone_key', 'pk'), ordered=True),
+
+        # AdminPanel.views
+        HotQuery('admin dashboard: sales today', SalesDailyRollup.objects.filter(business_date=today)),
+        HotQuery('admin dashboard: low stock', Inventory.objects.filter(quantity__lte=F('reorder_level')),
+                 scan='the partial index only holds rows at or below their reorder level'),
+        HotQuery('admin dashboard: active products', Product.objects.filter(is_active=True).order_by(),
+                 scan='the partial index only holds active products'),
+        HotQuery('phone list', Phone.objects.order_by('name', 'pk'), ordered=True,
+                 scan='keyset pages stop after LIMIT rows of the index'),
+        HotQuery('accessory list', Accessory.objects.order_by('name', 'pk'), ordered=True,
+                 scan='keyset pages stop after LIMIT rows of the index'),
+        HotQuery('sales report', Sale.objects.filter(
+            is_completed=True, business_date__gte=month_ago, business_date__lte=today,
+        ).order_by('business_date', 'sale_date', 'pk'), ordered=True),
+        HotQuery('sales report: branch', Sale.objects.filter(
+            is_completed=True, branch_id=branch_id, business_date__gte=month_ago, business_date__lte=today,
+        ).order_by('business_date', 'sale_date', 'pk'), ordered=True),
+        HotQuery('purchase report', Purchase.objects.filter(
+            branch_id=branch_id, business_date__gte=month_ago, business_date__lte=today,
+        ).order_by('business_date', 'purchase_date', 'pk'), ordered=True),
+        HotQuery('profit report: lines', SaleItem.objects.filter(
+            sale__is_completed=True, sale__business_date__gte=month_ago, sale__business_date__lte=today,
+            pk__gt=0, pk__lte=100000)),
+        HotQuery('report cache lookup', Report.objects.filter(cache_key='0' * 64)),
+
+        # Workers
+        HotQuery('report queue', ReportJob.objects.filter(status='queued')),
+        HotQuery('notification queue', Notification.objects.filter(
+            Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now), status='pending').order_by('pk'),
+            ordered=True),
+        HotQuery('notifications for a user', Notification.objects.filter(recipient_id=user_id, status='pending')),
+        HotQuery('low stock digest', LowStockAlert.objects.filter(is_low=True, notified_at__isnull=True),
+                 scan='the partial index only holds alerts waiting for a digest'),
+        HotQuery('analytics: changed sales', Sale.objects.filter(updated_at__gt=now - datetime.timedelta(days=30))),
+        HotQuery('analytics: facts for a day range', SaleItem.objects.filter(
+            sale__is_completed=True, sale__business_date__gte=month_ago, sale__business_date__lte=today)),
+    ]
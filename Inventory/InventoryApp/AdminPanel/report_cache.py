@@ -0,0 +1,149 @@
+import datetime
+import hashlib
+import json
+
+from django.conf import settings
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from .models import DataVersion, Report
+
+
+def max_age():
+    return datetime.timedelta(days=getattr(settings, 'REPORT_CACHE_MAX_AGE_DAYS', 30))
+
+
+def max_bytes():
+    return getattr(settings, 'REPORT_CACHE_MAX_MB', 2048) * 2 ** 20
+
+
+def _sources(report_type):
+    """
+    (model, aggregates) pairs and DataVersion counters whose values change
+    whenever a report of this type would. The large tables are read with
+    Max() over an indexed column, which looks at one end of the index.
+    """
+    from inventory.models import Branch, Brand, Category, Product, Purchase, StockMovement, Supplier
+    from Sales.models import Customer, Sale
+
+    sales = (Sale, {'sales_changed': Max('updated_at')})
+    if report_type == 'sales':
+        return [sales, (Customer, {'customers_changed': Max('updated_at')})], ['Sales.Sale', 'Sales.Customer']
+    if report_type == 'purchase':
+        return [
+            (Purchase, {'purchases_changed': Max('updated_at')}),
+            (Supplier, {'suppliers_changed': Max('updated_at')}),
+            (Branch, {'branches_changed': Max('updated_at')}),
+        ], ['inventory.Purchase']
+    if report_type == 'inventory':
+        # Every quantity or cost change writes a ledger row; reorder levels are edited in place and counted
+        return [
+            (StockMovement, {'movement': Max('pk')}),
+            (Product, {'products_changed': Max('updated_at')}),
+            (Branch, {'branches_changed': Max('updated_at')}),
+        ], ['inventory.Inventory']
+    if report_type == 'profit':
+        # Products hold the fallback cost; all four dimensions supply labels
+        return [
+            sales,
+            (Product, {'products_changed': Max('updated_at')}),
+            (Category, {'categories_changed': Max('updated_at')}),
+            (Brand, {'brands_changed': Max('updated_at')}),
+            (Branch, {'branches_changed': Max('updated_at')}),
+        ], ['Sales.Sale']
+    raise ValueError(f"Cannot generate {report_type} reports")
+
+
+def watermark(report_type):
+    """Summary of the data a report type reads; it differs whenever that data has changed"""
+    sources, counters = _sources(report_type)
+    values = {}
+    for model, aggregates in sources:
+        values.update(model.objects.aggregate(**aggregates))
+    # Deletions leave the latest timestamp alone, so they are counted as they happen instead
+    values.update(DataVersion.objects.filter(name__in=counters).values_list('name', 'version'))
+    return values
+
+
+def canonical_parameters(report_type, parameters):
+    """Parameters with blanks dropped and defaults filled in, so equivalent requests compare equal"""
+    canonical = {key: str(value) for key, value in (parameters or {}).items() if value not in (None, '')}
+    if report_type == 'profit':
+        canonical.setdefault('group_by', 'product')
+    return canonical
+
+
+def cache_key(report_type, export_format, parameters):
+    """Hex digest identifying the file a report request would produce right now"""
+    payload = json.dumps(
+        [report_type, export_format, canonical_parameters(report_type, parameters), watermark(report_type)],
+        sort_keys=True, default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def find(key):
+    """
+    An existing report for `key` that is generated or on its way, or None.
+
+    Reports whose job failed, or whose file has gone missing from storage,
+    are passed over. The one returned is marked as used.
+    """
+    candidates = Report.objects.filter(cache_key=key).filter(
+        Q(job__isnull=True) | Q(job__status__in=('queued', 'running', 'done'))
+    ).select_related('job').order_by('-created_at')
+
+    for report in candidates:
+        job = getattr(report, 'job', None)
+        in_progress = job is not None and job.status != 'done'
+        if in_progress or (report.file and report.file.storage.exists(report.file.name)):
+            touch(report)
+            return report
+    return None
+
+
+def touch(report):
+    report.last_used_at = timezone.now()
+    Report.objects.filter(pk=report.pk).update(last_used_at=report.last_used_at)
+
+
+def _size(report_file):
+    if not report_file:
+        return 0
+    try:
+        return report_file.storage.size(report_file.name)
+    except OSError:
+        return 0
+
+
+def evict(age=None, limit=None, dry_run=False):
+    """
+    Delete reports unused for longer than `age`, then the least recently
+    used ones until their files total no more than `limit` bytes.
+
+    Reports still queued or being generated are never touched. Defaults
+    come from REPORT_CACHE_MAX_AGE_DAYS and REPORT_CACHE_MAX_MB. Returns
+    (reports removed, bytes freed).
+    """
+    cutoff = timezone.now() - (age if age is not None else max_age())
+    limit = limit if limit is not None else max_bytes()
+
+    reports = list(Report.objects.exclude(job__status__in=('queued', 'running')).order_by('last_used_at', 'pk'))
+    sizes = {report.pk: _size(report.file) for report in reports}
+    total = sum(sizes.values())
+
+    evicted = []
+    for report in reports:
+        if report.last_used_at < cutoff or total > limit:
+            evicted.append(report)
+            total -= sizes[report.pk]
+
+    if not dry_run:
+        for report in evicted:
+            if report.file:
+                report.file.storage.delete(report.file.name)
+        ids = [report.pk for report in evicted]
+        # Batches keep the IN list under SQLite's bound parameter limit
+        for offset in range(0, len(ids), 10000):
+            Report.objects.filter(pk__in=ids[offset:offset + 10000]).delete()
+    return len(evicted), sum(sizes[report.pk] for report in evicted)
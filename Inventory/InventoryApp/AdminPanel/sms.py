@@ -0,0 +1,107 @@
+import json
+import os
+import threading
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+# Longest text sent; gateways split anything over 160 characters into parts
+MAX_LENGTH = 480
+
+
+class SMSMessage:
+    """A text message to one phone number"""
+
+    def __init__(self, to, body):
+        self.to = to
+        self.body = body[:MAX_LENGTH]
+
+    def __repr__(self):
+        return f'SMSMessage(to={self.to!r}, body={self.body[:20]!r})'
+
+
+class BaseSMSBackend:
+    """
+    Interface every SMS gateway backend implements, shaped like Django's
+    email backends: open() once, send_messages() any number of times,
+    close(). send_messages() returns how many messages were accepted and
+    raises on failure unless fail_silently is set.
+    """
+
+    def __init__(self, fail_silently=False, **kwargs):
+        self.fail_silently = fail_silently
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def send_messages(self, messages):
+        raise NotImplementedError('SMS backends must implement send_messages()')
+
+
+class FileBackend(BaseSMSBackend):
+    """Appends each message as a JSON line to SMS_FILE_PATH, standing in for a gateway in development"""
+
+    def __init__(self, file_path=None, **kwargs):
+        super().__init__(**kwargs)
+        self.file_path = str(file_path or getattr(settings, 'SMS_FILE_PATH', 'sms-outbox.jsonl'))
+        self.stream = None
+        self._lock = threading.RLock()
+
+    def open(self):
+        if self.stream is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.file_path)), exist_ok=True)
+            self.stream = open(self.file_path, 'a', encoding='utf-8')
+            return True
+        return False
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+    def send_messages(self, messages):
+        if not messages:
+            return 0
+        with self._lock:
+            opened = self.open()
+            try:
+                sent_at = timezone.now().isoformat()
+                for message in messages:
+                    self.stream.write(json.dumps({'to': message.to, 'body': message.body, 'sent_at': sent_at}) + '\n')
+                self.stream.flush()
+            except Exception:
+                if not self.fail_silently:
+                    raise
+                return 0
+            finally:
+                if opened:
+                    self.close()
+        return len(messages)
+
+
+class LocmemBackend(BaseSMSBackend):
+    """Keeps messages in sms.outbox, for tests and benchmarks"""
+
+    def send_messages(self, messages):
+        outbox.extend(messages)
+        return len(messages)
+
+
+outbox = []
+
+
+def get_connection(backend=None, fail_silently=False, **kwargs):
+    """An instance of the SMS backend at dotted path `backend`, SMS_BACKEND by default"""
+    backend_class = import_string(backend or getattr(settings, 'SMS_BACKEND', 'AdminPanel.sms.FileBackend'))
+    return backend_class(fail_silently=fail_silently, **kwargs)
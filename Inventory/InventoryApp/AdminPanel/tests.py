@@ -1,3 +1,519 @@
-from django.test import TestCase
+import base64
+import csv
+import datetime
+import io
+import json
+import tempfile
+import unittest
+import zipfile
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.db import connection
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core import mail
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+
+from CustomUser.models import CustomUser
+from inventory.models import Accessory, Branch, Brand, Category, Inventory, Phone, Product, Purchase, Supplier
+from inventory.stock import deduct_stock
+from Sales.models import Customer, Sale, SaleItem
+
+from . import (
+    alerts, analytics, exports, jobs, notifications, pagination, profit, query_plans, report_cache, sms, views,
+)
+from .models import LowStockAlert, Notification, Report, ReportJob
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'Plans are read with SQLite EXPLAIN QUERY PLAN')
+class QueryPlanTests(TestCase):
+    """The hot queries must search an index, and only walk a whole one where they say why"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.branch = Branch.objects.create(name='Main', address='1 Road', phone_number='08030000000')
+        cls.user = CustomUser.objects.create_user('cashier', password='x', branch=cls.branch)
+        category = Category.objects.create(name='Phones')
+        brand = Brand.objects.create(name='Acme')
+        products = [
+            Phone.objects.create(product_type='phone', name=f'Phone {n}', sku=f'P{n}', category=category, brand=brand,
+                                 cost_price=100, selling_price=150, model_number='M', storage_capacity='64GB',
+                                 ram='4GB', color='Black', screen_size='6in', processor='X')
+            for n in range(3)
+        ] + [
+            Accessory.objects.create(product_type='accessory', name=f'Case {n}', sku=f'A{n}', category=category,
+                                     brand=brand, cost_price=5, selling_price=10)
+            for n in range(3)
+        ]
+        stock = [Inventory.objects.create(product=product, branch=cls.branch, quantity=n, reorder_level=2)
+                 for n, product in enumerate(products)]
+        LowStockAlert.objects.get_or_create(inventory=stock[0], defaults={'is_low': True})
+
+        customer = Customer.objects.create(name='Ada Obi', phone_number='08031234567')
+        now = timezone.now()
+        for n in range(5):
+            sale = Sale.objects.create(branch=cls.branch, staff=cls.user, customer=customer, is_completed=True,
+                                       sale_date=now - datetime.timedelta(days=n), total_amount=Decimal('150'))
+            SaleItem.objects.create(sale=sale, product=products[0], quantity=1, unit_price=Decimal('150'),
+                                    total_price=Decimal('150'))
+
+        supplier = Supplier.objects.create(name='Wholesale', phone_number='08030000001')
+        Purchase.objects.create(supplier=supplier, branch=cls.branch, total_amount=Decimal('500'))
+        Notification.objects.create(notification_type='system', title='Hi', message='Hello', recipient=cls.user)
+        report = Report.objects.create(title='Sales', report_type='sales', format='csv', created_by=cls.user)
+        ReportJob.objects.create(report=report)
+
+    def test_hot_queries_use_an_index(self):
+        for query in query_plans.hot_queries(self.branch.pk, self.user.pk):
+            with self.subTest(query.name):
+                plan = query.plan()
+                self.assertEqual(query.problems(plan), [], plan)
+
+    def test_table_scan_is_a_problem(self):
+        query = query_plans.HotQuery('by address', Customer.objects.filter(address='1 Road'))
+        self.assertTrue(query.problems())
+
+    def test_index_walk_needs_a_reason(self):
+        walk = Customer.objects.order_by('-created_at', '-pk')
+        self.assertTrue(query_plans.HotQuery('customers', walk).problems())
+        self.assertEqual(query_plans.HotQuery('customers', walk, scan='LIMITed page').problems(), [])
+
+    def test_reason_does_not_excuse_a_table_scan(self):
+        query = query_plans.HotQuery('by address', Customer.objects.filter(address='1 Road'), scan='small table')
+        self.assertTrue(query.problems())
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Phones')
+        brand = Brand.objects.create(name='Acme')
+        # Repeated names, so pages have to break ties on the primary key
+        for n in range(7):
+            Phone.objects.create(product_type='phone', name=f'Phone {n // 2}', sku=f'P{n}', category=category,
+                                 brand=brand, cost_price=100, selling_price=150, model_number='M',
+                                 storage_capacity='64GB', ram='4GB', color='Black', screen_size='6in', processor='X')
+        cls.admin = CustomUser.objects.create_superuser('admin', 'admin@example.com', 'x')
+        cls.ordering = ['name', 'pk']
+        cls.expected = list(Phone.objects.order_by(*cls.ordering).values_list('pk', flat=True))
+
+    def page(self, cursor=None):
+        return pagination.paginate(Phone.objects.all(), self.ordering, cursor, 3)
+
+    def test_round_trip(self):
+        pages = [self.page()]
+        while pages[-1].has_next:
+            pages.append(self.page(pages[-1].next_cursor))
+        self.assertEqual([phone.pk for page in pages for phone in page], self.expected)
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertFalse(pages[0].has_previous)
+
+        # Walking back lands on the same pages
+        back = [pages[-1]]
+        while back[-1].has_previous:
+            back.append(self.page(back[-1].prev_cursor))
+        self.assertEqual([[phone.pk for phone in page] for page in back[::-1]],
+                         [[phone.pk for phone in page] for page in pages])
+
+    def test_tampered_cursors(self):
+        cursor = self.page().next_cursor
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        wrong_type = base64.urlsafe_b64encode(json.dumps(['next', [payload[1][0], 'x']]).encode()).decode()
+        too_short = base64.urlsafe_b64encode(json.dumps(['next', payload[1][:1]]).encode()).decode()
+
+        for tampered in ('garbage!!', cursor[:-3], wrong_type, too_short):
+            with self.subTest(tampered), self.assertRaises(pagination.InvalidCursor):
+                self.page(tampered)
+
+    def test_view_rejects_a_tampered_cursor(self):
+        def get(cursor):
+            request = RequestFactory().get('/', {'format': 'json', 'limit': 3, 'cursor': cursor})
+            request.user = self.admin
+            return views.phone_list(request)
+
+        first = json.loads(get('').content)
+        second = json.loads(get(first['next_cursor']).content)
+        self.assertEqual([row['id'] for row in first['results'] + second['results']], self.expected[:6])
+
+        response = get(base64.urlsafe_b64encode(b'["next", ["Phone 1", "x"]]').decode())
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content)['status'], 'error')
+
+
+class LowStockAlertTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.branch = Branch.objects.create(name='Main', address='1 Road', phone_number='08030000000')
+        cls.product = Product.objects.create(product_type='accessory', name='Charger', sku='CHG',
+                                             category=Category.objects.create(name='Accessories'),
+                                             brand=Brand.objects.create(name='Acme'), cost_price=5, selling_price=10)
+        cls.inventory = Inventory.objects.create(product=cls.product, branch=cls.branch, quantity=5, reorder_level=2)
+
+    def test_failed_check_does_not_fail_the_sale(self):
+        with mock.patch('AdminPanel.alerts.check_stock', side_effect=RuntimeError('down')), \
+                self.assertLogs(level='ERROR'), \
+                self.captureOnCommitCallbacks(execute=True):
+            deduct_stock(self.product, self.branch, 1)
+
+        self.inventory.refresh_from_db()
+        self.assertEqual(self.inventory.quantity, 4)
+
+    def sell(self, quantity):
+        with self.captureOnCommitCallbacks(execute=True):
+            deduct_stock(self.product, self.branch, quantity)
+
+    def test_each_crossing_is_recorded_once(self):
+        self.sell(3)
+        self.sell(1)
+        alert = LowStockAlert.objects.get()
+        self.assertEqual((alert.is_low, alert.times_crossed), (True, 1))
+
+        # Checking again without a change writes nothing
+        self.assertEqual(alerts.check_stock(self.branch.pk, [self.product.pk]), (0, 0))
+
+        Inventory.objects.filter(pk=self.inventory.pk).update(quantity=10)
+        self.assertEqual(alerts.check_stock(self.branch.pk, [self.product.pk]), (0, 1))
+        self.sell(8)
+        alert.refresh_from_db()
+        self.assertEqual((alert.is_low, alert.times_crossed), (True, 2))
+
+    def test_digest_per_manager(self):
+        manager = CustomUser.objects.create_user('manager', password='x', branch=self.branch)
+        Branch.objects.filter(pk=self.branch.pk).update(manager=manager)
+        restocked = Product.objects.create(product_type='accessory', name='Cable', sku='CBL',
+                                           category=self.product.category, brand=self.product.brand,
+                                           cost_price=1, selling_price=2)
+        Inventory.objects.create(product=restocked, branch=self.branch, quantity=1, reorder_level=2)
+        alerts.rescan()
+        self.sell(5)
+        # The cable dipped and was restocked before the digest went out
+        Inventory.objects.filter(product=restocked).update(quantity=9)
+        alerts.rescan()
+
+        self.assertEqual(alerts.send_digests(), 1)
+        notification = Notification.objects.get()
+        self.assertEqual((notification.recipient, notification.title),
+                         (manager, 'Low Stock Alert: 1 product to reorder'))
+        self.assertIn('Charger (CHG), OUT OF STOCK, reorder level 2', notification.message)
+        self.assertNotIn('Cable', notification.message)
+
+        # Reported crossings are not repeated
+        self.assertEqual(alerts.send_digests(), 0)
+
+
+@unittest.skipUnless(analytics.is_available(), 'The analytics store needs numpy, pandas and pyarrow')
+class SalesAnalyticsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.branch = Branch.objects.create(name='Main', address='1 Road', phone_number='08030000000')
+        cls.user = CustomUser.objects.create_superuser('owner', 'owner@example.com', 'x', branch=cls.branch)
+        category = Category.objects.create(name='Accessories')
+        brand = Brand.objects.create(name='Acme')
+        cls.products = [
+            Product.objects.create(product_type='accessory', name=name, sku=name.upper(), category=category,
+                                   brand=brand, cost_price=5, selling_price=10)
+            for name in ('Charger', 'Cable')
+        ]
+
+    def setUp(self):
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(ANALYTICS_STORE_PATH=f'{directory}/facts.parquet'))
+
+    def sell(self, product, quantity, days_ago=0):
+        sale = Sale.objects.create(branch=self.branch, staff=self.user, is_completed=True,
+                                   sale_date=timezone.now() - datetime.timedelta(days=days_ago))
+        SaleItem.objects.create(sale=sale, product=product, quantity=quantity, unit_price=Decimal('10'),
+                                total_price=Decimal(10 * quantity))
+        return sale
+
+    def report(self, **params):
+        request = RequestFactory().get('/', {'format': 'json', **params})
+        request.user = self.user
+        response = views.sales_report(request)
+        return response.status_code, json.loads(response.content)
+
+    def test_refresh_picks_up_new_and_deleted_sales(self):
+        charger, cable = self.products
+        self.sell(charger, 2, days_ago=5)
+        self.sell(cable, 1)
+        analytics.refresh_sales_facts()
+
+        status, body = self.report(group_by='product')
+        self.assertEqual(status, 200)
+        self.assertEqual([(row['product'], row['quantity']) for row in body['rows']], [('Charger', 2), ('Cable', 1)])
+
+        # An old day only comes back into the refresh because the deletion queued it
+        Sale.objects.filter(items__product=charger).delete()
+        self.sell(cable, 3)
+        refresh = analytics.refresh_sales_facts()
+
+        self.assertFalse(refresh.full)
+        _, body = self.report(group_by='product')
+        self.assertEqual([(row['product'], row['quantity']) for row in body['rows']], [('Cable', 4)])
+
+    def test_limit_is_clamped(self):
+        for product in self.products:
+            self.sell(product, 1)
+        analytics.refresh_sales_facts()
+
+        for limit, rows in (('0', 1), ('-3', 1), ('1', 1), ('1000000', 2)):
+            with self.subTest(limit):
+                status, body = self.report(group_by='product', limit=limit)
+                self.assertEqual((status, len(body['rows'])), (200, rows))
+        self.assertEqual(self.report(limit='lots')[0], 400)
+
+
+@unittest.skipUnless(profit.np is not None, 'Profit reports need numpy')
+class ProfitTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.branch = Branch.objects.create(name='Main', address='1 Road', phone_number='08030000000')
+        cls.annex = Branch.objects.create(name='Annex', address='2 Road', phone_number='08030000002')
+        category = Category.objects.create(name='Accessories')
+        brand = Brand.objects.create(name='Acme')
+        cls.charger = Product.objects.create(product_type='accessory', name='Charger', sku='CHG', category=category,
+                                             brand=brand, cost_price=Decimal('4'), selling_price=Decimal('10'))
+        cls.cable = Product.objects.create(product_type='accessory', name='Cable', sku='CBL', category=category,
+                                           brand=brand, cost_price=Decimal('1'), selling_price=Decimal('3'))
+        Inventory.objects.create(product=cls.charger, branch=cls.branch, quantity=10, average_cost=Decimal('5.5'))
+
+    def sell(self, branch, product, quantity, price, completed=True):
+        sale = Sale.objects.create(branch=branch, is_completed=completed)
+        SaleItem.objects.create(sale=sale, product=product, quantity=quantity, unit_price=price,
+                                total_price=price * quantity)
+
+    def test_cost_is_taken_when_sold(self):
+        self.sell(self.branch, self.charger, 2, Decimal('10'))
+        self.sell(self.annex, self.charger, 1, Decimal('9'))
+        self.sell(self.branch, self.cable, 3, Decimal('3'))
+        self.sell(self.branch, self.cable, 5, Decimal('3'), completed=False)
+        # Repricing afterwards does not rewrite what earlier sales cost
+        Product.objects.filter(pk=self.charger.pk).update(cost_price=Decimal('8'))
+
+        # Tiny windows make sure nothing is lost or counted twice between them
+        with mock.patch.object(profit, 'CHUNK_SIZE', 2):
+            report = profit.profit_by('product')
+
+        rows = {row['label']: (row['quantity'], row['revenue'], row['cost'], row['profit']) for row in report['rows']}
+        # Two chargers at the branch's average cost, one at the annex's list cost
+        self.assertEqual(rows, {'Charger': (3, Decimal('29'), Decimal('15'), Decimal('14')),
+                                'Cable': (3, Decimal('9'), Decimal('3'), Decimal('6'))})
+        self.assertEqual(report['totals']['profit'], Decimal('20'))
+        self.assertEqual(report['totals']['margin'], Decimal('52.6'))
+
+    def test_branch_and_grouping(self):
+        self.sell(self.branch, self.charger, 2, Decimal('10'))
+        self.sell(self.annex, self.charger, 1, Decimal('9'))
+
+        report = profit.profit_by('branch', branch=self.annex)
+
+        self.assertEqual([(row['label'], row['profit']) for row in report['rows']], [('Annex', Decimal('5'))])
+        with self.assertRaises(ValueError):
+            profit.profit_by('cashier')
+
+
+class ExportTests(TestCase):
+    rows = [(n, f'Item <{n}> & co\x01', Decimal('1.50') * n, datetime.date(2026, 1, n)) for n in range(1, 6)]
+
+    def test_csv_in_chunks(self):
+        with mock.patch.object(exports, 'FLUSH_ROWS', 2):
+            chunks = list(exports.stream(('No', 'Name', 'Price', 'Day'), iter(self.rows), 'csv'))
+
+        self.assertEqual(len(chunks), 3)
+        parsed = list(csv.reader(io.StringIO(b''.join(chunks).decode())))
+        self.assertEqual(parsed[0], ['No', 'Name', 'Price', 'Day'])
+        self.assertEqual(parsed[5], ['5', 'Item <5> & co\x01', '7.50', '2026-01-05'])
+
+    def test_xlsx_workbook(self):
+        with mock.patch.object(exports, 'FLUSH_ROWS', 2):
+            data = b''.join(exports.stream(('No', 'Name', 'Price', 'Day'), iter(self.rows), 'excel'))
+
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            self.assertIsNone(archive.testzip())
+            sheet = archive.read('xl/worksheets/sheet1.xml').decode()
+        self.assertEqual(sheet.count('<row>'), 6)
+        self.assertIn('<t xml:space="preserve">Item &lt;5&gt; &amp; co</t>', sheet)
+        self.assertIn('<c><v>7.50</v></c>', sheet)
+
+    def test_sales_report_rows(self):
+        branch = Branch.objects.create(name='Main', address='1 Road', phone_number='08030000000')
+        other = Branch.objects.create(name='Annex', address='2 Road', phone_number='08030000002')
+        now = timezone.now()
+        for days_ago, where, completed in ((0, branch, True), (3, branch, True), (0, other, True), (0, branch, False)):
+            Sale.objects.create(branch=where, is_completed=completed, total_amount=Decimal('12'),
+                                sale_date=now - datetime.timedelta(days=days_ago))
+
+        header, rows = exports.report_rows('sales', {'branch': str(branch.pk),
+                                                     'start': timezone.localdate().isoformat()})
+        rows = list(rows)
+
+        self.assertEqual(header, exports.SALE_HEADER)
+        self.assertEqual(len(rows), 1)
+        self.assertEqual((rows[0][4], rows[0][-1]), ('Cash', Decimal('12')))
+        self.assertEqual(exports.report_size('sales', {'branch': str(branch.pk)}), 2)
+
+        response = exports.streaming_response(header, iter(rows), 'csv', 'sales')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="sales.csv"')
+        self.assertEqual(b''.join(response.streaming_content).decode().count('\r\n'), 2)
+
+
+class ReportJobTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.branch = Branch.objects.create(name='Main', address='1 Road', phone_number='08030000000')
+        cls.user = CustomUser.objects.create_superuser('owner', 'owner@example.com', 'x', branch=cls.branch)
+        Sale.objects.create(branch=cls.branch, is_completed=True, total_amount=Decimal('12'))
+
+    def setUp(self):
+        self.enterContext(override_settings(MEDIA_ROOT=self.enterContext(tempfile.TemporaryDirectory())))
+
+    def generate(self, data, **headers):
+        request = RequestFactory().post('/', data, headers=headers)
+        request.user = self.user
+        request._messages = CookieStorage(request)
+        return views.generate_sales_report(request), [str(message) for message in request._messages]
+
+    def test_claim_and_run(self):
+        report, created = jobs.enqueue('sales', 'csv', {}, self.user)
+        self.assertTrue(created)
+        self.assertEqual(jobs.enqueue('sales', 'csv', {}, self.user), (report, False))
+
+        job = jobs.claim_next('worker-1')
+        self.assertIsNone(jobs.claim_next('worker-2'))
+        self.assertEqual(jobs.run_job(job.pk), 'done')
+
+        job.refresh_from_db()
+        report.refresh_from_db()
+        self.assertEqual((job.status, job.rows_total, job.rows_written), ('done', 1, 1))
+        with report.file.open() as file:
+            self.assertEqual(file.read().decode().count('\r\n'), 2)
+
+    def test_failed_run_is_retried_then_given_up(self):
+        jobs.enqueue('sales', 'csv', {}, self.user)
+        with mock.patch.object(exports, 'report_rows', side_effect=RuntimeError('disk full')), \
+                override_settings(REPORT_JOB_MAX_ATTEMPTS=2):
+            self.assertEqual(jobs.run_job(jobs.claim_next('worker-1').pk), 'queued')
+            self.assertEqual(jobs.run_job(jobs.claim_next('worker-1').pk), 'failed')
+
+        self.assertEqual(ReportJob.objects.get().error, 'RuntimeError: disk full')
+
+    def test_per_user_limit(self):
+        with override_settings(REPORT_JOBS_PER_USER=1):
+            jobs.enqueue('sales', 'csv', {}, self.user)
+            with self.assertRaises(jobs.JobLimitError):
+                jobs.enqueue('inventory', 'csv', {}, self.user)
+
+    def test_form_errors_go_back_to_the_form(self):
+        response, notes = self.generate({'start': 'yesterday'})
+
+        self.assertEqual((response.status_code, response.url), (302, '/admin-portal/'))
+        self.assertEqual(notes, ['Dates must be given as YYYY-MM-DD.'])
+        self.assertFalse(Report.objects.exists())
+
+        response, notes = self.generate({'branch': str(self.branch.pk)})
+        self.assertEqual(response.url, f'/admin-portal/download/{Report.objects.get().pk}/')
+
+    def test_scripts_get_json_errors(self):
+        response, notes = self.generate({'branch': '999'}, x_requested_with='XMLHttpRequest')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content)['message'], 'Branch #999 does not exist.')
+        self.assertEqual(notes, [])
+
+
+class ReportCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.branch = Branch.objects.create(name='Main', address='1 Road', phone_number='08030000000')
+        cls.product = Product.objects.create(product_type='accessory', name='Charger', sku='CHG',
+                                             category=Category.objects.create(name='Accessories'),
+                                             brand=Brand.objects.create(name='Acme'), cost_price=5, selling_price=10)
+        cls.inventory = Inventory.objects.create(product=cls.product, branch=cls.branch, quantity=5)
+        cls.customer = Customer.objects.create(name='Ada Obi', phone_number='08031234567')
+        cls.sales = [Sale.objects.create(branch=cls.branch, is_completed=True, total_amount=Decimal('12'))
+                     for _ in range(2)]
+
+    def assertMoves(self, report_type, change):
+        before = report_cache.watermark(report_type)
+        change()
+        self.assertNotEqual(report_cache.watermark(report_type), before)
+
+    def test_reads_leave_it_alone(self):
+        for report_type in exports.REPORT_TYPES:
+            with self.subTest(report_type):
+                self.assertEqual(report_cache.watermark(report_type), report_cache.watermark(report_type))
+
+    def test_changes_move_it(self):
+        def edit_sale():
+            self.sales[0].notes = 'Gift'
+            self.sales[0].save()
+
+        def edit_reorder_level():
+            self.inventory.reorder_level = 3
+            self.inventory.save()
+
+        self.assertMoves('sales', edit_sale)
+        # The deleted sale was not the latest one edited
+        self.assertMoves('sales', self.sales[1].delete)
+        self.assertMoves('profit', self.sales[0].delete)
+        self.assertMoves('sales', self.customer.delete)
+        self.assertMoves('inventory', edit_reorder_level)
+        self.assertMoves('inventory', lambda: deduct_stock(self.product, self.branch, 1))
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+                   SMS_BACKEND='AdminPanel.sms.LocmemBackend', NOTIFICATION_MAX_ATTEMPTS=2)
+class NotificationDeliveryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('manager', 'manager@example.com', 'x', phone_number='08031234567')
+
+    def setUp(self):
+        sms.outbox.clear()
+        self.addCleanup(sms.outbox.clear)
+
+    def notify(self, delivery_method='email', recipient=None):
+        return Notification.objects.create(notification_type='system', title='Hi', message='Hello',
+                                           recipient=recipient or self.user, delivery_method=delivery_method)
+
+    def test_delivers_each_channel_once(self):
+        both = self.notify('both')
+        with mock.patch.object(sms.LocmemBackend, 'send_messages', side_effect=OSError('gateway down')):
+            self.assertEqual(notifications.send_pending('w1'), (1, 0, 1, 0))
+        both.refresh_from_db()
+        self.assertEqual((both.status, both.delivered_via, both.claimed_by), ('pending', 'email', ''))
+
+        # Due again once the backoff has passed; only the text message is sent this time
+        Notification.objects.filter(pk=both.pk).update(next_attempt_at=timezone.now())
+        self.assertEqual(notifications.send_pending('w1'), (1, 1, 0, 0))
+        both.refresh_from_db()
+        self.assertEqual((both.status, both.delivered_via, both.attempts), ('sent', 'email,sms', 2))
+        self.assertEqual((len(mail.outbox), len(sms.outbox)), (1, 1))
+
+    def test_undeliverable_and_exhausted(self):
+        no_email = self.notify(recipient=CustomUser.objects.create_user('clerk', password='x'))
+        flaky = self.notify()
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', return_value=0):
+            self.assertEqual(notifications.send_pending('w1'), (2, 0, 1, 1))
+            Notification.objects.filter(pk=flaky.pk).update(next_attempt_at=timezone.now())
+            self.assertEqual(notifications.send_pending('w1'), (1, 0, 0, 1))
+
+        no_email.refresh_from_db()
+        flaky.refresh_from_db()
+        self.assertEqual((no_email.status, no_email.last_error), ('failed', 'email: recipient has no email address'))
+        self.assertEqual((flaky.status, flaky.attempts), ('failed', 2))
+
+    def test_outcome_is_not_written_over_a_new_claim(self):
+        sent, retried = self.notify(), self.notify('sms')
+        batch = notifications.claim_batch('slow')
+        # The slow worker's claim lapses and another worker takes both rows over
+        Notification.objects.update(claimed_by='fast/1')
+
+        with mock.patch.object(sms.LocmemBackend, 'send_messages', side_effect=OSError('gateway down')):
+            self.assertEqual(notifications.send_batch(batch), (0, 0, 0))
+
+        for notification in (sent, retried):
+            notification.refresh_from_db()
+            self.assertEqual((notification.status, notification.attempts, notification.claimed_by),
+                             ('pending', 0, 'fast/1'))
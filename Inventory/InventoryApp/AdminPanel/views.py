@@ -1,43 +1,51 @@
+import os
+
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required, permission_required
 from django.db.models import Sum, F, Q
+from django.core.exceptions import ImproperlyConfigured
+from django.http import FileResponse, Http404, JsonResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.utils import timezone
+from django.utils.text import slugify
 
 
+from inventory import receiving
 from inventory.forms import PhoneForm
-from inventory.models import Product, Phone, Inventory, Brand, Category
-
-from Inventory.InventoryApp.inventory.models import Accessory
+from inventory.models import Product, Phone, Accessory, Inventory, Brand, Branch, Category, Purchase
+from . import analytics, exports, jobs, pagination, profit, report_cache
+from .models import Report
 
 
 @login_required
 @permission_required('accounts.can_access_admin_portal', raise_exception=True)
 def dashboard(request):
     """Admin dashboard view with summary statistics"""
-    from Sales.models import Sale
-    # Get current date
-    today = timezone.now().date()
+    from Sales.models import SalesDailyRollup
+    # Each branch's own trading day; branches in different zones or with different cutoffs may not agree
+    today = Q()
+    for day, branch_ids in Branch.business_days().items():
+        today |= Q(business_date=day, branch_id__in=branch_ids)
 
-    # Get sales statistics
-    today_sales = Sale.objects.filter(sale_date__date=today)
-    today_sales_count = today_sales.count()
-    today_sales_amount = today_sales.aggregate(total=Sum('total_amount'))['total'] or 0
+    # Get user's branch if assigned
+    branch = request.user.branch
+
+    # Get sales statistics for every branch and for the user's own from the daily rollup
+    totals = SalesDailyRollup.objects.filter(today).aggregate(
+        today_sales_count=Sum('sale_count'),
+        today_sales_amount=Sum('total_amount'),
+        branch_sales_count=Sum('sale_count', filter=Q(branch=branch)),
+        branch_sales_amount=Sum('total_amount', filter=Q(branch=branch)),
+    )
+    today_sales_count = totals['today_sales_count'] or 0
+    today_sales_amount = totals['today_sales_amount'] or 0
 
     # Get inventory statistics
     low_stock_items = Inventory.objects.filter(quantity__lte=F('reorder_level')).count()
     total_products = Product.objects.filter(is_active=True).count()
 
-    # Get user's branch if assigned
-    if request.CustomUser.branch:
-        branch = request.CustomUser.branch
-        branch_sales = Sale.objects.filter(branch=branch, sale_date__date=today)
-        branch_sales_count = branch_sales.count()
-        branch_sales_amount = branch_sales.aggregate(total=Sum('total_amount'))['total'] or 0
-    else:
-        branch = None
-        branch_sales_count = 0
-        branch_sales_amount = 0
+    branch_sales_count = (totals['branch_sales_count'] or 0) if branch else 0
+    branch_sales_amount = (totals['branch_sales_amount'] or 0) if branch else 0
 
     context = {
         'today_sales_count': today_sales_count,
@@ -52,6 +60,16 @@ def dashboard(request):
     return render(request, 'AdminPanel/dashboard.html', context)
 
 
+def _product_row(product):
+    return {
+        'id': product.pk,
+        'name': product.name,
+        'sku': product.sku,
+        'brand': product.brand.name,
+        'selling_price': str(product.selling_price),
+    }
+
+
 @login_required
 @permission_required('inventory.view_phone', raise_exception=True)
 def phone_list(request):
@@ -77,12 +95,23 @@ def phone_list(request):
             Q(barcode__icontains=search)
         )
 
+    # One page at a time, continuing from the last name seen
+    try:
+        page = pagination.paginate(phones.select_related('brand'), ['name', 'pk'],
+                                   request.GET.get('cursor'), request.GET.get('limit'))
+    except pagination.InvalidCursor as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    if request.GET.get('format') == 'json':
+        return JsonResponse({'status': 'success', 'results': [_product_row(phone) for phone in page],
+                             **page.cursors()})
+
     # Get filter options for the template
     brands = Brand.objects.all()
     categories = Category.objects.filter(parent__isnull=True) | Category.objects.filter(parent__name__icontains='phone')
 
     context = {
-        'phones': phones,
+        'phones': page,
+        'page': page,
         'brands': brands,
         'categories': categories,
         'selected_brand': brand,
@@ -177,11 +206,21 @@ def accessory_list(request):
             Q(barcode__icontains=search)
         )
 
+    try:
+        page = pagination.paginate(accessories.select_related('brand'), ['name', 'pk'],
+                                   request.GET.get('cursor'), request.GET.get('limit'))
+    except pagination.InvalidCursor as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    if request.GET.get('format') == 'json':
+        return JsonResponse({'status': 'success', 'results': [_product_row(accessory) for accessory in page],
+                             **page.cursors()})
+
     brands = Brand.objects.all()
     categories = Category.objects.filter(parent__isnull=True) | Category.objects.filter(parent__name__icontains='accessory')
 
     context = {
-        'accessories': accessories,
+        'accessories': page,
+        'page': page,
         'brands': brands,
         'categories': categories,
         'selected_brand': brand,
@@ -254,3 +293,254 @@ def accessory_delete(request, pk):
     }
 
     return render(request, 'admin_portal/accessories/delete.html', context)
+
+
+@login_required
+@permission_required('inventory.change_purchase', raise_exception=True)
+def receive_purchase(request, pk):
+    """Receive all or part of a purchase order into branch inventory"""
+    purchase = get_object_or_404(Purchase, pk=pk)
+
+    if request.method == 'POST':
+        # Fields are named received_<item id> and hold the cumulative quantity delivered
+        received = {}
+        for key, value in request.POST.items():
+            if key.startswith('received_'):
+                try:
+                    received[int(key[len('received_'):])] = int(value)
+                except ValueError:
+                    messages.error(request, 'Received quantities must be whole numbers.')
+                    return redirect('admin_portal:receive_purchase', pk=purchase.pk)
+
+        try:
+            added = receiving.receive_purchase(purchase, request.user, received or None)
+        except receiving.ReceivingError as e:
+            messages.error(request, str(e))
+        else:
+            if added:
+                messages.success(request, f'Received {sum(added.values())} units for {purchase}.')
+            else:
+                messages.info(request, f'Nothing left to receive for {purchase}.')
+        return redirect('admin_portal:purchase_detail', pk=purchase.pk)
+
+    context = {
+        'purchase': purchase,
+        'items': purchase.items.select_related('product'),
+    }
+
+    return render(request, 'AdminPanel/purchase_receive.html', context)
+
+
+@login_required
+@permission_required('accounts.can_access_admin_portal', raise_exception=True)
+def sales_report(request):
+    """Slice and roll up sales by branch, product, category, brand and period from the analytics store"""
+    group_by = [name for name in request.GET.get('group_by', 'branch').split(',') if name]
+    grain = request.GET.get('grain') or None
+    start = request.GET.get('start') or None
+    end = request.GET.get('end') or None
+
+    try:
+        # Dimension filters are comma separated ids, e.g. ?brand=3,7
+        filters = {
+            dimension: [int(pk) for pk in request.GET[dimension].split(',') if pk]
+            for dimension in analytics.DIMENSIONS if request.GET.get(dimension)
+        }
+        limit = max(1, min(int(request.GET.get('limit', 200)), analytics.MAX_LIMIT))
+        rows = analytics.get_cube().query(group_by, grain, start, end, filters, limit)
+    except (ImproperlyConfigured, ValueError) as e:
+        # Missing store or libraries, unknown dimensions, bad ids and malformed dates
+        error = str(e)
+        rows = None
+    else:
+        error = None
+
+    columns = (['period'] if grain else []) + group_by + ['quantity', 'revenue', 'line_count']
+
+    if request.GET.get('format') == 'json':
+        if error:
+            return JsonResponse({'status': 'error', 'message': error}, status=400)
+        records = rows[columns].to_dict('records')
+        for record in records:
+            if 'period' in record:
+                record['period'] = record['period'].isoformat()
+            record['quantity'] = int(record['quantity'])
+            record['line_count'] = int(record['line_count'])
+        return JsonResponse({'status': 'success', 'columns': columns, 'rows': records})
+
+    if error:
+        messages.error(request, error)
+
+    context = {
+        'columns': columns,
+        'rows': rows[columns].itertuples(index=False) if rows is not None else [],
+        'group_by': ','.join(group_by),
+        'grain': grain or '',
+        'grains': analytics.GRAINS,
+        'start': start or '',
+        'end': end or '',
+    }
+
+    return render(request, 'AdminPanel/sales_report.html', context)
+
+
+@login_required
+@permission_required('accounts.can_access_admin_portal', raise_exception=True)
+def profit_report(request):
+    """Gross profit by product, branch, category or brand, from the cost captured on each sale line"""
+    try:
+        summary = exports.profit_summary(request.GET)
+    except (ImproperlyConfigured, ValueError) as e:
+        if request.GET.get('format') == 'json':
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+        messages.error(request, str(e))
+        summary = {'rows': [], 'totals': None}
+
+    if request.GET.get('format') == 'json':
+        return JsonResponse({'status': 'success', **summary})
+
+    context = {
+        'summary': summary,
+        'columns': exports.PROFIT_COLUMNS,
+        'group_by': request.GET.get('group_by') or 'product',
+        'groups': profit.GROUPS,
+        'start': request.GET.get('start', ''),
+        'end': request.GET.get('end', ''),
+    }
+
+    return render(request, 'AdminPanel/profit_report.html', context)
+
+
+REPORT_PARAMETERS = ('start', 'end', 'branch', 'group_by')
+
+
+def _report_parameter_error(report_type, parameters):
+    """Why a report cannot be generated from `parameters`, or None when it can"""
+    try:
+        exports.date_range(parameters)
+    except ValueError:
+        return 'Dates must be given as YYYY-MM-DD.'
+    if 'branch' in parameters:
+        try:
+            branch_id = int(parameters['branch'])
+        except ValueError:
+            return 'Branch must be a branch id.'
+        if not Branch.objects.filter(pk=branch_id).exists():
+            return f'Branch #{branch_id} does not exist.'
+    if report_type == 'profit' and parameters.get('group_by', 'product') not in profit.GROUPS:
+        return f"Cannot group profit by '{parameters['group_by']}'."
+    return None
+
+
+def _wants_json(request):
+    """Whether the caller is a script expecting JSON back rather than a browser posting a form"""
+    return (request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+            or request.content_type == 'application/json'
+            or 'application/json' in request.headers.get('Accept', ''))
+
+
+def _queue_report(request, report_type, fallback):
+    """Queue a report from a POSTed form and send the user to its download page"""
+    if request.method != 'POST':
+        return redirect(fallback)
+
+    parameters = {key: request.POST[key] for key in REPORT_PARAMETERS if request.POST.get(key)}
+    # Reject bad parameters now, rather than have the worker fail the job
+    error = _report_parameter_error(report_type, parameters)
+    if error is None:
+        try:
+            report, created = jobs.enqueue(report_type, request.POST.get('format') or 'csv', parameters,
+                                           request.user)
+        except ValueError as e:
+            error = str(e)
+
+    if error:
+        if _wants_json(request):
+            return JsonResponse({'status': 'error', 'message': error}, status=400)
+        messages.error(request, error)
+        return redirect(fallback)
+
+    if created:
+        messages.success(request, f'{report.title} queued. It will download once it is ready.')
+    else:
+        messages.success(request, f'Nothing has changed since this {report.title.lower()} was generated; '
+                                  f'reusing it.')
+    return redirect('admin_portal:download_report', pk=report.pk)
+
+
+@login_required
+@permission_required('accounts.can_access_admin_portal', raise_exception=True)
+def generate_sales_report(request):
+    """Queue a sales report for background generation"""
+    return _queue_report(request, 'sales', 'admin_portal:dashboard')
+
+
+@login_required
+@permission_required('accounts.can_access_admin_portal', raise_exception=True)
+def generate_inventory_report(request):
+    """Queue an inventory report for background generation"""
+    return _queue_report(request, 'inventory', 'admin_portal:dashboard')
+
+
+@login_required
+@permission_required('accounts.can_access_admin_portal', raise_exception=True)
+def generate_purchases_report(request):
+    """Queue a purchases report for background generation"""
+    return _queue_report(request, 'purchase', 'admin_portal:dashboard')
+
+
+@login_required
+@permission_required('accounts.can_access_admin_portal', raise_exception=True)
+def generate_profit_report(request):
+    """Queue the profit report for background generation"""
+    return _queue_report(request, 'profit', 'admin_portal:profit_report')
+
+
+@login_required
+@permission_required('accounts.can_access_admin_portal', raise_exception=True)
+def download_report(request, pk):
+    """Send a generated report file, or its generation status while a worker is still on it"""
+    report = get_object_or_404(Report.objects.select_related('job'), pk=pk)
+    job = getattr(report, 'job', None)
+
+    if job is None or job.status == 'done':
+        # Reports saved before background generation, or whose file was evicted, have nothing to send
+        try:
+            stream = report.file.open('rb')
+        except (ValueError, FileNotFoundError):
+            raise Http404('This report has not been generated.')
+        report_cache.touch(report)
+        return FileResponse(stream, as_attachment=True, filename=os.path.basename(report.file.name))
+
+    # Polled by the status page every few seconds
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'status': job.status,
+            'progress': job.progress,
+            'rows_written': job.rows_written,
+            'rows_total': job.rows_total,
+            'error': job.error if job.status == 'failed' else '',
+        })
+
+    return render(request, 'AdminPanel/report_status.html', {'report': report, 'job': job})
+
+
+@login_required
+@permission_required('accounts.can_access_admin_portal', raise_exception=True)
+def export_report(request, pk):
+    """Stream a saved report's data afresh as CSV or Excel, however many rows it covers"""
+    report = get_object_or_404(Report, pk=pk)
+    export_format = request.GET.get('format') or report.format
+
+    if export_format not in exports.CONTENT_TYPES:
+        messages.error(request, f'{report.get_format_display()} reports cannot be exported; choose CSV or Excel.')
+        return redirect('admin_portal:dashboard')
+
+    try:
+        header, rows = exports.report_rows(report.report_type, report.parameters or {})
+    except (ImproperlyConfigured, ValueError) as e:
+        messages.error(request, str(e))
+        return redirect('admin_portal:dashboard')
+
+    filename = slugify(report.title) or f'report-{report.pk}'
+    return exports.streaming_response(header, rows, export_format, filename)
@@ -128,3 +128,98 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'CustomUser.CustomUser'
+
+
+# Invoice and purchase order numbering
+# Number of sequence values each worker process reserves per database round trip
+
+DOCUMENT_SEQUENCE_BLOCK_SIZE = 1
+
+
+# POS cart reservations
+# Seconds a cart holds stock after its last change before the sweeper reclaims it
+
+STOCK_RESERVATION_TTL = 15 * 60
+
+
+# Idempotency keys for POS mutations
+# Seconds a stored response can be replayed to a retrying client
+
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+
+
+# Offline POS sync
+# Maximum number of queued sales accepted in one upload, and how far (as a
+# fraction) a tablet's snapshot price may stray from the current list price
+
+OFFLINE_SYNC_MAX_BATCH = 500
+OFFLINE_PRICE_TOLERANCE = 0.2
+
+
+# Barcode scan cache
+# Codes each worker process keeps resolved in memory
+
+BARCODE_CACHE_SIZE = 10000
+
+
+# Customer lookup
+# Country code assumed for numbers typed in national format, and results per page
+
+DEFAULT_PHONE_COUNTRY_CODE = '234'
+CUSTOMER_SEARCH_LIMIT = 20
+
+
+# POS typeahead
+# Completions returned per keystroke by the in-memory product index
+
+AUTOCOMPLETE_LIMIT = 10
+
+
+# Sales analytics
+# Parquet file the reports read instead of querying the sales tables
+
+ANALYTICS_STORE_PATH = BASE_DIR / 'analytics' / 'sales_facts.parquet'
+
+
+# Background reports
+# Worker processes per run_report_workers, reports a user may have pending,
+# tries per report, and seconds without a heartbeat before a job is handed back
+
+REPORT_WORKERS = 2
+REPORT_JOBS_PER_USER = 3
+REPORT_JOB_MAX_ATTEMPTS = 3
+REPORT_JOB_STALE_SECONDS = 900
+
+
+# Report cache
+# Generated reports are reused until their data changes; evict_reports removes
+# those unused for this many days, then the least recently used above this size
+
+REPORT_CACHE_MAX_AGE_DAYS = 30
+REPORT_CACHE_MAX_MB = 2048
+
+
+# Notifications
+# Sent and failed notifications older than this are removed by purge_notifications
+
+NOTIFICATION_RETENTION_DAYS = 90
+
+
+# Notification delivery
+# Local stand-ins: emails are written to files and texts to a JSON lines file.
+# Point EMAIL_BACKEND at SMTP and SMS_BACKEND at a gateway backend in production.
+
+EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
+EMAIL_FILE_PATH = BASE_DIR / 'outbox' / 'email'
+SMS_BACKEND = 'AdminPanel.sms.FileBackend'
+SMS_FILE_PATH = BASE_DIR / 'outbox' / 'sms.jsonl'
+NOTIFICATION_BATCH_SIZE = 200
+NOTIFICATION_MAX_ATTEMPTS = 5
+NOTIFICATION_RETRY_SECONDS = 60
+NOTIFICATION_CLAIM_SECONDS = 300
+
+
+# List pages
+# Rows per page for keyset-paginated lists; ?limit= may ask for up to 200
+
+LIST_PAGE_SIZE = 50
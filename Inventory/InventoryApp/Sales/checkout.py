@@ -0,0 +1,155 @@
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+
+from inventory.models import Inventory
+from inventory.stock import InsufficientStockError, deduct_stock_bulk
+from Staff.reservations import with_reserved
+from .models import Sale, SaleItem
+from .rollup import record_sale
+
+
+class CheckoutError(ValueError):
+    """Raised when a cart cannot be turned into a sale"""
+
+
+def to_decimal(value, field):
+    try:
+        amount = Decimal(str(value or 0))
+    except (InvalidOperation, ValueError):
+        raise CheckoutError(f"Invalid value for {field}: {value!r}")
+    # NaN and Infinity parse, but raise InvalidOperation in any later comparison
+    if not amount.is_finite():
+        raise CheckoutError(f"Invalid value for {field}: {value!r}")
+    return amount
+
+
+def normalize_cart(items):
+    """Validate raw cart lines and return them as (product_id, quantity, discount) tuples"""
+    if not items:
+        raise CheckoutError("Cart is empty")
+
+    lines = []
+    for index, item in enumerate(items, start=1):
+        try:
+            product_id = int(item['product_id'])
+            quantity = int(item.get('quantity', 1))
+        except (KeyError, TypeError, ValueError):
+            raise CheckoutError(f"Line {index}: product_id and quantity must be integers")
+        if quantity < 1:
+            raise CheckoutError(f"Line {index}: quantity must be at least 1")
+
+        discount = to_decimal(item.get('discount'), f"line {index} discount")
+        if discount < 0:
+            raise CheckoutError(f"Line {index}: discount cannot be negative")
+        lines.append((product_id, quantity, discount))
+
+    return lines
+
+
+def line_total(unit_price, quantity, discount, index):
+    """What a cart line comes to; a discount may not take it below zero"""
+    gross = unit_price * quantity
+    if discount > gross:
+        raise CheckoutError(f"Line {index}: discount is more than the line total of {gross}")
+    return gross - discount
+
+
+def check_order_amounts(subtotal, tax_amount, discount_amount):
+    """Reject order-level tax and discount that would make the sale total negative"""
+    if tax_amount < 0:
+        raise CheckoutError("tax_amount cannot be negative")
+    if discount_amount < 0:
+        raise CheckoutError("discount_amount cannot be negative")
+    if discount_amount > subtotal + tax_amount:
+        raise CheckoutError("discount_amount is more than the sale total")
+
+
+def checkout(branch, staff, items, customer=None, payment_method='cash', discount_amount=0,
+             tax_amount=0, notes=None, session=None):
+    """
+    Turn a whole cart into a completed sale in a single transaction.
+
+    Stock for every line is checked with one query, the items are written
+    with one bulk insert, and inventory is decremented with one batched
+    conditional update. Totals are computed once, before the sale row is
+    written, so SaleItem.save() never has to re-sum the cart.
+
+    Stock held by other carts' reservations is not available to this sale.
+    When the cart belongs to a POS `session`, its own holds are consumed.
+    """
+    lines = normalize_cart(items)
+    discount_amount = to_decimal(discount_amount, 'discount_amount')
+    tax_amount = to_decimal(tax_amount, 'tax_amount')
+
+    if payment_method not in dict(Sale.PAYMENT_METHOD_CHOICES):
+        raise CheckoutError(f"Unknown payment method: {payment_method}")
+
+    quantities = {}
+    for product_id, quantity, _ in lines:
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+
+    with transaction.atomic():
+        # Lock the rows as reservations.sell() does, so a hold placed while we check cannot be sold
+        rows = with_reserved(Inventory.objects.select_for_update().filter(branch=branch, product_id__in=quantities),
+                             branch, exclude_session=session)
+        stock = {
+            row['product_id']: row
+            for row in rows.values('product_id', 'quantity', 'reserved', 'average_cost', 'product__selling_price',
+                                   'product__cost_price', 'product__is_active')
+        }
+
+        for product_id, quantity in quantities.items():
+            row = stock.get(product_id)
+            if row is None or not row['product__is_active']:
+                raise CheckoutError(f"Product #{product_id} is not sold at this branch")
+            available = row['quantity'] - row['reserved']
+            if available < quantity:
+                raise InsufficientStockError(product_id, branch.pk, quantity, max(available, 0))
+
+        sale_items = []
+        subtotal = Decimal('0')
+        for index, (product_id, quantity, discount) in enumerate(lines, start=1):
+            row = stock[product_id]
+            unit_price = row['product__selling_price']
+            total_price = line_total(unit_price, quantity, discount, index)
+            subtotal += total_price
+            sale_items.append(SaleItem(
+                product_id=product_id,
+                quantity=quantity,
+                unit_price=unit_price,
+                unit_cost=row['product__cost_price'] if row['average_cost'] is None else row['average_cost'],
+                discount=discount,
+                total_price=total_price,
+            ))
+        check_order_amounts(subtotal, tax_amount, discount_amount)
+
+        sale = Sale(
+            branch=branch,
+            staff=staff,
+            customer=customer,
+            payment_method=payment_method,
+            subtotal=subtotal,
+            tax_amount=tax_amount,
+            discount_amount=discount_amount,
+            total_amount=subtotal + tax_amount - discount_amount,
+            notes=notes,
+            is_completed=True,
+            pos_session=session,
+        )
+        sale.save()
+
+        for sale_item in sale_items:
+            sale_item.sale = sale
+        SaleItem.objects.bulk_create(sale_items)
+
+        # The stock read above is only a fast pre-check; this conditional
+        # update is what actually guards against concurrent sellers
+        deduct_stock_bulk(branch, quantities, reference_type='sale', reference_id=sale.pk, user=staff)
+        record_sale(sale)
+
+        if session is not None:
+            session.reservations.all().delete()
+            session.update_sales_totals(sale)
+
+    return sale
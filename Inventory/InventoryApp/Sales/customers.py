@@ -0,0 +1,85 @@
+import base64
+import binascii
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Q
+
+from .models import Customer, CustomerNameToken
+from .normalize import WORD, email_token, fold, looks_like_phone, phone_prefix, prefix_upper_bound
+
+MAX_LIMIT = 50
+
+
+def default_limit():
+    return getattr(settings, 'CUSTOMER_SEARCH_LIMIT', 20)
+
+
+def _encode_cursor(key, pk):
+    return base64.urlsafe_b64encode(f'{key}\x00{pk}'.encode()).decode()
+
+
+def _decode_cursor(cursor):
+    try:
+        key, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('\x00')
+        return key, int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def _after(field, cursor):
+    # Keyset continuation on (field, customer id), which is the index order
+    position = _decode_cursor(cursor) if cursor else None
+    if position is None:
+        return Q()
+    key, pk = position
+    id_field = 'pk' if field == 'phone_key' else 'customer_id'
+    return Q(**{f'{field}__gt': key}) | Q(**{field: key, f'{id_field}__gt': pk})
+
+
+def search_customers(query, limit=None, cursor=None):
+    """
+    Find customers by the start of their phone number, name words or email.
+
+    Phone-like input is normalised the same way stored numbers are, so
+    "+234 803", "0803" and "803" all match +234803...; anything else matches
+    customers having a word starting with every word typed. Both paths are
+    range scans over an index, capped at `limit` rows per page. Returns
+    (customers, next_cursor); next_cursor is None on the last page.
+    """
+    limit = max(1, min(int(limit or default_limit()), MAX_LIMIT))
+    query = (query or '').strip()
+
+    if looks_like_phone(query):
+        prefix = phone_prefix(query)
+        rows = list(Customer.objects.filter(
+            _after('phone_key', cursor),
+            phone_key__gte=prefix,
+            phone_key__lt=prefix_upper_bound(prefix),
+        ).order_by('phone_key', 'pk').values_list('phone_key', 'pk')[:limit + 1])
+    else:
+        if '@' in query:
+            words = [email_token(query)]
+        else:
+            words = sorted(WORD.findall(fold(query)), key=len, reverse=True)
+        if not words:
+            return [], None
+
+        # Drive the scan from the most selective (longest) word; the rest must also match
+        tokens = CustomerNameToken.objects.filter(
+            _after('token', cursor),
+            token__gte=words[0],
+            token__lt=prefix_upper_bound(words[0]),
+        )
+        for word in words[1:]:
+            tokens = tokens.filter(Exists(CustomerNameToken.objects.filter(
+                customer_id=OuterRef('customer_id'),
+                token__gte=word,
+                token__lt=prefix_upper_bound(word),
+            )))
+        rows = list(tokens.order_by('token', 'customer_id').values_list('token', 'customer_id')[:limit + 1])
+
+    next_cursor = _encode_cursor(*rows[limit - 1]) if len(rows) > limit else None
+    ids = list(dict.fromkeys(pk for _, pk in rows[:limit]))
+
+    customers = Customer.objects.in_bulk(ids)
+    return [customers[pk] for pk in ids if pk in customers], next_cursor
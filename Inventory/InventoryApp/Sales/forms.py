@@ -35,6 +35,9 @@ class SaleItemForm(forms.ModelForm):
         branch = kwargs.pop('branch', None)
         super().__init__(*args, **kwargs)
 
+        # Store branch for the stock check in clean()
+        self.branch = branch
+
         # Product dropdown should only show items in stock
         if branch:
             self.fields['product'].queryset = self.fields['product'].queryset.filter(
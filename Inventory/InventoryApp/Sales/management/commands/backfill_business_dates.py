@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from inventory.models import Branch, Purchase
+from Sales.models import Sale
+
+
+class Command(BaseCommand):
+    help = ('Recompute the trading day of existing sales and purchases from their branch time zone and cutoff. '
+            'Run it after adding the column with a placeholder default, and after changing a branch\'s time zone '
+            'or cutoff; rebuild the sales rollup afterwards when any dates moved.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows processed per transaction')
+        parser.add_argument('--branch', type=int, help='Only this branch')
+
+    def handle(self, *args, **options):
+        branches = Branch.objects.in_bulk()
+        changed = 0
+        for model, date_field in ((Sale, 'sale_date'), (Purchase, 'purchase_date')):
+            rows = model.objects.all()
+            if options['branch']:
+                rows = rows.filter(branch_id=options['branch'])
+            changed += self._backfill(model, rows, date_field, branches, options['chunk_size'])
+
+        if changed:
+            self.stdout.write(self.style.WARNING('Dates moved; run rebuild_sales_rollup to bring the rollup in line'))
+        self.stdout.write(self.style.SUCCESS(f'Set the business date of {changed} rows'))
+
+    def _backfill(self, model, rows, date_field, branches, chunk_size):
+        name = model._meta.verbose_name_plural
+        last_pk = 0
+        processed = changed = 0
+
+        while True:
+            chunk = list(rows.filter(pk__gt=last_pk).order_by('pk').values_list(
+                'pk', 'branch_id', date_field, 'business_date')[:chunk_size])
+            if not chunk:
+                break
+
+            # Rows in a chunk fall on a handful of days, so write one UPDATE per day
+            days = {}
+            for pk, branch_id, moment, stored in chunk:
+                day = branches[branch_id].business_date(moment)
+                if day != stored:
+                    days.setdefault(day, []).append(pk)
+
+            with transaction.atomic():
+                # Moving a row to another day changes the reports it falls in, so bump the cache watermark too
+                now = timezone.now()
+                for day, ids in days.items():
+                    model.objects.filter(pk__in=ids).update(business_date=day, updated_at=now)
+
+            last_pk = chunk[-1][0]
+            processed += len(chunk)
+            changed += sum(len(ids) for ids in days.values())
+            self.stdout.write(f'{processed} {name} checked, {changed} updated')
+
+        return changed
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from Sales.models import Customer, CustomerNameToken
+from Sales.normalize import name_tokens, normalize_phone
+
+
+class Command(BaseCommand):
+    help = 'Normalise phone keys and rebuild name search tokens for existing customers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Customers processed per transaction')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        last_pk = 0
+        processed = 0
+
+        while True:
+            rows = list(Customer.objects.filter(pk__gt=last_pk).order_by('pk').values_list(
+                'pk', 'name', 'email', 'phone_number')[:chunk_size])
+            if not rows:
+                break
+
+            with transaction.atomic():
+                # An upsert on the primary key writes the whole chunk in one statement;
+                # only phone_key is touched on the existing rows
+                Customer.objects.bulk_create(
+                    [Customer(pk=pk, name=name, email=email, phone_number=phone_number,
+                              phone_key=normalize_phone(phone_number))
+                     for pk, name, email, phone_number in rows],
+                    update_conflicts=True,
+                    unique_fields=['pk'],
+                    update_fields=['phone_key'],
+                )
+                ids = [pk for pk, _, _, _ in rows]
+                CustomerNameToken.objects.filter(customer_id__in=ids).delete()
+                CustomerNameToken.objects.bulk_create([
+                    CustomerNameToken(customer_id=pk, token=token)
+                    for pk, name, email, _ in rows
+                    for token in name_tokens(name, email)
+                ])
+
+            last_pk = rows[-1][0]
+            processed += len(rows)
+            self.stdout.write(f'{processed} customers normalised')
+
+        self.stdout.write(self.style.SUCCESS(f'Backfilled {processed} customers'))
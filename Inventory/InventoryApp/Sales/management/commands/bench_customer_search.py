@@ -0,0 +1,86 @@
+import random
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max
+
+from Sales.customers import search_customers
+from Sales.models import Customer
+
+FIRST_NAMES = ('Adaeze Chinedu Emeka Fatima Ibrahim Ngozi Oluwaseun Tunde Yusuf Zainab Bola Kemi Musa Aisha '
+               'Chioma Femi Halima Ifeanyi Kelechi Nneka Segun Tobi Uche Amaka').split()
+LAST_NAMES = ('Okafor Adeyemi Bello Eze Mohammed Okonkwo Balogun Nwosu Abubakar Olawale Danjuma Ogunleye '
+              'Chukwu Lawal Obi Salami Umar Nnamdi Afolabi Ibe').split()
+
+
+class Command(BaseCommand):
+    help = 'Time customer lookups by partial phone number and name on a large customer table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=1000000, help='Synthetic customers to load')
+        parser.add_argument('--queries', type=int, default=2000, help='Lookups to time')
+        parser.add_argument('--target-ms', type=float, default=10.0, help='Fail when p95 latency exceeds this')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        total = options['customers']
+        rng = random.Random(options['seed'])
+        first_new = (Customer.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+        try:
+            self.stdout.write(f'Loading {total} customers...')
+            numbers = []
+            for start in range(0, total, 20000):
+                batch = []
+                for _ in range(start, min(start + 20000, total)):
+                    local = f"{rng.choice(('803', '806', '813', '703', '810', '905'))}{rng.randrange(10 ** 7):07d}"
+                    numbers.append(local)
+                    # Numbers arrive in every format the cashiers have ever used
+                    phone = rng.choice((f'0{local}', f'+234{local}', f'234{local}', f'0{local[:3]} {local[3:]}'))
+                    batch.append(Customer(name=f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+                                          phone_number=phone[:15]))
+                Customer.objects.bulk_create(batch)
+
+            # bulk_create skips save(), so this also exercises the backfill
+            started = time.perf_counter()
+            call_command('backfill_customer_keys', stdout=open('/dev/null', 'w'))
+            self.stdout.write(f'Backfill:         {time.perf_counter() - started:.1f} s')
+
+            queries = []
+            for _ in range(options['queries']):
+                local = rng.choice(numbers)
+                queries.append(rng.choice((
+                    f'0{local[:rng.randint(3, 9)]}',
+                    f'+234 {local[:3]} {local[3:rng.randint(4, 9)]}',
+                    local[:rng.randint(4, 9)],
+                    rng.choice(FIRST_NAMES)[:rng.randint(2, 5)],
+                    f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)[:rng.randint(1, 4)]}',
+                )))
+
+            timings = []
+            found = 0
+            for query in queries:
+                started = time.perf_counter()
+                customers, next_cursor = search_customers(query)
+                if next_cursor:
+                    search_customers(query, cursor=next_cursor)
+                timings.append((time.perf_counter() - started) * 1000 / (2 if next_cursor else 1))
+                found += bool(customers)
+
+            timings.sort()
+            p95 = timings[int(len(timings) * 0.95) - 1]
+            self.stdout.write(f'Queries:          {len(queries)} ({found} with results)')
+            self.stdout.write(f'Latency per page: p50 {timings[len(timings) // 2]:.2f} ms, p95 {p95:.2f} ms, '
+                              f'max {timings[-1]:.2f} ms')
+
+            if found != len(queries):
+                raise CommandError('Some lookups for existing customers returned nothing')
+            if p95 > options['target_ms']:
+                raise CommandError(f"p95 {p95:.2f} ms is over the {options['target_ms']} ms target")
+            self.stdout.write(self.style.SUCCESS('Customer lookups are within target'))
+        finally:
+            # Remove the synthetic customers in id ranges to keep each delete small
+            last = Customer.objects.aggregate(last=Max('pk'))['last'] or 0
+            for start in range(first_new, last + 1, 5000):
+                Customer.objects.filter(pk__gte=start, pk__lt=start + 5000).delete()
@@ -0,0 +1,99 @@
+import random
+import time
+import uuid
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from inventory.models import Branch, Brand, Category, Inventory, Product, StockMovement
+from Sales.models import Sale, SaleItem
+from Sales.offline import ingest_offline_sales
+
+
+class Command(BaseCommand):
+    help = 'Replay a synthetic backlog of offline POS sales through the batch sync'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sales', type=int, default=10000, help='Queued offline sales to sync')
+        parser.add_argument('--batch-size', type=int, default=500, help='Sales uploaded per request')
+        parser.add_argument('--products', type=int, default=200, help='Products on the shelf')
+        parser.add_argument('--stock', type=int, default=100, help='Units of each product before the outage')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        total = options['sales']
+        batch_size = options['batch_size']
+        stock = options['stock']
+        rng = random.Random(options['seed'])
+
+        tag = uuid.uuid4().hex[:8]
+        category = Category.objects.create(name=f'bench-{tag}')
+        brand = Brand.objects.create(name=f'bench-{tag}')
+        branch = Branch.objects.create(name=f'bench-{tag}', address='-', phone_number='-')
+
+        try:
+            products = Product.objects.bulk_create([
+                Product(product_type='accessory', name=f'Bench {tag} #{i}', sku=f'BENCH-{tag}-{i}',
+                        category=category, brand=brand, cost_price=1, selling_price=2)
+                for i in range(options['products'])
+            ])
+            Inventory.objects.bulk_create([
+                Inventory(product=product, branch=branch, quantity=stock) for product in products
+            ])
+
+            # A week-long outage; the shelf is deliberately oversold so some sales conflict
+            started_at = timezone.now() - timedelta(days=7)
+            queued = []
+            for i in range(total):
+                queued.append({
+                    'client_id': f'{tag}-{i}',
+                    'sale_date': (started_at + timedelta(seconds=i * 60)).isoformat(),
+                    'payment_method': rng.choice(['cash', 'credit_card', 'mobile_payment']),
+                    'items': [
+                        {'product_id': product.pk, 'quantity': rng.randint(1, 3)}
+                        for product in rng.sample(products, rng.randint(1, 3))
+                    ],
+                })
+            batches = [queued[i:i + batch_size] for i in range(0, total, batch_size)]
+
+            counts = {}
+            queries = 0
+            started = time.perf_counter()
+            for batch in batches:
+                with CaptureQueriesContext(connection) as captured:
+                    results = ingest_offline_sales(branch, None, batch)
+                queries += len(captured)
+                for result in results:
+                    counts[result['status']] = counts.get(result['status'], 0) + 1
+            elapsed = time.perf_counter() - started
+
+            # A tablet that never saw the acknowledgement uploads its first batch again
+            replay = ingest_offline_sales(branch, None, batches[0])
+
+            sales = Sale.objects.filter(branch=branch)
+            sold = sum(SaleItem.objects.filter(sale__branch=branch).values_list('quantity', flat=True))
+            on_hand = sum(Inventory.objects.filter(branch=branch).values_list('quantity', flat=True))
+            ledger = -sum(StockMovement.objects.filter(branch=branch).values_list('quantity', flat=True))
+
+            self.stdout.write(f'Sales:            {total} in {len(batches)} batches of {batch_size}')
+            self.stdout.write(f'Elapsed:          {elapsed:.2f} s ({total / elapsed:.0f} sales/s)')
+            self.stdout.write(f'Queries:          {queries} ({queries / len(batches):.1f} per batch)')
+            self.stdout.write(f'Results:          {counts}')
+
+            if any(result['status'] == 'created' for result in replay):
+                raise CommandError('Replaying a synced batch created new sales')
+            if sales.count() != counts.get('created', 0):
+                raise CommandError('Created sales do not match the sync results')
+            if sold + on_hand != stock * len(products) or sold != ledger:
+                raise CommandError(f'Stock does not reconcile: sold {sold}, on hand {on_hand}, ledger {ledger}')
+            if sales.values('invoice_number').distinct().count() != sales.count():
+                raise CommandError('Duplicate invoice numbers were assigned')
+            self.stdout.write(self.style.SUCCESS('Stock, ledger and invoice numbers reconcile; replay was deduplicated'))
+        finally:
+            branch.delete()
+            Product.objects.filter(category=category).delete()
+            category.delete()
+            brand.delete()
@@ -0,0 +1,60 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Max, Min, Sum
+from django.utils import timezone
+
+from Sales.models import Sale, SalesDailyRollup
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily sales rollup from the sales table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start', help='First business date to rebuild (YYYY-MM-DD). '
+                                                         'Defaults to the first sale.')
+        parser.add_argument('--to', dest='end', help='Last business date to rebuild (YYYY-MM-DD). '
+                                                     'Defaults to today.')
+        parser.add_argument('--days', type=int, default=31, help='Business days rebuilt per transaction')
+
+    def _date(self, value, option):
+        try:
+            return datetime.date.fromisoformat(value)
+        except ValueError:
+            raise CommandError(f'{option} must be a date in YYYY-MM-DD format')
+
+    def handle(self, *args, **options):
+        bounds = Sale.objects.aggregate(first=Min('business_date'), last=Max('business_date'))
+        # Days that have lost all their sales, e.g. to a backfill moving them, still need their rows cleared
+        first_rolled_up = SalesDailyRollup.objects.aggregate(first=Min('business_date'))['first']
+        first = min((day for day in (bounds['first'], first_rolled_up) if day), default=None)
+        if first is None and not options['start']:
+            self.stdout.write('No sales to roll up')
+            return
+
+        start = self._date(options['start'], '--from') if options['start'] else first
+        # Branches east of the site time zone may already be trading tomorrow
+        end = self._date(options['end'], '--to') if options['end'] else max(
+            timezone.localdate() + datetime.timedelta(days=1), bounds['last'] or start)
+        step = datetime.timedelta(days=options['days'])
+        rows_written = 0
+
+        day = start
+        while day <= end:
+            last_day = min(day + step - datetime.timedelta(days=1), end)
+            totals = Sale.objects.filter(
+                is_completed=True, business_date__gte=day, business_date__lte=last_day,
+            ).values('business_date', 'branch_id', 'staff_id', 'payment_method').annotate(
+                sale_count=Count('id'), total_amount=Sum('total_amount'),
+            ).order_by()
+
+            with transaction.atomic():
+                SalesDailyRollup.objects.filter(business_date__gte=day, business_date__lte=last_day).delete()
+                created = SalesDailyRollup.objects.bulk_create([SalesDailyRollup(**row) for row in totals])
+
+            rows_written += len(created)
+            self.stdout.write(f'{day} .. {last_day}: {len(created)} rollup rows')
+            day = last_day + datetime.timedelta(days=1)
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rows_written} rollup rows from {start} to {end}'))
@@ -0,0 +1,92 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+
+from inventory.models import Purchase, PurchaseItem
+from Sales.models import Sale, SaleItem
+
+
+class Command(BaseCommand):
+    help = 'Repair drifted sale and purchase totals in batches, one aggregate query per chunk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', choices=('sales', 'purchases', 'all'), default='all')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Parent rows checked per batch')
+        parser.add_argument('--dry-run', action='store_true', help='Report drift without writing fixes')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        dry_run = options['dry_run']
+
+        if options['model'] in ('sales', 'all'):
+            checked, fixed = self._repair_sales(chunk_size, dry_run)
+            self.stdout.write(f'Sales: checked {checked}, drifted {fixed}')
+
+        if options['model'] in ('purchases', 'all'):
+            checked, fixed = self._repair_purchases(chunk_size, dry_run)
+            self.stdout.write(f'Purchases: checked {checked}, drifted {fixed}')
+
+        if dry_run:
+            self.stdout.write(self.style.WARNING('Dry run, no totals were changed'))
+
+    def _chunks(self, queryset, fields, chunk_size):
+        """Walk a table in primary key order without OFFSET scans"""
+        last_pk = 0
+        while True:
+            rows = list(queryset.filter(pk__gt=last_pk).order_by('pk').values_list('pk', *fields)[:chunk_size])
+            if not rows:
+                return
+            yield rows
+            last_pk = rows[-1][0]
+
+    def _repair_sales(self, chunk_size, dry_run):
+        checked = fixed = 0
+        fields = ('subtotal', 'tax_amount', 'discount_amount', 'total_amount')
+
+        for rows in self._chunks(Sale.objects.all(), fields, chunk_size):
+            sums = dict(
+                SaleItem.objects.filter(sale_id__gte=rows[0][0], sale_id__lte=rows[-1][0])
+                .values('sale_id').annotate(total=Sum('total_price')).values_list('sale_id', 'total')
+            )
+
+            drifted = []
+            for pk, subtotal, tax_amount, discount_amount, total_amount in rows:
+                expected_subtotal = sums.get(pk) or Decimal('0')
+                expected_total = expected_subtotal + tax_amount - discount_amount
+                if subtotal != expected_subtotal or total_amount != expected_total:
+                    drifted.append(Sale(pk=pk, subtotal=expected_subtotal, total_amount=expected_total))
+
+            if drifted and not dry_run:
+                with transaction.atomic():
+                    Sale.objects.bulk_update(drifted, ['subtotal', 'total_amount'])
+
+            checked += len(rows)
+            fixed += len(drifted)
+
+        return checked, fixed
+
+    def _repair_purchases(self, chunk_size, dry_run):
+        checked = fixed = 0
+
+        for rows in self._chunks(Purchase.objects.all(), ('total_amount',), chunk_size):
+            sums = dict(
+                PurchaseItem.objects.filter(purchase_id__gte=rows[0][0], purchase_id__lte=rows[-1][0])
+                .values('purchase_id').annotate(total=Sum('total_price')).values_list('purchase_id', 'total')
+            )
+
+            drifted = []
+            for pk, total_amount in rows:
+                expected_total = sums.get(pk) or Decimal('0')
+                if total_amount != expected_total:
+                    drifted.append(Purchase(pk=pk, total_amount=expected_total))
+
+            if drifted and not dry_run:
+                with transaction.atomic():
+                    Purchase.objects.bulk_update(drifted, ['total_amount'])
+
+            checked += len(rows)
+            fixed += len(drifted)
+
+        return checked, fixed
@@ -0,0 +1,84 @@
+import threading
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, OperationalError, connection
+from django.test.utils import override_settings
+
+from inventory.models import Branch, Purchase, Supplier
+from Sales.models import Sale
+
+
+class Command(BaseCommand):
+    help = 'Insert sales or purchases from many threads at once and verify no document number is duplicated'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=('sale', 'purchase'), default='sale')
+        parser.add_argument('--workers', type=int, default=16, help='Number of concurrent writers')
+        parser.add_argument('--per-worker', type=int, default=250, help='Documents inserted by each writer')
+        parser.add_argument('--block-size', type=int, default=1,
+                            help='Values each process reserves per round trip (DOCUMENT_SEQUENCE_BLOCK_SIZE)')
+        parser.add_argument('--keep', action='store_true', help='Keep the generated rows')
+
+    def handle(self, *args, **options):
+        kind = options['kind']
+        workers = options['workers']
+        per_worker = options['per_worker']
+
+        tag = uuid.uuid4().hex[:8]
+        branch = Branch.objects.create(name=f'stress-{tag}', address='-', phone_number='-')
+        supplier = Supplier.objects.create(name=f'stress-{tag}', phone_number='-') if kind == 'purchase' else None
+
+        created = [[] for _ in range(workers)]
+        errors = []
+        barrier = threading.Barrier(workers)
+
+        def writer(index):
+            barrier.wait()
+            try:
+                for _ in range(per_worker):
+                    while True:
+                        try:
+                            if kind == 'sale':
+                                document = Sale.objects.create(branch=branch)
+                                created[index].append(document.invoice_number)
+                            else:
+                                document = Purchase.objects.create(branch=branch, supplier=supplier)
+                                created[index].append(document.reference_number)
+                            break
+                        except OperationalError:
+                            # SQLite lock timeout under heavy contention, try again
+                            continue
+                        except IntegrityError as e:
+                            errors.append(str(e))
+                            break
+            finally:
+                connection.close()
+
+        with override_settings(DOCUMENT_SEQUENCE_BLOCK_SIZE=options['block_size']):
+            threads = [threading.Thread(target=writer, args=(i,)) for i in range(workers)]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+
+        numbers = [number for batch in created for number in batch]
+        duplicates = len(numbers) - len(set(numbers))
+
+        try:
+            self.stdout.write(f'Inserted:     {len(numbers)} {kind}s ({len(numbers) / elapsed:.0f}/s)')
+            self.stdout.write(f'Duplicates:   {duplicates}')
+            self.stdout.write(f'Collisions:   {len(errors)}')
+            self.stdout.write(f'Elapsed:      {elapsed:.3f}s')
+
+            if duplicates or errors or len(numbers) != workers * per_worker:
+                raise CommandError('Document numbering is not collision free')
+            self.stdout.write(self.style.SUCCESS('All document numbers are unique'))
+        finally:
+            if not options['keep']:
+                branch.delete()
+                if supplier:
+                    supplier.delete()
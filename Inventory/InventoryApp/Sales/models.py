@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Q
 from django.conf import settings
 from django.core.validators import MinValueValidator
 from django.db.models.signals import post_save
@@ -6,19 +7,62 @@ from django.dispatch import receiver
 from django.utils import timezone
 import uuid
 
+from inventory.sequences import next_value
+from .normalize import name_tokens, normalize_phone
+
 
 class Customer(models.Model):
     """Model for customer information"""
     name = models.CharField(max_length=100)
     email = models.EmailField(blank=True, null=True)
     phone_number = models.CharField(max_length=15)
+    phone_key = models.CharField(max_length=20, blank=True, default='', db_index=True)  # E.164, for lookups
     address = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)  # Watermark for report caching
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at']),
+        ]
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what the search tokens were built from so save() can skip rebuilding them
+        instance._stored_tokens = name_tokens(instance.__dict__.get('name'), instance.__dict__.get('email'))
+        return instance
+
+    def save(self, *args, **kwargs):
+        # Keep the lookup key in step with the number as typed
+        self.phone_key = normalize_phone(self.phone_number)
+        tokens = name_tokens(self.name, self.email)
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+            if tokens != getattr(self, '_stored_tokens', None):
+                self.name_tokens.all().delete()
+                CustomerNameToken.objects.bulk_create([
+                    CustomerNameToken(customer=self, token=token) for token in tokens
+                ])
+                self._stored_tokens = tokens
+
+
+class CustomerNameToken(models.Model):
+    """One searchable word of a customer's name (or their email), for indexed prefix lookups"""
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='name_tokens')
+    token = models.CharField(max_length=64)
+
+    class Meta:
+        unique_together = ('token', 'customer')
+
+    def __str__(self):
+        return f"{self.token} -> {self.customer_id}"
+
 
 class Sale(models.Model):
     """Model for sales transactions"""
@@ -31,60 +75,145 @@ class Sale(models.Model):
     )
 
     sale_date = models.DateTimeField(default=timezone.now)
+    business_date = models.DateField(editable=False)  # The branch's trading day, set on save; a keyset sort column
     invoice_number = models.CharField(max_length=50, unique=True)
+    client_reference = models.CharField(max_length=64, unique=True, blank=True, null=True)  # Offline POS sale id
     customer = models.ForeignKey(Customer, on_delete=models.SET_NULL, null=True, blank=True, related_name='sales')
     branch = models.ForeignKey('inventory.Branch', on_delete=models.CASCADE, related_name='sales')
     staff = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, related_name='sales')
+    pos_session = models.ForeignKey('Staff.POSSession', on_delete=models.SET_NULL, null=True, blank=True,
+                                    related_name='sales')
     payment_method = models.CharField(max_length=20, choices=PAYMENT_METHOD_CHOICES, default='cash')
     subtotal = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     tax_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     discount_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     notes = models.TextField(blank=True, null=True)
+    is_completed = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)  # Watermark for analytics and report caching
+
+    class Meta:
+        indexes = [
+            # Sales history and reports only ever read completed sales, by trading day and then time,
+            # so one index serves both the date filter and the order
+            models.Index(fields=['branch', 'business_date', 'sale_date'], condition=Q(is_completed=True),
+                         name='sale_completed_branch_day'),
+            models.Index(fields=['business_date', 'sale_date'], condition=Q(is_completed=True),
+                         name='sale_completed_day'),
+        ]
 
     def __str__(self):
         return f"Invoice #{self.invoice_number} - {self.sale_date.strftime('%Y-%m-%d')}"
 
+    @staticmethod
+    def build_invoice_number(branch_id, day, number):
+        return f"INV-{branch_id:03d}-{day:%Y%m%d}-{number:04d}"
+
     def save(self, *args, **kwargs):
-        # Auto-generate invoice number if not provided
+        self.business_date = self.branch.business_date(self.sale_date)
+
+        # Auto-generate invoice number if not provided, numbered within the branch's trading day
         if not self.invoice_number:
-            today = timezone.now().strftime('%Y%m%d')
-            last_sale = Sale.objects.filter(invoice_number__startswith=f"INV-{today}").order_by('-id').first()
-            if last_sale:
-                last_number = int(last_sale.invoice_number.split('-')[-1])
-                self.invoice_number = f"INV-{today}-{str(last_number + 1).zfill(4)}"
-            else:
-                self.invoice_number = f"INV-{today}-0001"
+            number = next_value('invoice', self.branch_id, self.business_date)
+            self.invoice_number = self.build_invoice_number(self.branch_id, self.business_date, number)
 
         super().save(*args, **kwargs)
 
+    def update_totals(self):
+        """Recompute the grand total from the running subtotal and reload both"""
+        Sale.objects.filter(pk=self.pk).update(
+            total_amount=F('subtotal') + F('tax_amount') - F('discount_amount'),
+            updated_at=timezone.now(),
+        )
+        self.refresh_from_db(fields=['subtotal', 'total_amount'])
+
+
+class SalesDailyRollup(models.Model):
+    """Completed sales per branch, cashier, business day and payment method, kept current as sales close"""
+    branch = models.ForeignKey('inventory.Branch', on_delete=models.CASCADE, related_name='sales_rollups')
+    staff = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True,
+                              related_name='sales_rollups')
+    business_date = models.DateField()
+    payment_method = models.CharField(max_length=20, choices=Sale.PAYMENT_METHOD_CHOICES)
+    sale_count = models.IntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ('business_date', 'branch', 'staff', 'payment_method')
+        constraints = [
+            # NULLs never clash in a unique index, so rows without a cashier need a key of their own
+            models.UniqueConstraint(fields=['business_date', 'branch', 'payment_method'],
+                                    condition=Q(staff__isnull=True), name='salesdailyrollup_key_no_staff'),
+        ]
+
+    def __str__(self):
+        return f"{self.business_date} {self.branch_id}/{self.staff_id} {self.payment_method}: {self.sale_count}"
+
 
 class SaleItem(models.Model):
     """Model for individual items in a sale"""
     sale = models.ForeignKey(Sale, on_delete=models.CASCADE, related_name='items')
-    product = models.ForeignKey('inventory.Product', on_delete=models.CASCADE, related_name='sale_items')
+    # Indexed together with the sale below, which also serves lookups by product alone
+    product = models.ForeignKey('inventory.Product', on_delete=models.CASCADE, related_name='sale_items',
+                                db_index=False)
     quantity = models.PositiveIntegerField()
     unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    unit_cost = models.DecimalField(max_digits=12, decimal_places=4, blank=True, null=True)  # Average cost when sold
     discount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     total_price = models.DecimalField(max_digits=12, decimal_places=2)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'sale']),
+        ]
+
     def __str__(self):
         return f"{self.product.name} ({self.quantity}) - {self.sale.invoice_number}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored total so save() only applies the difference
+        instance._stored_total_price = instance.__dict__.get('total_price')
+        return instance
+
     def save(self, *args, **kwargs):
+        from inventory.stock import unit_costs
+
         # Auto-calculate the total price
         self.total_price = (self.quantity * self.unit_price) - self.discount
-        super().save(*args, **kwargs)
 
-        # Update the sale total
-        self.sale.subtotal = sum(item.total_price for item in self.sale.items.all())
-        self.sale.total_amount = self.sale.subtotal + self.sale.tax_amount - self.sale.discount_amount
-        self.sale.save()
+        # Snapshot what the units cost the branch, unless the caller already did
+        if self.unit_cost is None:
+            self.unit_cost = unit_costs(self.sale.branch_id, [self.product_id]).get(self.product_id)
+
+        if self._state.adding:
+            previous_total = 0
+        else:
+            previous_total = getattr(self, '_stored_total_price', None)
+            if previous_total is None:
+                previous_total = SaleItem.objects.filter(pk=self.pk).values_list('total_price', flat=True).first() or 0
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+            # Update the sale total
+            self._apply_to_sale(self.total_price - previous_total)
+
+        self._stored_total_price = self.total_price
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            self._apply_to_sale(-self.total_price)
+        return result
 
-        # Update inventory
-        inventory = self.product.inventory.filter(branch=self.sale.branch).first()
-        if inventory:
-            inventory.quantity = max(0, inventory.quantity - self.quantity)
-            inventory.save()
+    def _apply_to_sale(self, delta):
+        """Shift the sale's subtotal and total by `delta` without re-reading its items"""
+        if delta:
+            Sale.objects.filter(pk=self.sale_id).update(
+                subtotal=F('subtotal') + delta,
+                total_amount=F('total_amount') + delta,
+                updated_at=timezone.now(),
+            )
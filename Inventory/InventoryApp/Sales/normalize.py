@@ -0,0 +1,72 @@
+import re
+import unicodedata
+
+from django.conf import settings
+
+NON_DIGITS = re.compile(r'\D')
+PHONE_QUERY = re.compile(r'^\+?[\d\s\-().]{3,}$')
+WORD = re.compile(r'\w+', re.UNICODE)
+
+# Longest national significant number we treat as local when it has no trunk prefix
+NATIONAL_NUMBER_LENGTH = 10
+MAX_TOKEN_LENGTH = 64
+
+
+def country_code():
+    return str(getattr(settings, 'DEFAULT_PHONE_COUNTRY_CODE', '234'))
+
+
+def _to_e164(raw, partial):
+    raw = (raw or '').strip()
+    digits = NON_DIGITS.sub('', raw)
+    if not digits:
+        return ''
+
+    if raw.startswith('+'):
+        return f'+{digits}'
+    if digits.startswith('00'):
+        return f'+{digits[2:]}'
+    if digits.startswith('0'):
+        # National format: swap the trunk 0 for the country code
+        return f'+{country_code()}{digits[1:]}'
+    if digits.startswith(country_code()) and (partial or len(digits) > NATIONAL_NUMBER_LENGTH):
+        return f'+{digits}'
+    return f'+{country_code()}{digits}'
+
+
+def normalize_phone(raw):
+    """Normalise a stored phone number to an E.164-style key, e.g. 0803 123 4567 -> +2348031234567"""
+    return _to_e164(raw, partial=False)
+
+
+def phone_prefix(query):
+    """Normalise the start of a phone number typed at the till the same way stored numbers are keyed"""
+    return _to_e164(query, partial=True)
+
+
+def looks_like_phone(query):
+    return bool(PHONE_QUERY.match(query.strip())) and len(NON_DIGITS.sub('', query)) >= 3
+
+
+def fold(text):
+    """Lowercase and strip accents so 'José' and 'jose' index the same"""
+    text = unicodedata.normalize('NFKD', text or '')
+    return ''.join(char for char in text if not unicodedata.combining(char)).lower()
+
+
+def email_token(email):
+    # Marked with a leading @ so email prefixes never collide with name words
+    return f'@{fold(email.strip())}'[:MAX_TOKEN_LENGTH]
+
+
+def name_tokens(name, email=None):
+    """Search tokens for a customer: each word of the name, plus the whole email address"""
+    tokens = {token[:MAX_TOKEN_LENGTH] for token in WORD.findall(fold(name))}
+    if email:
+        tokens.add(email_token(email))
+    return tokens
+
+
+def prefix_upper_bound(prefix):
+    """Smallest string greater than every string starting with `prefix`, for index range scans"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
@@ -0,0 +1,280 @@
+import datetime
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from inventory.models import Inventory, StockMovement
+from inventory.sequences import allocate_values
+from inventory.stock import deduct_stock_bulk
+from .checkout import CheckoutError, check_order_amounts, line_total, normalize_cart, to_decimal
+from .models import Customer, Sale, SaleItem
+from .rollup import record_sales
+
+# Tablets clocks drift; anything further ahead than this is rejected
+CLOCK_SKEW = datetime.timedelta(minutes=5)
+
+
+def max_batch_size():
+    return getattr(settings, 'OFFLINE_SYNC_MAX_BATCH', 500)
+
+
+def price_tolerance():
+    return Decimal(str(getattr(settings, 'OFFLINE_PRICE_TOLERANCE', 0.2)))
+
+
+def _to_id(value):
+    try:
+        return int(value) if value else None
+    except (TypeError, ValueError):
+        raise CheckoutError(f"Invalid id: {value!r}")
+
+
+def _parse_sale(raw, now):
+    """Validate one queued sale and return it in the shape ingest works with"""
+    client_id = str(raw.get('client_id') or '').strip()
+    if not client_id or len(client_id) > 64:
+        raise CheckoutError("client_id is required and must be at most 64 characters")
+
+    sale_date = parse_datetime(str(raw.get('sale_date') or ''))
+    if sale_date is None:
+        raise CheckoutError("sale_date must be an ISO 8601 timestamp")
+    if timezone.is_naive(sale_date):
+        sale_date = timezone.make_aware(sale_date)
+    if sale_date > now + CLOCK_SKEW:
+        raise CheckoutError("sale_date is in the future")
+
+    payment_method = raw.get('payment_method', 'cash')
+    if payment_method not in dict(Sale.PAYMENT_METHOD_CHOICES):
+        raise CheckoutError(f"Unknown payment method: {payment_method}")
+
+    items = raw.get('items') or []
+    lines = normalize_cart(items)
+    # The tablet charged the price in its snapshot, which is what gets booked
+    prices = []
+    for index, item in enumerate(items, start=1):
+        price = item.get('unit_price')
+        if price is not None:
+            price = to_decimal(price, f"line {index} unit_price")
+            if price < 0:
+                raise CheckoutError(f"Line {index}: unit_price cannot be negative")
+        prices.append(price)
+
+    return {
+        'client_id': client_id,
+        'sale_date': sale_date,
+        'payment_method': payment_method,
+        'customer_id': _to_id(raw.get('customer_id')),
+        'discount_amount': to_decimal(raw.get('discount_amount'), 'discount_amount'),
+        'tax_amount': to_decimal(raw.get('tax_amount'), 'tax_amount'),
+        'notes': raw.get('notes'),
+        'lines': [
+            (product_id, quantity, discount, price)
+            for (product_id, quantity, discount), price in zip(lines, prices)
+        ],
+    }
+
+
+def _settle_prices(sale, stock):
+    """
+    Fix each line's price and total, and the sale's subtotal, before booking.
+
+    A tablet may charge the price from its snapshot, but only within the
+    price tolerance of the current list price; a missing price means the
+    list price. Discounts may not take a line or the sale below zero.
+    """
+    tolerance = price_tolerance()
+    lines = []
+    subtotal = Decimal('0')
+    for index, (product_id, quantity, discount, price) in enumerate(sale['lines'], start=1):
+        list_price = stock[product_id][1]
+        if price is None:
+            price = list_price
+        elif abs(price - list_price) > list_price * tolerance:
+            raise CheckoutError(f"Line {index}: unit_price {price} is too far from the list price of {list_price}")
+        total = line_total(price, quantity, discount, index)
+        lines.append((product_id, quantity, discount, price, total))
+        subtotal += total
+
+    check_order_amounts(subtotal, sale['tax_amount'], sale['discount_amount'])
+    sale['lines'] = lines
+    sale['subtotal'] = subtotal
+
+
+def _already_booked(client_ids):
+    """{client_id: (sale_id, invoice_number)} for the ids an earlier upload booked"""
+    return {
+        client_reference: (sale_id, invoice_number)
+        for client_reference, sale_id, invoice_number in Sale.objects.filter(
+            client_reference__in=client_ids
+        ).values_list('client_reference', 'id', 'invoice_number')
+    }
+
+
+def ingest_offline_sales(branch, staff, queued_sales):
+    """
+    Book a batch of sales recorded while a POS was offline.
+
+    The whole batch is reconciled in one transaction: duplicates are found
+    with one lookup on the client-generated ids, stock for every product in
+    the batch is read with one query, invoice numbers are reserved in one
+    block per business day, and sales, items, stock and ledger rows are each
+    written with a single bulk statement.
+
+    Returns one result per queued sale, in input order, with a status of
+    created, duplicate, conflict (not enough stock; nothing booked) or
+    invalid (including prices outside the tolerance and discounts larger
+    than what they apply to).
+    """
+    try:
+        return _ingest(branch, staff, queued_sales)
+    except IntegrityError:
+        # An overlapping upload of the same queue booked some of these ids after we
+        # looked them up; a second pass finds them and reports them as duplicates
+        return _ingest(branch, staff, queued_sales)
+
+
+def _ingest(branch, staff, queued_sales):
+    now = timezone.now()
+    results = [None] * len(queued_sales)
+    parsed = []
+
+    for index, raw in enumerate(queued_sales):
+        try:
+            parsed.append((index, _parse_sale(raw, now)))
+        except (CheckoutError, AttributeError) as e:
+            client_id = raw.get('client_id') if isinstance(raw, dict) else None
+            results[index] = {'client_id': client_id, 'status': 'invalid', 'message': str(e)}
+
+    # Customers may have been deleted since the tablet cached them
+    customer_ids = {sale['customer_id'] for _, sale in parsed if sale['customer_id']}
+    known_customers = set(
+        Customer.objects.filter(id__in=customer_ids).values_list('id', flat=True)
+    ) if customer_ids else set()
+    for _, sale in parsed:
+        if sale['customer_id'] and sale['customer_id'] not in known_customers:
+            sale['customer_id'] = None
+
+    with transaction.atomic():
+        existing = _already_booked([sale['client_id'] for _, sale in parsed])
+
+        product_ids = {line[0] for _, sale in parsed for line in sale['lines']}
+        stock = {
+            product_id: [quantity, price, cost_price if average_cost is None else average_cost]
+            for product_id, quantity, price, average_cost, cost_price in Inventory.objects.filter(
+                branch=branch, product_id__in=product_ids
+            ).values_list('product_id', 'quantity', 'product__selling_price', 'average_cost', 'product__cost_price')
+        }
+
+        # Replay sales in the order they happened so earlier ones get the stock
+        accepted = []
+        seen = set()
+        for index, sale in sorted(parsed, key=lambda entry: entry[1]['sale_date']):
+            client_id = sale['client_id']
+            if client_id in existing or client_id in seen:
+                sale_id, invoice_number = existing.get(client_id, (None, None))
+                results[index] = {'client_id': client_id, 'status': 'duplicate', 'sale_id': sale_id,
+                                  'invoice_number': invoice_number}
+                continue
+            seen.add(client_id)
+
+            needed = {}
+            for product_id, quantity, _, _ in sale['lines']:
+                needed[product_id] = needed.get(product_id, 0) + quantity
+            shortages = {
+                product_id: stock[product_id][0] if product_id in stock else 0
+                for product_id, quantity in needed.items()
+                if product_id not in stock or stock[product_id][0] < quantity
+            }
+            if shortages:
+                results[index] = {'client_id': client_id, 'status': 'conflict',
+                                  'message': 'Not enough stock to book this sale',
+                                  'available': {str(product_id): left for product_id, left in shortages.items()}}
+                continue
+
+            try:
+                _settle_prices(sale, stock)
+            except CheckoutError as e:
+                results[index] = {'client_id': client_id, 'status': 'invalid', 'message': str(e)}
+                continue
+
+            for product_id, quantity in needed.items():
+                stock[product_id][0] -= quantity
+            accepted.append((index, sale, needed))
+
+        if accepted:
+            _book(branch, staff, accepted, stock, results)
+
+    return results
+
+
+def _book(branch, staff, accepted, stock, results):
+    # Number invoices by the branch's trading day, the day each sale is reported under
+    for _, sale, _ in accepted:
+        sale['business_date'] = branch.business_date(sale['sale_date'])
+
+    # Reserve every invoice number a business day needs in one round trip
+    numbers = {}
+    for _, sale, _ in accepted:
+        numbers[sale['business_date']] = numbers.get(sale['business_date'], 0) + 1
+    numbers = {day: iter(allocate_values('invoice', branch, count, day)) for day, count in numbers.items()}
+
+    sales = []
+    for _, sale, _ in accepted:
+        subtotal = sale['subtotal']
+        day = sale['business_date']
+        sales.append(Sale(
+            sale_date=sale['sale_date'],
+            business_date=day,
+            invoice_number=Sale.build_invoice_number(branch.pk, day, next(numbers[day])),
+            client_reference=sale['client_id'],
+            customer_id=sale['customer_id'],
+            branch=branch,
+            staff=staff,
+            payment_method=sale['payment_method'],
+            subtotal=subtotal,
+            tax_amount=sale['tax_amount'],
+            discount_amount=sale['discount_amount'],
+            total_amount=subtotal + sale['tax_amount'] - sale['discount_amount'],
+            notes=sale['notes'],
+            is_completed=True,
+        ))
+    Sale.objects.bulk_create(sales)
+
+    items = []
+    ledger = []
+    totals = {}
+    now = timezone.now()
+    for (index, sale, needed), booked in zip(accepted, sales):
+        for product_id, quantity, discount, unit_price, total_price in sale['lines']:
+            items.append(SaleItem(
+                sale=booked,
+                product_id=product_id,
+                quantity=quantity,
+                unit_price=unit_price,
+                unit_cost=stock[product_id][2],
+                discount=discount,
+                total_price=total_price,
+            ))
+        for product_id, quantity in needed.items():
+            totals[product_id] = totals.get(product_id, 0) + quantity
+            ledger.append(StockMovement(
+                product_id=product_id,
+                branch=branch,
+                movement_type='sale',
+                quantity=-quantity,
+                reference_type='sale',
+                reference_id=booked.pk,
+                created_by=staff,
+                # Stamped when booked, not when sold: a backdated row would fall behind stock
+                # checkpoints already taken and never be counted. Sale.sale_date keeps the sale time.
+                created_at=now,
+            ))
+        results[index] = {'client_id': sale['client_id'], 'status': 'created', 'sale_id': booked.pk,
+                          'invoice_number': booked.invoice_number}
+
+    SaleItem.objects.bulk_create(items)
+    deduct_stock_bulk(branch, totals, ledger=ledger)
+    record_sales(sales)
@@ -0,0 +1,45 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import SalesDailyRollup
+
+
+def record_sales(sales, reverse=False):
+    """
+    Add completed sales to the daily rollup, or take them back out when `reverse`.
+
+    Sales sharing a (day, branch, cashier, payment method) key are folded
+    into one F() delta, so a whole batch costs one UPDATE per key and
+    concurrent writers never overwrite each other. Call inside the
+    transaction that completes or cancels the sales.
+    """
+    sign = -1 if reverse else 1
+    deltas = {}
+    for sale in sales:
+        if not sale.is_completed:
+            continue
+        key = (sale.business_date, sale.branch_id, sale.staff_id, sale.payment_method)
+        count, amount = deltas.get(key, (0, 0))
+        deltas[key] = (count + sign, amount + sign * sale.total_amount)
+
+    with transaction.atomic():
+        for (day, branch_id, staff_id, payment_method), (count, amount) in deltas.items():
+            rows = SalesDailyRollup.objects.filter(
+                business_date=day, branch_id=branch_id, staff_id=staff_id, payment_method=payment_method,
+            )
+            changes = {'sale_count': F('sale_count') + count, 'total_amount': F('total_amount') + amount}
+            if rows.update(**changes):
+                continue
+            try:
+                with transaction.atomic():
+                    SalesDailyRollup.objects.create(
+                        business_date=day, branch_id=branch_id, staff_id=staff_id, payment_method=payment_method,
+                        sale_count=count, total_amount=amount,
+                    )
+            except IntegrityError:
+                # Another worker opened this key first
+                rows.update(**changes)
+
+
+def record_sale(sale, reverse=False):
+    record_sales([sale], reverse)
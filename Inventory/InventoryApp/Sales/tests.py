@@ -1,3 +1,351 @@
-from django.test import TestCase
+import datetime
+import json
+import os
+from decimal import Decimal
 
-# Create your tests here.
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.test import RequestFactory, TestCase
+from django.utils import timezone
+
+from CustomUser.models import CustomUser
+from inventory.models import Branch, Brand, Category, Inventory, Product, StockCheckpoint
+from inventory.stock import InsufficientStockError, stock_as_of
+from Staff import reservations
+from Staff.models import POSSession, StockReservation
+
+from . import customers, offline, views
+from .checkout import CheckoutError, checkout, to_decimal
+from .models import Customer, Sale, SaleItem, SalesDailyRollup
+from .offline import ingest_offline_sales
+from .rollup import record_sale, record_sales
+
+
+class SalesTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.branch = Branch.objects.create(name='Main', address='1 Road', phone_number='08030000000')
+        cls.staff = CustomUser.objects.create_superuser('cashier', 'cashier@example.com', 'x', branch=cls.branch)
+        category = Category.objects.create(name='Accessories')
+        brand = Brand.objects.create(name='Acme')
+        cls.product = Product.objects.create(product_type='accessory', name='Charger', sku='CHG', category=category,
+                                             brand=brand, cost_price=Decimal('5'), selling_price=Decimal('10'))
+        cls.other = Product.objects.create(product_type='accessory', name='Cable', sku='CBL', category=category,
+                                           brand=brand, cost_price=Decimal('2'), selling_price=Decimal('4'))
+        Inventory.objects.create(product=cls.product, branch=cls.branch, quantity=5)
+        Inventory.objects.create(product=cls.other, branch=cls.branch, quantity=5)
+
+    def on_hand(self, product=None):
+        return Inventory.objects.get(branch=self.branch, product=product or self.product).quantity
+
+    def cart(self, quantity, **line):
+        return [{'product_id': self.product.pk, 'quantity': quantity, **line}]
+
+    def post(self, view, body):
+        request = RequestFactory().post('/', body if isinstance(body, str) else json.dumps(body),
+                                        content_type='application/json')
+        request.user = self.staff
+        return view(request)
+
+
+class CheckoutTests(SalesTestCase):
+    def test_whole_cart_in_one_sale(self):
+        sale = checkout(self.branch, self.staff,
+                        self.cart(2, discount='1') + [{'product_id': self.other.pk, 'quantity': 3}],
+                        discount_amount='2')
+
+        self.assertEqual((sale.subtotal, sale.total_amount), (Decimal('31'), Decimal('29')))
+        self.assertEqual(sorted(sale.items.values_list('total_price', flat=True)), [Decimal('12'), Decimal('19')])
+        self.assertEqual((self.on_hand(), self.on_hand(self.other)), (3, 2))
+
+    def test_short_line_books_nothing(self):
+        with self.assertRaises(InsufficientStockError):
+            checkout(self.branch, self.staff, self.cart(1) + [{'product_id': self.other.pk, 'quantity': 6}])
+
+        self.assertFalse(Sale.objects.exists())
+        self.assertEqual((self.on_hand(), self.on_hand(self.other)), (5, 5))
+
+    def test_discounts_cannot_go_below_zero(self):
+        with self.assertRaises(CheckoutError):
+            checkout(self.branch, self.staff, self.cart(1, discount='11'))
+        with self.assertRaises(CheckoutError):
+            checkout(self.branch, self.staff, self.cart(1), discount_amount='10.01')
+
+        self.assertEqual(self.on_hand(), 5)
+
+    def test_non_finite_amounts_are_rejected(self):
+        for value in ('NaN', 'Infinity', '-inf', 'sNaN'):
+            with self.subTest(value), self.assertRaises(CheckoutError):
+                to_decimal(value, 'discount')
+
+    def test_endpoint(self):
+        response = self.post(views.process_sale, {'items': self.cart(2)})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['total_amount'], 20.0)
+        self.assertEqual(self.on_hand(), 3)
+
+    def test_endpoint_rejects_bad_payloads(self):
+        for body in ('[1, 2]', '"cart"', '7', {'items': self.cart(1, discount='NaN')},
+                     {'items': self.cart(1), 'discount_amount': 'Infinity'}):
+            with self.subTest(body):
+                self.assertEqual(self.post(views.process_sale, body).status_code, 400)
+
+        self.assertEqual(self.on_hand(), 5)
+
+
+class SaleTotalsTests(SalesTestCase):
+    def test_line_changes_shift_the_totals(self):
+        sale = Sale.objects.create(branch=self.branch, staff=self.staff, tax_amount=Decimal('1'),
+                                   discount_amount=Decimal('2'))
+        sale.update_totals()
+        line = SaleItem.objects.create(sale=sale, product=self.product, quantity=2, unit_price=Decimal('10'),
+                                       total_price=0)
+        other = SaleItem.objects.create(sale=sale, product=self.other, quantity=1, unit_price=Decimal('4'),
+                                        total_price=0)
+        sale.refresh_from_db()
+        self.assertEqual((sale.subtotal, sale.total_amount), (Decimal('24'), Decimal('23')))
+
+        line = SaleItem.objects.get(pk=line.pk)
+        line.quantity = 3
+        line.save()
+        other.delete()
+        sale.refresh_from_db()
+        self.assertEqual((sale.subtotal, sale.total_amount), (Decimal('30'), Decimal('29')))
+
+
+class CheckoutReservationTests(SalesTestCase):
+    def open_session(self, username):
+        staff = CustomUser.objects.create_user(username, password='x', branch=self.branch)
+        return POSSession.objects.create(staff=staff, branch=self.branch)
+
+    def test_other_carts_holds_are_not_for_sale(self):
+        reservations.reserve(self.open_session('other'), self.product, 3)
+
+        with self.assertRaises(InsufficientStockError) as raised:
+            checkout(self.branch, self.staff, self.cart(3))
+
+        self.assertEqual(raised.exception.available, 2)
+        self.assertEqual(self.on_hand(), 5)
+        self.assertFalse(Sale.objects.exists())
+
+    def test_own_hold_is_used_up_by_the_sale(self):
+        session = self.open_session('mine')
+        reservations.reserve(session, self.product, 4)
+
+        sale = checkout(self.branch, session.staff, self.cart(4), session=session)
+
+        self.assertEqual(sale.total_amount, Decimal('40'))
+        self.assertEqual(self.on_hand(), 1)
+        self.assertFalse(StockReservation.objects.filter(session=session).exists())
+
+    def test_expired_holds_do_not_count(self):
+        reservations.reserve(self.open_session('other'), self.product, 3, ttl=datetime.timedelta(seconds=-1))
+
+        checkout(self.branch, self.staff, self.cart(5))
+
+        self.assertEqual(self.on_hand(), 0)
+
+
+class OfflineIngestTests(SalesTestCase):
+    def queued(self, client_id, quantity, minutes_ago=5, **fields):
+        return {
+            'client_id': client_id,
+            'sale_date': (timezone.now() - datetime.timedelta(minutes=minutes_ago)).isoformat(),
+            'items': self.cart(quantity),
+            **fields,
+        }
+
+    def test_created(self):
+        result, = ingest_offline_sales(self.branch, self.staff, [self.queued('tablet-1', 2)])
+
+        self.assertEqual(result['status'], 'created')
+        sale = Sale.objects.get(client_reference='tablet-1')
+        self.assertEqual((result['sale_id'], sale.total_amount), (sale.pk, Decimal('20')))
+        self.assertEqual(self.on_hand(), 3)
+
+    def test_duplicate(self):
+        first, = ingest_offline_sales(self.branch, self.staff, [self.queued('tablet-1', 2)])
+        again, repeated = ingest_offline_sales(self.branch, self.staff,
+                                               [self.queued('tablet-1', 2), self.queued('tablet-1', 2)])
+
+        for result in (again, repeated):
+            self.assertEqual(result['status'], 'duplicate')
+            self.assertEqual(result['invoice_number'], first['invoice_number'])
+        self.assertEqual(Sale.objects.count(), 1)
+        self.assertEqual(self.on_hand(), 3)
+
+    def test_overlapping_upload_reports_a_duplicate(self):
+        first, = ingest_offline_sales(self.branch, self.staff, [self.queued('tablet-1', 2)])
+        already_booked = offline._already_booked
+
+        # The first upload commits between the second one's lookup and its insert
+        with mock.patch.object(offline, '_already_booked', side_effect=[{}, already_booked(['tablet-1'])]):
+            again, other = ingest_offline_sales(self.branch, self.staff,
+                                                [self.queued('tablet-1', 2), self.queued('tablet-2', 1)])
+
+        self.assertEqual((again['status'], again['sale_id']), ('duplicate', first['sale_id']))
+        self.assertEqual(other['status'], 'created')
+        self.assertEqual(self.on_hand(), 2)
+
+    def test_conflict_books_nothing_for_that_sale(self):
+        booked, short = ingest_offline_sales(self.branch, self.staff,
+                                             [self.queued('tablet-1', 4, minutes_ago=6), self.queued('tablet-2', 2)])
+
+        self.assertEqual(booked['status'], 'created')
+        self.assertEqual(short['status'], 'conflict')
+        self.assertEqual(short['available'], {str(self.product.pk): 1})
+        self.assertFalse(Sale.objects.filter(client_reference='tablet-2').exists())
+        self.assertEqual(self.on_hand(), 1)
+
+    def test_bad_amounts_only_fail_their_own_sale(self):
+        results = ingest_offline_sales(self.branch, self.staff, [
+            self.queued('far', 1, items=self.cart(1, unit_price='1')),
+            self.queued('nan-price', 1, items=self.cart(1, unit_price='NaN')),
+            self.queued('nan-discount', 1, items=self.cart(1, discount='NaN')),
+            self.queued('inf-tax', 1, tax_amount='Infinity'),
+            self.queued('fine', 1, items=self.cart(1, unit_price='9.50')),
+        ])
+
+        self.assertEqual([result['status'] for result in results], ['invalid'] * 4 + ['created'])
+        self.assertEqual(Sale.objects.get().total_amount, Decimal('9.50'))
+        self.assertEqual(self.on_hand(), 4)
+
+    def test_sale_made_before_a_checkpoint(self):
+        # Rung up before the checkpoint but only synced after it
+        checkpoint_at = timezone.now()
+        StockCheckpoint.objects.create(product=self.product, branch=self.branch, as_of=checkpoint_at, quantity=5)
+        result, = ingest_offline_sales(self.branch, self.staff, [self.queued('tablet-1', 4, minutes_ago=60)])
+
+        self.assertEqual(result['status'], 'created')
+        self.assertEqual(stock_as_of(self.product, self.branch, timezone.now()), self.on_hand())
+
+    def test_endpoint(self):
+        response = self.post(views.sync_offline_sales, {'sales': [self.queued('tablet-1', 1),
+                                                                   self.queued('tablet-2', 1, discount_amount='NaN')]})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['counts'], {'created': 1, 'invalid': 1})
+
+
+class CustomerSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.ada = Customer.objects.create(name='Adaeze Obi', phone_number='0803 123 4567', email='ada@shop.ng')
+        cls.jose = Customer.objects.create(name='José Adams', phone_number='+234 805 000 0000')
+
+    def find(self, query, **kwargs):
+        return [customer.name for customer in customers.search_customers(query, **kwargs)[0]]
+
+    def test_phone_numbers_in_any_format(self):
+        for query in ('0803', '+234 803', '234803', '803 12', '(0803) 123-4567'):
+            with self.subTest(query):
+                self.assertEqual(self.find(query), ['Adaeze Obi'])
+        self.assertEqual(self.find('0809'), [])
+
+    def test_name_words_and_email(self):
+        self.assertEqual(sorted(self.find('ada')), ['Adaeze Obi', 'José Adams'])
+        self.assertEqual(self.find('obi ada'), ['Adaeze Obi'])
+        self.assertEqual(self.find('jose'), ['José Adams'])
+        self.assertEqual(self.find('ada@sh'), ['Adaeze Obi'])
+
+    def test_rename_replaces_the_words(self):
+        self.ada.name = 'Adaeze Nwosu'
+        self.ada.save()
+
+        self.assertEqual(self.find('obi'), [])
+        self.assertEqual(self.find('nwo'), ['Adaeze Nwosu'])
+
+    def test_pages(self):
+        for n in range(5):
+            Customer.objects.create(name=f'Chidi {n}', phone_number=f'0806000000{n}')
+        seen, cursor = [], None
+        while True:
+            page, cursor = customers.search_customers('chidi', limit=2, cursor=cursor)
+            seen += [customer.name for customer in page]
+            if cursor is None:
+                break
+
+        self.assertEqual(seen, [f'Chidi {n}' for n in range(5)])
+        # A cursor that does not decode starts from the top
+        self.assertEqual(self.find('chidi', limit=1, cursor='!!'), ['Chidi 0'])
+
+
+class RollupTests(SalesTestCase):
+    def rollup(self):
+        rows = SalesDailyRollup.objects.filter(sale_count__gt=0).order_by('staff', 'payment_method')
+        return list(rows.values_list('staff_id', 'payment_method', 'sale_count', 'total_amount'))
+
+    def completed(self, total, staff=None, payment_method='cash'):
+        return Sale.objects.create(branch=self.branch, staff=staff, payment_method=payment_method,
+                                   is_completed=True, total_amount=Decimal(total))
+
+    def test_sales_fold_into_one_row_per_key(self):
+        record_sales([self.completed('10', self.staff), self.completed('5', self.staff), self.completed('7'),
+                      self.completed('3', payment_method='mobile_payment')])
+        record_sale(self.completed('1'))
+
+        self.assertEqual(self.rollup(), [(None, 'cash', 2, Decimal('8')), (None, 'mobile_payment', 1, Decimal('3')),
+                                         (self.staff.pk, 'cash', 2, Decimal('15'))])
+
+        record_sale(Sale.objects.get(total_amount=5), reverse=True)
+        self.assertEqual(self.rollup()[-1], (self.staff.pk, 'cash', 1, Decimal('10')))
+
+    def test_one_row_per_key_without_a_cashier(self):
+        SalesDailyRollup.objects.create(business_date=timezone.localdate(), branch=self.branch,
+                                        payment_method='cash')
+
+        with self.assertRaises(IntegrityError):
+            SalesDailyRollup.objects.create(business_date=timezone.localdate(), branch=self.branch,
+                                            payment_method='cash')
+
+    def test_matches_a_rebuild(self):
+        checkout(self.branch, self.staff, self.cart(2))
+        checkout(self.branch, self.staff, self.cart(1), payment_method='credit_card')
+        live = self.rollup()
+
+        call_command('rebuild_sales_rollup', stdout=open(os.devnull, 'w'))
+
+        self.assertEqual(live, [(self.staff.pk, 'cash', 1, Decimal('20')),
+                                (self.staff.pk, 'credit_card', 1, Decimal('10'))])
+        self.assertEqual(self.rollup(), live)
+
+
+class BusinessDateTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # Trading in Tokyo runs until four in the morning
+        cls.branch = Branch.objects.create(name='Shinjuku', address='1 Chome', phone_number='0300000000',
+                                           time_zone='Asia/Tokyo', day_cutoff=datetime.time(4, 0))
+
+    def sell(self, utc_moment):
+        return Sale.objects.create(branch=self.branch, is_completed=True, total_amount=Decimal('10'),
+                                   sale_date=utc_moment.replace(tzinfo=datetime.timezone.utc))
+
+    def test_late_night_sale_counts_to_the_day_before(self):
+        # 17:30 UTC is 02:30 on the 1st of March in Tokyo, before the cutoff
+        late = self.sell(datetime.datetime(2026, 2, 28, 17, 30))
+        next_morning = self.sell(datetime.datetime(2026, 2, 28, 19, 30))
+        earlier = self.sell(datetime.datetime(2026, 2, 28, 3, 0))
+
+        self.assertEqual([sale.business_date for sale in (late, next_morning, earlier)],
+                         [datetime.date(2026, 2, 28), datetime.date(2026, 3, 1), datetime.date(2026, 2, 28)])
+        # Invoices are numbered within the trading day
+        prefix = f'INV-{self.branch.pk:03d}'
+        self.assertEqual([late.invoice_number, next_morning.invoice_number, earlier.invoice_number],
+                         [f'{prefix}-20260228-0001', f'{prefix}-20260301-0001', f'{prefix}-20260228-0002'])
+
+    def test_backfill_and_rebuild_after_moving_the_cutoff(self):
+        late = self.sell(datetime.datetime(2026, 2, 28, 17, 30))
+        record_sale(late)
+        Branch.objects.filter(pk=self.branch.pk).update(day_cutoff=datetime.time(0, 0))
+
+        call_command('backfill_business_dates', stdout=open(os.devnull, 'w'))
+        call_command('rebuild_sales_rollup', stdout=open(os.devnull, 'w'))
+
+        late.refresh_from_db()
+        self.assertEqual(late.business_date, datetime.date(2026, 3, 1))
+        rolled_up = SalesDailyRollup.objects.values_list('business_date', 'sale_count')
+        self.assertEqual(list(rolled_up), [(datetime.date(2026, 3, 1), 1)])
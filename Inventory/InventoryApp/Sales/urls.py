@@ -6,6 +6,7 @@ app_name = 'Sales'
 urlpatterns = [
     path('api/products/', views.product_search, name='product_search'),
     path('api/process-sale/', views.process_sale, name='process_sale'),
+    path('api/sync-offline-sales/', views.sync_offline_sales, name='sync_offline_sales'),
     path('api/get-sale/<int:pk>/', views.get_sale, name='get_sale'),
     path('api/create-customer/', views.create_customer, name='create_customer'),
 ]
@@ -1,3 +1,115 @@
-from django.shortcuts import render
+import json
 
-# Create your views here.
+from django.contrib.auth.decorators import login_required, permission_required
+from django.http import JsonResponse
+
+from inventory.stock import InsufficientStockError
+from Staff.idempotency import idempotent
+from Staff.models import POSSession
+from .checkout import CheckoutError, checkout
+from .models import Customer
+from .offline import ingest_offline_sales, max_batch_size
+
+
+@login_required
+@permission_required('accounts.can_access_staff_portal', raise_exception=True)
+@idempotent
+def process_sale(request):
+    """Check out a whole cart posted as one JSON payload"""
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Method not allowed'}, status=405)
+
+    # Get user's branch
+    branch = request.user.branch
+
+    if not branch:
+        return JsonResponse({'status': 'error', 'message': 'You are not assigned to any branch'}, status=400)
+
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid JSON payload'}, status=400)
+    if not isinstance(payload, dict):
+        return JsonResponse({'status': 'error', 'message': 'Expected a JSON object'}, status=400)
+
+    # Resolve the optional customer
+    customer = None
+    customer_id = payload.get('customer_id')
+    if customer_id:
+        try:
+            customer = Customer.objects.get(id=customer_id)
+        except (Customer.DoesNotExist, ValueError):
+            return JsonResponse({'status': 'error', 'message': 'Customer not found'}, status=404)
+
+    # Resolve the POS session whose reservations this cart consumes
+    session = None
+    session_id = payload.get('session_id')
+    if session_id:
+        try:
+            session = POSSession.objects.get(id=session_id, staff=request.user, status='active')
+        except (POSSession.DoesNotExist, ValueError):
+            return JsonResponse({'status': 'error', 'message': 'POS session not found'}, status=404)
+
+    try:
+        sale = checkout(
+            branch,
+            request.user,
+            payload.get('items'),
+            customer=customer,
+            payment_method=payload.get('payment_method', 'cash'),
+            discount_amount=payload.get('discount_amount'),
+            notes=payload.get('notes'),
+            session=session,
+        )
+    except InsufficientStockError as e:
+        return JsonResponse({'status': 'error', 'message': str(e), 'product_id': e.product_id}, status=409)
+    except CheckoutError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+    return JsonResponse({
+        'status': 'success',
+        'sale_id': sale.id,
+        'invoice_number': sale.invoice_number,
+        'subtotal': float(sale.subtotal),
+        'discount_amount': float(sale.discount_amount),
+        'total_amount': float(sale.total_amount),
+    })
+
+
+@login_required
+@permission_required('accounts.can_access_staff_portal', raise_exception=True)
+def sync_offline_sales(request):
+    """Upload sales queued by a POS while it was offline"""
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Method not allowed'}, status=405)
+
+    branch = request.user.branch
+
+    if not branch:
+        return JsonResponse({'status': 'error', 'message': 'You are not assigned to any branch'}, status=400)
+
+    try:
+        payload = json.loads(request.body)
+        queued_sales = payload['sales']
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'status': 'error', 'message': 'Expected a JSON object with a sales list'}, status=400)
+
+    if not isinstance(queued_sales, list):
+        return JsonResponse({'status': 'error', 'message': 'sales must be a list'}, status=400)
+    if len(queued_sales) > max_batch_size():
+        return JsonResponse({
+            'status': 'error',
+            'message': f"At most {max_batch_size()} sales can be synced at once",
+        }, status=413)
+
+    try:
+        results = ingest_offline_sales(branch, request.user, queued_sales)
+    except InsufficientStockError:
+        # Stock moved between the check and the write; nothing was booked
+        return JsonResponse({'status': 'error', 'message': 'Stock changed during sync, please retry'}, status=409)
+
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+
+    return JsonResponse({'status': 'success', 'counts': counts, 'results': results})
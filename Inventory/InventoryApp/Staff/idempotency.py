@@ -0,0 +1,123 @@
+import datetime
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+
+# A claim left unfinished this long belongs to a worker that died mid-request
+STALE_CLAIM_AFTER = datetime.timedelta(seconds=60)
+
+
+def idempotency_ttl():
+    return datetime.timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+
+
+def request_fingerprint(request):
+    digest = hashlib.sha256()
+    digest.update(request.method.encode())
+    digest.update(request.get_full_path().encode())
+    digest.update(request.body)
+    return digest.hexdigest()
+
+
+def _replay(record):
+    response = HttpResponse(bytes(record.response_body or b''), status=record.status_code,
+                            content_type=record.content_type)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view):
+    """
+    Make a POST view safe to retry.
+
+    Clients send an Idempotency-Key header. The first request with a key
+    claims it and runs the view; its response is stored against the key.
+    A retry with the same key replays that response after a single indexed
+    lookup instead of running the mutation again. A duplicate that arrives
+    while the first is still running gets 409, and reusing a key with a
+    different payload gets 422. Requests without the header are unaffected.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.META.get(IDEMPOTENCY_HEADER)
+        if request.method != 'POST' or not key:
+            return view(request, *args, **kwargs)
+
+        key = key[:255]
+        fingerprint = request_fingerprint(request)
+        now = timezone.now()
+
+        record = IdempotencyKey.objects.filter(user=request.user, key=key).first()
+        if record is not None and (
+                record.expires_at <= now or
+                (record.status_code is None and record.created_at <= now - STALE_CLAIM_AFTER)):
+            # Expired or abandoned: forget it and treat this as a first attempt
+            record.delete()
+            record = None
+
+        if record is None:
+            try:
+                with transaction.atomic():
+                    record = IdempotencyKey.objects.create(
+                        user=request.user,
+                        key=key,
+                        fingerprint=fingerprint,
+                        expires_at=now + idempotency_ttl(),
+                    )
+            except IntegrityError:
+                # A concurrent duplicate claimed the key between our lookup and insert
+                record = IdempotencyKey.objects.filter(user=request.user, key=key).first()
+            else:
+                return _run_and_store(record, view, request, *args, **kwargs)
+
+        if record is None or record.fingerprint != fingerprint:
+            return JsonResponse({'status': 'error', 'message': 'Idempotency key was used for a different request'},
+                                status=422)
+        if record.status_code is None:
+            response = JsonResponse({'status': 'error', 'message': 'A request with this key is still in progress'},
+                                    status=409)
+            response['Retry-After'] = '1'
+            return response
+        return _replay(record)
+
+    return wrapper
+
+
+def _run_and_store(record, view, request, *args, **kwargs):
+    try:
+        response = view(request, *args, **kwargs)
+    except Exception:
+        # Let the client retry a request that blew up
+        record.delete()
+        raise
+
+    if response.status_code >= 500 or getattr(response, 'streaming', False):
+        record.delete()
+        return response
+
+    IdempotencyKey.objects.filter(pk=record.pk).update(
+        status_code=response.status_code,
+        content_type=response.get('Content-Type'),
+        response_body=response.content,
+    )
+    return response
+
+
+def purge_expired(batch_size=1000):
+    """Delete expired keys in bounded batches and return how many were removed"""
+    purged = 0
+    while True:
+        expired = list(IdempotencyKey.objects.filter(
+            expires_at__lte=timezone.now()
+        ).values_list('pk', flat=True)[:batch_size])
+        if not expired:
+            return purged
+        purged += IdempotencyKey.objects.filter(pk__in=expired).delete()[0]
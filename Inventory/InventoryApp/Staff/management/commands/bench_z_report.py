@@ -0,0 +1,100 @@
+import random
+import threading
+import time
+import uuid
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+from django.test.utils import CaptureQueriesContext
+
+from CustomUser.models import CustomUser
+from inventory.models import Branch
+from Sales.models import Sale
+from Staff.models import CashDrawerOperation, POSSession
+
+
+class Command(BaseCommand):
+    help = 'Close sales concurrently on one POS shift, then time its Z-report and check it against the counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sales', type=int, default=5000, help='Completed sales on the shift')
+        parser.add_argument('--operations', type=int, default=500, help='Cash drawer operations on the shift')
+        parser.add_argument('--workers', type=int, default=8, help='Threads closing sales at the same time')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        rng = random.Random(options['seed'])
+
+        tag = uuid.uuid4().hex[:8]
+        branch = Branch.objects.create(name=f'bench-{tag}', address='-', phone_number='-')
+        user = CustomUser.objects.create(username=f'bench-{tag}', branch=branch)
+        session = POSSession.objects.create(staff=user, branch=branch, opening_balance=Decimal('200.00'))
+
+        methods = [method for method, _ in Sale.PAYMENT_METHOD_CHOICES]
+        sales = Sale.objects.bulk_create([
+            Sale(invoice_number=f'BENCH-{tag}-{i}', branch=branch, business_date=branch.today(), staff=user,
+                 pos_session=session, payment_method=rng.choice(methods), total_amount=Decimal(rng.randint(100, 50000)) / 100,
+                 is_completed=True)
+            for i in range(options['sales'])
+        ])
+
+        try:
+            # Every worker holds its own stale copy of the session, as separate requests would
+            chunks = [sales[i::workers] for i in range(workers)]
+            barrier = threading.Barrier(workers)
+            locked = []
+
+            def close_sales(chunk):
+                own_session = POSSession.objects.get(pk=session.pk)
+                barrier.wait()
+                try:
+                    for sale in chunk:
+                        own_session.update_sales_totals(sale)
+                except OperationalError:
+                    locked.append(True)
+                finally:
+                    connection.close()
+
+            threads = [threading.Thread(target=close_sales, args=(chunk,)) for chunk in chunks]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            counters_elapsed = time.perf_counter() - started
+            if locked:
+                raise CommandError(f'{len(locked)} workers hit a database lock; rerun with fewer --workers')
+
+            operation_types = [operation for operation, _ in CashDrawerOperation.OPERATION_TYPE_CHOICES]
+            for _ in range(options['operations']):
+                CashDrawerOperation.objects.create(
+                    session=session, operation_type=rng.choice(operation_types),
+                    amount=Decimal(rng.randint(100, 5000)) / 100, performed_by=user,
+                )
+
+            session.refresh_from_db()
+            session.close_session(user, session.cash_in_drawer, session.cash_in_drawer)
+
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                report = session.z_report()
+                report_elapsed = time.perf_counter() - started
+
+            self.stdout.write(f'Sales:            {len(sales)} closed by {workers} workers in {counters_elapsed:.2f} s')
+            self.stdout.write(f'Z-report:         {report_elapsed * 1000:.1f} ms, {len(queries)} queries')
+            self.stdout.write(f"Cash/card/other:  {report['cash_sales']} / {report['card_sales']} / "
+                              f"{report['other_sales']}")
+            self.stdout.write(f"Expected cash:    {report['expected_cash']} (variance {report['variance']})")
+
+            mismatches = [
+                field for field in ('cash_sales', 'card_sales', 'other_sales', 'total_sales', 'transaction_count')
+                if getattr(session, field) != report[field]
+            ]
+            if mismatches or report['variance'] != 0:
+                raise CommandError(f"Session counters lost updates: {', '.join(mismatches) or 'cash in drawer'}")
+            self.stdout.write(self.style.SUCCESS('Session counters match the Z-report'))
+        finally:
+            branch.delete()
+            user.delete()
@@ -0,0 +1,96 @@
+import json
+import threading
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+from django.test import RequestFactory
+
+from CustomUser.models import CustomUser
+from inventory.models import Branch, Brand, Category, Inventory, Product
+from Sales.models import Sale
+from Sales.views import process_sale
+from Staff.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = 'Fire duplicate concurrent checkout requests sharing one Idempotency-Key and verify a single sale results'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--duplicates', type=int, default=8, help='Concurrent copies of the same request')
+        parser.add_argument('--rounds', type=int, default=20, help='Distinct keys to try')
+
+    def handle(self, *args, **options):
+        duplicates = options['duplicates']
+        rounds = options['rounds']
+
+        tag = uuid.uuid4().hex[:8]
+        category = Category.objects.create(name=f'stress-{tag}')
+        brand = Brand.objects.create(name=f'stress-{tag}')
+        branch = Branch.objects.create(name=f'stress-{tag}', address='-', phone_number='-')
+        product = Product.objects.create(product_type='accessory', name=f'Stress {tag}', sku=f'STRESS-{tag}',
+                                         category=category, brand=brand, cost_price=1, selling_price=2)
+        Inventory.objects.create(product=product, branch=branch, quantity=rounds * duplicates)
+        user = CustomUser.objects.create(username=f'stress-{tag}', is_superuser=True, branch=branch)
+
+        factory = RequestFactory()
+        body = json.dumps({'items': [{'product_id': product.pk, 'quantity': 1}]})
+        statuses = {}
+        failures = []
+
+        try:
+            for _ in range(rounds):
+                key = uuid.uuid4().hex
+                responses = [None] * duplicates
+                barrier = threading.Barrier(duplicates)
+
+                def client(index):
+                    request = factory.post('/sales/api/process-sale/', body, content_type='application/json',
+                                           HTTP_IDEMPOTENCY_KEY=key)
+                    request.user = user
+                    barrier.wait()
+                    try:
+                        responses[index] = process_sale(request)
+                    except OperationalError:
+                        # SQLite lock timeout: the claim is released and the client would retry
+                        pass
+                    finally:
+                        connection.close()
+
+                threads = [threading.Thread(target=client, args=(i,)) for i in range(duplicates)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+                # Retry once more after everything settled: it must replay, not re-run
+                request = factory.post('/sales/api/process-sale/', body, content_type='application/json',
+                                       HTTP_IDEMPOTENCY_KEY=key)
+                request.user = user
+                responses.append(process_sale(request))
+
+                for response in responses:
+                    status = response.status_code if response is not None else 'db_locked'
+                    statuses[status] = statuses.get(status, 0) + 1
+                bodies = {response.content for response in responses if response and response.status_code == 200}
+                if len(bodies) != 1:
+                    failures.append(f'key {key}: {len(bodies)} distinct successful responses')
+
+            sales = Sale.objects.filter(branch=branch).count()
+            remaining = Inventory.objects.get(product=product, branch=branch).quantity
+
+            self.stdout.write(f'Rounds:        {rounds} x {duplicates} duplicates (+1 late retry)')
+            self.stdout.write(f'Responses:     {statuses}')
+            self.stdout.write(f'Sales created: {sales}')
+            self.stdout.write(f'Units sold:    {rounds * duplicates - remaining}')
+
+            if failures or sales != rounds or remaining != rounds * duplicates - rounds:
+                raise CommandError('Duplicate requests were not collapsed: ' + '; '.join(failures))
+            self.stdout.write(self.style.SUCCESS('Every key produced exactly one sale'))
+        finally:
+            IdempotencyKey.objects.filter(user=user).delete()
+            user.delete()
+            branch.delete()
+            product.delete()
+            category.delete()
+            brand.delete()
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from Staff.reservations import sweep_expired
+
+
+class Command(BaseCommand):
+    help = 'Reclaim stock held by abandoned POS carts whose reservations have expired'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Reservations deleted per statement')
+
+    def handle(self, *args, **options):
+        reclaimed = sweep_expired(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Reclaimed {reclaimed} expired reservations'))
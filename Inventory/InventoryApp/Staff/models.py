@@ -1,8 +1,11 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, F, Sum, Value
 from django.conf import settings
 from django.utils import timezone
 from decimal import Decimal
 
+from Sales.models import Sale
+
 
 class POSSession(models.Model):
     """Represents a staff member's POS session/shift"""
@@ -14,7 +17,7 @@ class POSSession(models.Model):
 
     staff = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
                               related_name='pos_sessions')
-    branch = models.ForeignKey('users.Branch', on_delete=models.CASCADE, related_name='pos_sessions')
+    branch = models.ForeignKey('inventory.Branch', on_delete=models.CASCADE, related_name='pos_sessions')
     opening_time = models.DateTimeField(auto_now_add=True)
     closing_time = models.DateTimeField(blank=True, null=True)
     opening_balance = models.DecimalField(max_digits=10, decimal_places=2, default=0)
@@ -47,34 +50,103 @@ class POSSession(models.Model):
         if notes:
             self.notes = notes
 
-        self.save()
+        # Leave the sales counters alone; other requests may still be updating them
+        self.save(update_fields=['status', 'closing_time', 'closed_by', 'closing_balance', 'cash_in_drawer',
+                                 'notes'])
 
-    def update_sales_totals(self, sale):
-        """Update session totals with a new sale"""
-        from sales.models import Sale
+    @staticmethod
+    def payment_bucket(payment_method):
+        """Map a sale's payment method to the session counter it belongs to"""
+        if payment_method == 'cash':
+            return 'cash'
+        if payment_method in ('credit_card', 'debit_card'):
+            return 'card'
+        return 'other'
 
-        if sale.status != 'completed':
-            return
+    def save(self, *args, **kwargs):
+        # The drawer starts the shift holding the float
+        if self._state.adding:
+            self.cash_in_drawer = self.opening_balance
 
-        # Update total sales
-        self.total_sales += sale.total_amount
-        self.transaction_count += 1
+        super().save(*args, **kwargs)
 
-        # Update payment method totals
-        payment_method = sale.payment_method.name.lower() if sale.payment_method else 'other'
+    def update_sales_totals(self, sale, reverse=False):
+        """Add a completed sale to the session counters, or take it back out when `reverse`"""
+        if not sale.is_completed:
+            return
 
-        if 'cash' in payment_method:
-            self.cash_sales += sale.total_amount
-            self.cash_in_drawer += sale.total_amount
-        elif 'card' in payment_method or 'credit' in payment_method:
-            self.card_sales += sale.total_amount
-        else:
-            self.other_sales += sale.total_amount
+        amount = -sale.total_amount if reverse else sale.total_amount
+        bucket = self.payment_bucket(sale.payment_method)
 
-        self.save()
+        # Deltas are applied in the database so concurrent sales never overwrite each other
+        changes = {
+            'total_sales': F('total_sales') + amount,
+            'transaction_count': F('transaction_count') + (-1 if reverse else 1),
+            f'{bucket}_sales': F(f'{bucket}_sales') + amount,
+        }
+        if bucket == 'cash':
+            changes['cash_in_drawer'] = F('cash_in_drawer') + amount
+
+        POSSession.objects.filter(pk=self.pk).update(**changes)
+        self.refresh_from_db(fields=['total_sales', 'transaction_count', 'cash_sales', 'card_sales', 'other_sales',
+                                     'cash_in_drawer'])
+
+    def z_report(self):
+        """End-of-shift totals, drawer operations and cash variance from one grouped query"""
+        sales = Sale.objects.filter(pos_session=self, is_completed=True).values('payment_method').annotate(
+            source=Value('sale', output_field=models.CharField()),
+            total=Sum('total_amount'),
+            count=Count('id'),
+        ).values_list('source', 'payment_method', 'total', 'count')
+        operations = CashDrawerOperation.objects.filter(session=self).values('operation_type').annotate(
+            source=Value('drawer', output_field=models.CharField()),
+            total=Sum('amount'),
+            count=Count('id'),
+        ).values_list('source', 'operation_type', 'total', 'count')
+
+        payments = {'cash': Decimal('0.00'), 'card': Decimal('0.00'), 'other': Decimal('0.00')}
+        by_method = {}
+        drawer = {}
+        drawer_net = Decimal('0.00')
+        transaction_count = 0
+
+        for source, key, total, count in sales.union(operations, all=True):
+            # Union rows skip the field converters, so normalise to cents here
+            total = Decimal(str(total or 0)).quantize(Decimal('0.01'))
+            if source == 'sale':
+                payments[self.payment_bucket(key)] += total
+                by_method[key] = {'total': total, 'count': count}
+                transaction_count += count
+            else:
+                signed = CashDrawerOperation.signed(key, total)
+                drawer[key] = {'total': total, 'count': count, 'cash_effect': signed}
+                drawer_net += signed
+
+        expected_cash = self.opening_balance + payments['cash'] + drawer_net
+        counted_cash = self.closing_balance
+
+        return {
+            'session_id': self.pk,
+            'status': self.status,
+            'opening_time': self.opening_time,
+            'closing_time': self.closing_time,
+            'opening_balance': self.opening_balance,
+            'cash_sales': payments['cash'],
+            'card_sales': payments['card'],
+            'other_sales': payments['other'],
+            'total_sales': sum(payments.values()),
+            'transaction_count': transaction_count,
+            'payment_methods': by_method,
+            'drawer_operations': drawer,
+            'drawer_net': drawer_net,
+            'expected_cash': expected_cash,
+            'counted_cash': counted_cash,
+            'variance': None if counted_cash is None else counted_cash - expected_cash,
+        }
 
 
 class CashDrawerOperation(models.Model):
+    """Cash put into or taken out of the drawer outside of a sale"""
     OPERATION_TYPE_CHOICES = [
         ('mobile_in', 'Mobile Money In'),
         ('mobile_out', 'Mobile Money Out'),
@@ -86,6 +158,10 @@ class CashDrawerOperation(models.Model):
         ('adjustment', 'Manual Adjustment'),
     ]
 
+    # Operations that hand cash over the counter; adjustments carry their own sign
+    CASH_IN = ('mobile_in', 'wallet_topup', 'bank_transfer_in')
+    CASH_OUT = ('mobile_out', 'wallet_refund', 'card_refund', 'bank_transfer_out')
+
     session = models.ForeignKey(POSSession, on_delete=models.CASCADE)
     operation_type = models.CharField(max_length=30, choices=OPERATION_TYPE_CHOICES)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
@@ -96,10 +172,27 @@ class CashDrawerOperation(models.Model):
     def __str__(self):
         return f"{self.get_operation_type_display()} - {self.amount}"
 
+    @classmethod
+    def signed(cls, operation_type, amount):
+        """Effect of an operation on the cash in the drawer"""
+        return -amount if operation_type in cls.CASH_OUT else amount
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+            # Fold new operations into the session's running drawer balance
+            if adding:
+                POSSession.objects.filter(pk=self.session_id).update(
+                    cash_in_drawer=F('cash_in_drawer') + self.signed(self.operation_type, self.amount)
+                )
+
 
 class POSSetting(models.Model):
     """POS system settings (can be branch-specific)"""
-    branch = models.OneToOneField('users.Branch', on_delete=models.CASCADE, related_name='pos_settings')
+    branch = models.OneToOneField('inventory.Branch', on_delete=models.CASCADE, related_name='pos_settings')
     tax_rate = models.DecimalField(max_digits=5, decimal_places=2, default=10.0)  # percentage
     receipt_header = models.TextField(blank=True, null=True)
     receipt_footer = models.TextField(blank=True, null=True)
@@ -109,8 +202,7 @@ class POSSetting(models.Model):
     allow_price_override = models.BooleanField(default=False)
     min_discount_percentage = models.DecimalField(max_digits=5, decimal_places=2, default=0)
     max_discount_percentage = models.DecimalField(max_digits=5, decimal_places=2, default=20)
-    default_payment_method = models.ForeignKey('sales.PaymentMethod',
-                                               on_delete=models.SET_NULL, null=True, blank=True)
+    default_payment_method = models.CharField(max_length=20, choices=Sale.PAYMENT_METHOD_CHOICES, default='cash')
     cash_rounding = models.BooleanField(default=False)
     allow_partial_payments = models.BooleanField(default=False)
 
@@ -145,7 +237,7 @@ class QuickAction(models.Model):
     color = models.CharField(max_length=20, default='primary')  # Button color
     display_order = models.PositiveSmallIntegerField(default=0)
     is_active = models.BooleanField(default=True)
-    branch = models.ForeignKey('users.Branch', on_delete=models.CASCADE,
+    branch = models.ForeignKey('inventory.Branch', on_delete=models.CASCADE,
                                related_name='pos_quick_actions', null=True, blank=True)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
                              related_name='pos_quick_actions', null=True, blank=True)
@@ -173,8 +265,6 @@ class CartItem(models.Model):
     """Temporary cart items before finalizing a sale"""
     session = models.ForeignKey(POSSession, on_delete=models.CASCADE, related_name='cart_items')
     product = models.ForeignKey('inventory.Product', on_delete=models.CASCADE)
-    variant = models.ForeignKey('inventory.ProductVariant', on_delete=models.SET_NULL,
-                                null=True, blank=True)
     quantity = models.IntegerField(default=1)
     unit_price = models.DecimalField(max_digits=10, decimal_places=2)
     discount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
@@ -207,7 +297,7 @@ class CartItem(models.Model):
 
 class CustomerDisplay(models.Model):
     """Settings for customer-facing display"""
-    branch = models.OneToOneField('users.Branch', on_delete=models.CASCADE,
+    branch = models.OneToOneField('inventory.Branch', on_delete=models.CASCADE,
                                   related_name='customer_display')
     welcome_message = models.CharField(max_length=255, default="Welcome to our store!")
     enable_digital_receipts = models.BooleanField(default=True)
@@ -219,3 +309,45 @@ class CustomerDisplay(models.Model):
 
     def __str__(self):
         return f"Customer Display for {self.branch.name}"
+
+
+class StockReservation(models.Model):
+    """Stock held for an open POS cart until it is sold or the hold expires"""
+    session = models.ForeignKey(POSSession, on_delete=models.CASCADE, related_name='reservations')
+    product = models.ForeignKey('inventory.Product', on_delete=models.CASCADE, related_name='reservations')
+    branch = models.ForeignKey('inventory.Branch', on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('session', 'product')
+        indexes = [
+            models.Index(fields=['product', 'branch', 'expires_at']),
+            models.Index(fields=['expires_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} held by session #{self.session_id}"
+
+    def is_expired(self):
+        """Check if the hold has lapsed"""
+        return self.expires_at <= timezone.now()
+
+
+class IdempotencyKey(models.Model):
+    """Outcome of a POS mutation, stored so client retries replay it instead of re-running it"""
+    key = models.CharField(max_length=255)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='idempotency_keys')
+    fingerprint = models.CharField(max_length=64)  # SHA-256 of method, path and body
+    status_code = models.PositiveSmallIntegerField(blank=True, null=True)  # Null while the request is running
+    content_type = models.CharField(max_length=100, blank=True, null=True)
+    response_body = models.BinaryField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = ('user', 'key')
+
+    def __str__(self):
+        return f"{self.key} ({self.status_code or 'in progress'})"
@@ -0,0 +1,125 @@
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from inventory.models import Inventory
+from inventory.stock import InsufficientStockError, deduct_stock
+from .models import StockReservation
+
+
+def reservation_ttl():
+    return datetime.timedelta(seconds=getattr(settings, 'STOCK_RESERVATION_TTL', 15 * 60))
+
+
+def live_reservations(branch, exclude_session=None):
+    """Unexpired holds at a branch, optionally ignoring one session's own cart"""
+    reservations = StockReservation.objects.filter(branch=branch, expires_at__gt=timezone.now())
+    if exclude_session is not None:
+        reservations = reservations.exclude(session=exclude_session)
+    return reservations
+
+
+def with_reserved(inventory_rows, branch, exclude_session=None):
+    """
+    Annotate inventory rows with the quantity held by live reservations.
+
+    The total is a correlated subquery served by the (product, branch,
+    expires_at) index, so callers still fetch everything in one query.
+    """
+    reserved = live_reservations(branch, exclude_session).filter(
+        product_id=OuterRef('product_id')
+    ).order_by().values('product_id').annotate(total=Sum('quantity')).values('total')
+
+    return inventory_rows.annotate(
+        reserved=Coalesce(Subquery(reserved, output_field=IntegerField()), Value(0))
+    )
+
+
+def available_to_sell(branch, product_ids=None, exclude_session=None):
+    """Return {product_id: on-hand minus live reservations} for a branch"""
+    rows = Inventory.objects.filter(branch=branch)
+    if product_ids is not None:
+        rows = rows.filter(product_id__in=product_ids)
+
+    return dict(
+        with_reserved(rows, branch, exclude_session).values_list('product_id', F('quantity') - F('reserved'))
+    )
+
+
+def reserve(session, product, quantity, ttl=None):
+    """
+    Hold `quantity` units of a product for a session's cart.
+
+    The quantity replaces any earlier hold by the same session, so repeating
+    a call is harmless, and every call pushes the expiry out by the TTL.
+    """
+    product_id = getattr(product, 'pk', product)
+    if quantity <= 0:
+        release(session, product_id)
+        return
+
+    expires_at = timezone.now() + (ttl or reservation_ttl())
+
+    with transaction.atomic():
+        # Competing carts for the same product queue on the inventory row lock
+        # (SQLite serializes on the hold's write instead). If stock turns out
+        # to be short, raising rolls the hold back.
+        list(Inventory.objects.select_for_update().filter(branch_id=session.branch_id, product_id=product_id))
+        StockReservation.objects.update_or_create(
+            session=session,
+            product_id=product_id,
+            defaults={'branch_id': session.branch_id, 'quantity': quantity, 'expires_at': expires_at},
+        )
+
+        available = available_to_sell(session.branch_id, [product_id], exclude_session=session).get(product_id, 0)
+        if available < quantity:
+            raise InsufficientStockError(product_id, session.branch_id, quantity, max(available, 0))
+
+
+def sell(branch, product, quantity, session=None, **kwargs):
+    """
+    Take sold units out of stock, leaving alone what other carts are holding.
+
+    Units held by `session` itself count as available and its hold is used
+    up by the sale. Other keyword arguments go to deduct_stock().
+    """
+    product_id = getattr(product, 'pk', product)
+    branch_id = getattr(branch, 'pk', branch)
+
+    with transaction.atomic():
+        # Lock the row so a hold placed while we check cannot be sold from under its cart
+        list(Inventory.objects.select_for_update().filter(branch_id=branch_id, product_id=product_id))
+        available = available_to_sell(branch_id, [product_id], exclude_session=session).get(product_id, 0)
+        if available < quantity:
+            raise InsufficientStockError(product_id, branch_id, quantity, max(available, 0))
+
+        deduct_stock(product_id, branch_id, quantity, **kwargs)
+
+        if session is not None:
+            holds = StockReservation.objects.filter(session=session, product_id=product_id)
+            holds.filter(quantity__lte=quantity).delete()
+            holds.update(quantity=F('quantity') - quantity)
+
+
+def release(session, product=None):
+    """Drop a session's hold on one product, or on its whole cart"""
+    reservations = StockReservation.objects.filter(session=session)
+    if product is not None:
+        reservations = reservations.filter(product_id=getattr(product, 'pk', product))
+    reservations.delete()
+
+
+def sweep_expired(batch_size=1000):
+    """Delete lapsed holds in bounded batches and return how many were reclaimed"""
+    reclaimed = 0
+    while True:
+        expired = list(StockReservation.objects.filter(
+            expires_at__lte=timezone.now()
+        ).values_list('pk', flat=True)[:batch_size])
+        if not expired:
+            return reclaimed
+        reclaimed += StockReservation.objects.filter(pk__in=expired).delete()[0]
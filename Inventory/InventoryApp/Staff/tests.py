@@ -1,3 +1,315 @@
-from django.test import TestCase
+import datetime
+import json
+import threading
+import time
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.db import OperationalError, connection
+from django.http import HttpResponse, JsonResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from django.utils import timezone
+
+from CustomUser.models import CustomUser
+from inventory.models import Branch, Brand, Category, Inventory, Product
+from inventory.stock import InsufficientStockError
+from Sales.forms import SaleForm
+from Sales.models import Sale, SaleItem, SalesDailyRollup
+
+from . import reservations, views
+from .idempotency import idempotent
+from .models import CashDrawerOperation, IdempotencyKey, POSSession, StockReservation
+
+
+def create_shop():
+    """A branch, a cashier who may do everything, and five units of one product"""
+    branch = Branch.objects.create(name='Main', address='1 Road', phone_number='08030000000')
+    staff = CustomUser.objects.create_superuser('cashier', 'cashier@example.com', 'x', branch=branch)
+    product = Product.objects.create(product_type='accessory', name='Charger', sku='CHG',
+                                     category=Category.objects.create(name='Accessories'),
+                                     brand=Brand.objects.create(name='Acme'), cost_price=Decimal('5'),
+                                     selling_price=Decimal('10'))
+    Inventory.objects.create(product=product, branch=branch, quantity=5)
+    return branch, staff, product
+
+
+class StaffTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.branch, cls.staff, cls.product = create_shop()
+
+    def setUp(self):
+        self.session = POSSession.objects.create(staff=self.staff, branch=self.branch)
+
+    def on_hand(self):
+        return Inventory.objects.get(branch=self.branch, product=self.product).quantity
+
+    def get(self, view, *args):
+        request = RequestFactory().get('/')
+        request.user = self.staff
+        return view(request, *args)
+
+    def post(self, view, *args, data=None, headers=None):
+        request = RequestFactory().post('/', data or {}, headers=headers)
+        request.user = self.staff
+        return view(request, *args)
+
+    def open_sale(self, **fields):
+        return Sale.objects.create(branch=self.branch, staff=self.staff, pos_session=self.session, **fields)
+
+    def add_line(self, sale, quantity=1):
+        return SaleItem.objects.create(sale=sale, product=self.product, quantity=quantity,
+                                       unit_price=self.product.selling_price, total_price=0)
+
+
+class UpdateSaleTests(StaffTestCase):
+    def test_line_added_meanwhile_is_kept(self):
+        sale = self.open_sale()
+        self.add_line(sale)
+        is_valid = SaleForm.is_valid
+
+        def add_line_then_validate(form):
+            # Another terminal rings up a line after the view has read the sale
+            self.add_line(sale, quantity=2)
+            return is_valid(form)
+
+        with mock.patch.object(SaleForm, 'is_valid', add_line_then_validate):
+            response = self.post(views.update_sale, sale.pk,
+                                 data={'payment_method': 'credit_card', 'discount_amount': '5'})
+
+        self.assertEqual(json.loads(response.content)['total_amount'], 25.0)
+        sale.refresh_from_db()
+        self.assertEqual((sale.subtotal, sale.total_amount, sale.payment_method),
+                         (Decimal('30'), Decimal('25'), 'credit_card'))
+
+
+class SessionTotalsTests(StaffTestCase):
+    def add(self, sale, quantity=1):
+        return self.post(views.add_sale_item, data={'sale_id': sale.pk, 'product': self.product.pk,
+                                                    'quantity': quantity, 'discount': 0})
+
+    def complete(self, sale):
+        # Only the counters matter here, not the receipt page
+        with mock.patch.object(views, 'render', return_value=HttpResponse()):
+            return self.get(views.complete_sale, sale.pk)
+
+    def test_completed_sales_feed_the_counters_and_z_report(self):
+        self.session.opening_balance = Decimal('50')
+        self.session.save()
+        cash, card = self.open_sale(), self.open_sale(payment_method='credit_card')
+        self.add(cash, quantity=2)
+        self.add(card)
+        self.complete(cash)
+        self.complete(card)
+        # A second completion must not count the sale twice
+        self.complete(cash)
+        CashDrawerOperation.objects.create(session=self.session, operation_type='mobile_out', amount=Decimal('5'))
+
+        self.session.refresh_from_db()
+        self.assertEqual((self.session.total_sales, self.session.cash_sales, self.session.card_sales,
+                          self.session.transaction_count), (Decimal('30'), Decimal('20'), Decimal('10'), 2))
+
+        report = json.loads(self.get(views.z_report, self.session.pk).content)['report']
+        self.assertEqual((report['total_sales'], report['transaction_count']), ('30.00', 2))
+        self.assertEqual(report['expected_cash'], '65.00')
+
+    def test_completed_sale_lines_are_final(self):
+        sale = self.open_sale()
+        self.add(sale, quantity=2)
+        line = sale.items.get()
+        self.complete(sale)
+
+        self.assertEqual(self.add(sale).status_code, 409)
+        self.assertEqual(self.post(views.remove_sale_item, line.pk).status_code, 409)
+
+        self.session.refresh_from_db()
+        sale.refresh_from_db()
+        self.assertEqual((sale.total_amount, self.session.total_sales), (Decimal('20'), Decimal('20')))
+        self.assertEqual(SalesDailyRollup.objects.get().total_amount, Decimal('20'))
+        self.assertEqual(self.on_hand(), 3)
+
+
+class SalesHistoryTests(StaffTestCase):
+    def history(self, **params):
+        request = RequestFactory().get('/', {'format': 'json', 'limit': 2, **params})
+        request.user = self.staff
+        response = views.sales_history(request)
+        return response.status_code, json.loads(response.content)
+
+    def test_pages_newest_first(self):
+        now = timezone.now()
+        # Two sales at the same moment, so the pages have to break the tie on the id
+        moments = [now - datetime.timedelta(days=2), now - datetime.timedelta(hours=1), now, now, now]
+        sales = [Sale.objects.create(branch=self.branch, staff=self.staff, is_completed=True, sale_date=moment)
+                 for moment in moments]
+        self.open_sale()
+
+        seen, cursor = [], ''
+        while cursor is not None:
+            status, body = self.history(cursor=cursor)
+            self.assertEqual(status, 200)
+            seen += [row['id'] for row in body['results']]
+            cursor = body['next_cursor']
+
+        self.assertEqual(seen, [sale.pk for sale in sales[::-1]])
+
+    def test_tampered_cursor(self):
+        status, body = self.history(cursor='bm90IG91cnM')
+
+        self.assertEqual((status, body['status']), (400, 'error'))
+
+
+class ReservationTests(StaffTestCase):
+    def other_session(self):
+        staff = CustomUser.objects.create_user('other', password='x', branch=self.branch)
+        return POSSession.objects.create(staff=staff, branch=self.branch)
+
+    def test_holds_cannot_exceed_stock(self):
+        reservations.reserve(self.other_session(), self.product, 4)
+
+        with self.assertRaises(InsufficientStockError):
+            reservations.reserve(self.session, self.product, 2)
+        self.assertFalse(StockReservation.objects.filter(session=self.session).exists())
+
+        # Asking again replaces the hold rather than adding to it
+        reservations.reserve(self.session, self.product, 1)
+        reservations.reserve(self.session, self.product, 1)
+        self.assertEqual(reservations.available_to_sell(self.branch, [self.product.pk]), {self.product.pk: 0})
+
+    def test_sell_uses_up_only_the_sessions_own_hold(self):
+        reservations.reserve(self.other_session(), self.product, 2)
+        reservations.reserve(self.session, self.product, 3)
+
+        reservations.sell(self.branch, self.product, 2, session=self.session)
+        self.assertEqual(StockReservation.objects.get(session=self.session).quantity, 1)
+        with self.assertRaises(InsufficientStockError):
+            reservations.sell(self.branch, self.product, 2)
+
+        self.assertEqual(self.on_hand(), 3)
+
+    def test_sweep_reclaims_lapsed_holds(self):
+        reservations.reserve(self.other_session(), self.product, 5, ttl=datetime.timedelta(seconds=-1))
+
+        self.assertEqual(reservations.sweep_expired(), 1)
+        self.assertEqual(reservations.available_to_sell(self.branch, [self.product.pk]), {self.product.pk: 5})
+
+    def test_pos_line_respects_other_carts(self):
+        reservations.reserve(self.other_session(), self.product, 4)
+        sale = self.open_sale()
+
+        response = self.post(views.add_sale_item, data={'sale_id': sale.pk, 'product': self.product.pk,
+                                                        'quantity': 2, 'discount': 0})
+
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(sale.items.exists())
+        self.assertEqual(self.on_hand(), 5)
+
+
+class IdempotencyTests(StaffTestCase):
+    def add(self, sale, quantity=1, key='key-1'):
+        return self.post(views.add_sale_item, data={'sale_id': sale.pk, 'product': self.product.pk,
+                                                    'quantity': quantity, 'discount': 0},
+                         headers={'Idempotency-Key': key})
+
+    def test_retry_replays_the_stored_response(self):
+        sale = self.open_sale()
+        first = self.add(sale)
+        again = self.add(sale)
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual((again.status_code, again.content), (200, first.content))
+        self.assertEqual(again['Idempotent-Replayed'], 'true')
+        self.assertEqual(bytes(IdempotencyKey.objects.get(key='key-1').response_body), first.content)
+        self.assertEqual(sale.items.count(), 1)
+        self.assertEqual(self.on_hand(), 4)
+
+    def test_duplicate_while_the_first_is_running(self):
+        sale = self.open_sale()
+        sell = reservations.sell
+        duplicates = []
+
+        def sell_and_get_retried(*args, **kwargs):
+            # The client gives up waiting and retries while this request is still at work
+            if not duplicates:
+                duplicates.append(self.add(sale))
+            return sell(*args, **kwargs)
+
+        with mock.patch.object(reservations, 'sell', sell_and_get_retried):
+            first = self.add(sale)
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(duplicates[0].status_code, 409)
+        self.assertEqual(self.add(sale).content, first.content)
+        self.assertEqual(self.on_hand(), 4)
+
+    def test_key_reused_for_another_request(self):
+        sale = self.open_sale()
+        self.add(sale, quantity=1)
+
+        response = self.add(sale, quantity=2)
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(self.on_hand(), 4)
+
+    def test_claim_is_released_after_a_failure(self):
+        sale = self.open_sale()
+        with mock.patch.object(reservations, 'sell', side_effect=RuntimeError('database went away')):
+            with self.assertRaises(RuntimeError):
+                self.add(sale)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        self.assertEqual(self.add(sale).status_code, 200)
+        self.assertEqual(self.on_hand(), 4)
+
+    def test_claim_is_released_after_a_server_error(self):
+        calls = []
+
+        @idempotent
+        def flaky(request):
+            calls.append(request)
+            return JsonResponse({'status': 'error'}, status=503 if len(calls) == 1 else 200)
+
+        self.assertEqual(self.post(flaky, headers={'Idempotency-Key': 'k'}).status_code, 503)
+        self.assertEqual(self.post(flaky, headers={'Idempotency-Key': 'k'}).status_code, 200)
+        self.assertEqual(self.post(flaky, headers={'Idempotency-Key': 'k'}).status_code, 200)
+        self.assertEqual(len(calls), 2)
+
+
+class ConcurrentIdempotencyTests(TransactionTestCase):
+    """Duplicates fired together run the mutation once"""
+
+    def test_parallel_duplicates(self):
+        branch, staff, product = create_shop()
+        sale = Sale.objects.create(branch=branch, staff=staff,
+                                   pos_session=POSSession.objects.create(staff=staff, branch=branch))
+        responses = [None] * 4
+        barrier = threading.Barrier(len(responses))
+
+        def client(index):
+            barrier.wait()
+            try:
+                for _ in range(500):
+                    request = RequestFactory().post('/', {'sale_id': sale.pk, 'product': product.pk, 'quantity': 1,
+                                                          'discount': 0}, headers={'Idempotency-Key': 'same'})
+                    request.user = staff
+                    try:
+                        responses[index] = views.add_sale_item(request)
+                    except OperationalError:
+                        # SQLite reports writer contention as a lock timeout
+                        continue
+                    if responses[index].status_code != 409:
+                        return
+                    time.sleep(0.01)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=client, args=(index,)) for index in range(len(responses))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual({response.status_code for response in responses}, {200})
+        self.assertEqual(len({response.content for response in responses}), 1)
+        self.assertEqual(sale.items.count(), 1)
+        self.assertEqual(Inventory.objects.get(branch=branch, product=product).quantity, 4)
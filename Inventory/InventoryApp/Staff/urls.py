@@ -12,6 +12,11 @@ urlpatterns = [
     path('pos/add-item/', views.add_sale_item, name='add_sale_item'),
     path('pos/remove-item/<int:pk>/', views.remove_sale_item, name='remove_sale_item'),
     path('pos/complete-sale/<int:pk>/', views.complete_sale, name='complete_sale'),
+    path('pos/reserve/', views.reserve_item, name='reserve_item'),
+    path('pos/release/', views.release_item, name='release_item'),
+    path('pos/snapshot/', views.pos_snapshot, name='pos_snapshot'),
+    path('pos/autocomplete/', views.autocomplete_products, name='autocomplete_products'),
+    path('pos/sessions/<int:session_id>/z-report/', views.z_report, name='z_report'),
 
     # Inventory viewing
     path('inventory/', views.inventory_list, name='inventory_list'),
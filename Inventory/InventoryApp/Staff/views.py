@@ -2,13 +2,22 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required, permission_required
 from django.contrib import messages
 from django.http import JsonResponse
+from django.db import transaction
 from django.db.models import Sum, Count, F, Q
 from django.utils import timezone
 from django.apps import apps
 
+from AdminPanel import exports, pagination
+from inventory import autocomplete, search as product_search
 from inventory.models import Product, Phone, Accessory, Inventory
-from Sales.models import Sale, SaleItem, Customer
+from inventory.stock import InsufficientStockError, add_stock_bulk, restore_stock
+from Sales import customers as customer_search
+from Sales.models import Sale, SaleItem, Customer, SalesDailyRollup
+from Sales.rollup import record_sale
 from Sales.forms import SaleForm, SaleItemForm, CustomerForm
+from . import reservations
+from .idempotency import idempotent
+from .models import POSSession
 
 
 
@@ -16,9 +25,6 @@ from Sales.forms import SaleForm, SaleItemForm, CustomerForm
 @permission_required('accounts.can_access_staff_portal', raise_exception=True)
 def dashboard(request):
     """Staff dashboard view with summary statistics"""
-    # Get current date
-    today = timezone.now().date()
-
     # Get user's branch
     branch = request.user.branch
 
@@ -26,19 +32,30 @@ def dashboard(request):
         messages.warning(request, "You are not assigned to any branch. Please contact your administrator.")
         return redirect('accounts:profile')
 
-    # Get sales statistics for this branch and this staff
-    today_sales = Sale.objects.filter(branch=branch, sale_date__date=today)
-    my_sales = today_sales.filter(staff=request.user)
+    # The branch's own trading day, which may differ from the server's date
+    today = branch.today()
+
+    # Get sales statistics for this branch and this staff from the daily rollup
+    totals = SalesDailyRollup.objects.filter(branch=branch, business_date=today).aggregate(
+        today_sales_count=Sum('sale_count'),
+        today_sales_amount=Sum('total_amount'),
+        my_sales_count=Sum('sale_count', filter=Q(staff=request.user)),
+        my_sales_amount=Sum('total_amount', filter=Q(staff=request.user)),
+    )
 
-    today_sales_count = today_sales.count()
-    today_sales_amount = today_sales.aggregate(total=Sum('total_amount'))['total'] or 0
+    today_sales_count = totals['today_sales_count'] or 0
+    today_sales_amount = totals['today_sales_amount'] or 0
 
-    my_sales_count = my_sales.count()
-    my_sales_amount = my_sales.aggregate(total=Sum('total_amount'))['total'] or 0
+    my_sales_count = totals['my_sales_count'] or 0
+    my_sales_amount = totals['my_sales_amount'] or 0
 
     # Get inventory statistics for this branch
-    low_stock_items = Inventory.objects.filter(branch=branch, quantity__lte=F('reorder_level')).count()
-    out_of_stock_items = Inventory.objects.filter(branch=branch, quantity=0).count()
+    stock = Inventory.objects.filter(branch=branch).aggregate(
+        low_stock_items=Count('id', filter=Q(quantity__lte=F('reorder_level'))),
+        out_of_stock_items=Count('id', filter=Q(quantity=0)),
+    )
+    low_stock_items = stock['low_stock_items']
+    out_of_stock_items = stock['out_of_stock_items']
 
     context = {
         'today_sales_count': today_sales_count,
@@ -93,6 +110,7 @@ def pos(request):
 
 @login_required
 @permission_required('accounts.can_access_staff_portal', raise_exception=True)
+@idempotent
 def create_sale(request):
     """Create new sale API view"""
     if request.method != 'POST':
@@ -104,11 +122,12 @@ def create_sale(request):
     if not branch:
         return JsonResponse({'status': 'error', 'message': 'You are not assigned to any branch'}, status=400)
 
-    # Create empty sale
+    # Create empty sale on the cashier's open shift
     sale = Sale.objects.create(
         branch=branch,
         staff=request.user,
         sale_date=timezone.now(),
+        pos_session=POSSession.objects.filter(staff=request.user, branch=branch, status='active').first(),
     )
 
     return JsonResponse({
@@ -120,6 +139,7 @@ def create_sale(request):
 
 @login_required
 @permission_required('accounts.can_access_staff_portal', raise_exception=True)
+@idempotent
 def add_sale_item(request):
     """Add item to sale API view"""
     if request.method != 'POST':
@@ -155,12 +175,21 @@ def add_sale_item(request):
         # Save the item with calculated values
         sale_item.unit_price = price
         sale_item.total_price = item_total
-        sale_item.save()
 
-        # Update inventory
-        inventory = Inventory.objects.get(product=product, branch=sale.branch)
-        inventory.quantity -= quantity
-        inventory.save()
+        # Take the stock and record the item together, so a failed
+        # decrement never leaves an orphan line behind. Units other carts
+        # have reserved are not for sale here, as in checkout.
+        try:
+            with transaction.atomic():
+                # Completed sales are already counted in the shift and daily totals; lock the
+                # row so completion cannot slip in between this check and the new line
+                if Sale.objects.select_for_update().filter(pk=sale.pk, is_completed=True).exists():
+                    return JsonResponse({'status': 'error', 'message': 'Sale is already completed'}, status=409)
+                reservations.sell(sale.branch, product, quantity, session=sale.pos_session,
+                                  reference_type='sale', reference_id=sale.id, user=request.user)
+                sale_item.save()
+        except InsufficientStockError as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=409)
 
         # Update sale totals
         sale.update_totals()
@@ -182,6 +211,7 @@ def add_sale_item(request):
 
 @login_required
 @permission_required('accounts.can_access_staff_portal', raise_exception=True)
+@idempotent
 def remove_sale_item(request, item_id):
     """Remove item from sale API view"""
     if request.method != 'POST':
@@ -196,13 +226,14 @@ def remove_sale_item(request, item_id):
     # Get associated sale
     sale = sale_item.sale
 
-    # Return quantity to inventory
-    inventory = Inventory.objects.get(product=sale_item.product, branch=sale.branch)
-    inventory.quantity += sale_item.quantity
-    inventory.save()
-
-    # Delete the item
-    sale_item.delete()
+    # Return quantity to inventory and delete the item
+    with transaction.atomic():
+        # As in add_sale_item, a completed sale's lines are final
+        if Sale.objects.select_for_update().filter(pk=sale.pk, is_completed=True).exists():
+            return JsonResponse({'status': 'error', 'message': 'Sale is already completed'}, status=409)
+        restore_stock(sale_item.product_id, sale.branch_id, sale_item.quantity, reference_type='sale',
+                      reference_id=sale.id, user=request.user)
+        sale_item.delete()
 
     # Update sale totals
     sale.update_totals()
@@ -214,6 +245,97 @@ def remove_sale_item(request, item_id):
     })
 
 
+@login_required
+@permission_required('accounts.can_access_staff_portal', raise_exception=True)
+def reserve_item(request):
+    """Hold stock for a product in the current POS cart API view"""
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Method not allowed'}, status=405)
+
+    # Get the cashier's open session
+    try:
+        session = POSSession.objects.get(id=request.POST.get('session_id'), staff=request.user, status='active')
+        product_id = int(request.POST.get('product_id'))
+        quantity = int(request.POST.get('quantity', 1))
+    except (POSSession.DoesNotExist, TypeError, ValueError):
+        return JsonResponse({'status': 'error', 'message': 'Active session, product and quantity are required'},
+                            status=400)
+
+    try:
+        reservations.reserve(session, product_id, quantity)
+    except InsufficientStockError as e:
+        return JsonResponse({'status': 'error', 'message': str(e), 'quantity_available': e.available}, status=409)
+
+    available = reservations.available_to_sell(session.branch_id, [product_id]).get(product_id, 0)
+
+    return JsonResponse({
+        'status': 'success',
+        'product_id': product_id,
+        'reserved': max(quantity, 0),
+        'quantity_available': available,
+    })
+
+
+@login_required
+@permission_required('accounts.can_access_staff_portal', raise_exception=True)
+def release_item(request):
+    """Release stock held by the current POS cart API view"""
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Method not allowed'}, status=405)
+
+    try:
+        session = POSSession.objects.get(id=request.POST.get('session_id'), staff=request.user)
+    except (POSSession.DoesNotExist, ValueError):
+        return JsonResponse({'status': 'error', 'message': 'Session not found'}, status=404)
+
+    # Without a product the whole cart is released
+    reservations.release(session, request.POST.get('product_id') or None)
+
+    return JsonResponse({'status': 'success'})
+
+
+@login_required
+@permission_required('accounts.can_access_staff_portal', raise_exception=True)
+def pos_snapshot(request):
+    """Product, price and stock snapshot the POS keeps for offline selling API view"""
+    branch = request.user.branch
+
+    if not branch:
+        return JsonResponse({'status': 'error', 'message': 'You are not assigned to any branch'}, status=400)
+
+    # One query; rows are positional to keep the payload small on slow links
+    rows = reservations.with_reserved(
+        Inventory.objects.filter(branch=branch, product__is_active=True), branch
+    ).values_list(
+        'product_id', 'product__sku', 'product__barcode', 'product__name', 'product__selling_price',
+        'product__product_type', 'quantity', 'reserved',
+    ).order_by('product_id')
+
+    return JsonResponse({
+        'status': 'success',
+        'branch_id': branch.id,
+        'generated_at': timezone.now().isoformat(),
+        'columns': ['id', 'sku', 'barcode', 'name', 'price', 'type', 'quantity'],
+        'rows': [
+            [product_id, sku, barcode, name, str(price), product_type, max(quantity - reserved, 0)]
+            for product_id, sku, barcode, name, price, product_type, quantity, reserved in rows
+        ],
+    })
+
+
+@login_required
+@permission_required('accounts.can_access_staff_portal', raise_exception=True)
+def z_report(request, session_id):
+    """End-of-shift Z-report API view"""
+    session = get_object_or_404(POSSession, id=session_id)
+
+    # Cashiers only see their own shifts
+    if session.staff_id != request.user.id and not request.user.is_superuser:
+        return JsonResponse({'status': 'error', 'message': 'Session not found'}, status=404)
+
+    return JsonResponse({'status': 'success', 'report': session.z_report()})
+
+
 @login_required
 @permission_required('accounts.can_access_staff_portal', raise_exception=True)
 def update_sale(request, sale_id):
@@ -244,11 +366,24 @@ def update_sale(request, sale_id):
         sale.discount_amount = form.cleaned_data['discount_amount'] or 0
         sale.notes = form.cleaned_data['notes']
 
-        # Save changes
-        sale.save()
+        with transaction.atomic():
+            # What the sale looked like for the shift and daily totals, read under a lock so a line
+            # added meanwhile is counted; the form has already edited `sale` in place
+            previous = Sale.objects.select_for_update().get(pk=sale.pk)
 
-        # Update totals
-        sale.update_totals()
+            # Save only the edited fields; the running totals belong to the SaleItem deltas
+            sale.save(update_fields=['customer', 'payment_method', 'discount_amount', 'notes', 'updated_at'])
+
+            # Update totals
+            sale.update_totals()
+
+            # Completed sales are already counted; move them to their new payment method and total
+            if sale.is_completed:
+                record_sale(previous, reverse=True)
+                record_sale(sale)
+                if sale.pos_session_id:
+                    sale.pos_session.update_sales_totals(previous, reverse=True)
+                    sale.pos_session.update_sales_totals(sale)
 
         return JsonResponse({
             'status': 'success',
@@ -296,29 +431,8 @@ def search_products(request):
     if not query:
         return JsonResponse({'status': 'error', 'message': 'Search query is required'}, status=400)
 
-    # Search for products
-    products = Product.objects.filter(
-        Q(name__icontains=query) |
-        Q(sku__icontains=query) |
-        Q(barcode__icontains=query),
-        inventory__branch=branch,
-        inventory__quantity__gt=0,
-        is_active=True
-    ).distinct()
-
-    # Format results
-    results = []
-    for product in products:
-        inventory = product.inventory.get(branch=branch)
-        results.append({
-            'id': product.id,
-            'name': product.name,
-            'sku': product.sku,
-            'price': float(product.selling_price),
-            'quantity_available': inventory.quantity,
-            'product_type': 'Phone' if hasattr(product, 'phone') else 'Accessory',
-            'image_url': product.image.url if product.image else None,
-        })
+    # Ranked index lookup; price, stock and type come back in the same query
+    results = product_search.search_products(branch, query, limit=20)
 
     return JsonResponse({
         'status': 'success',
@@ -326,6 +440,22 @@ def search_products(request):
     })
 
 
+@login_required
+@permission_required('accounts.can_access_staff_portal', raise_exception=True)
+def autocomplete_products(request):
+    """Keystroke-level product completions from the in-memory typeahead API view"""
+    query = request.GET.get('q', '')
+    try:
+        limit = min(int(request.GET.get('limit') or autocomplete.default_limit()), autocomplete.MAX_LIMIT)
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'limit must be a number'}, status=400)
+
+    return JsonResponse({
+        'status': 'success',
+        'results': autocomplete.index.complete(query, max(limit, 1)),
+    })
+
+
 @login_required
 @permission_required('accounts.can_access_staff_portal', raise_exception=True)
 def search_customers(request):
@@ -335,11 +465,9 @@ def search_customers(request):
     if not query:
         return JsonResponse({'status': 'error', 'message': 'Search query is required'}, status=400)
 
-    # Search for customers
-    customers = Customer.objects.filter(
-        Q(name__icontains=query) |
-        Q(email__icontains=query) |
-        Q(phone_number__icontains=query)
+    # Indexed prefix search over phone keys and name tokens, one page at a time
+    customers, next_cursor = customer_search.search_customers(
+        query, limit=request.GET.get('limit'), cursor=request.GET.get('cursor')
     )
 
     # Format results
@@ -355,6 +483,7 @@ def search_customers(request):
     return JsonResponse({
         'status': 'success',
         'results': results,
+        'next_cursor': next_cursor,
     })
 
 
@@ -365,9 +494,18 @@ def complete_sale(request, sale_id):
     # Get the sale
     sale = get_object_or_404(Sale, id=sale_id)
 
-    # Update sale status
-    sale.is_completed = True
-    sale.save()
+    # Update sale status; only the request that flips it counts it towards the shift
+    with transaction.atomic():
+        completed = Sale.objects.filter(pk=sale.pk, is_completed=False).update(
+            is_completed=True, updated_at=timezone.now()
+        )
+        sale.is_completed = True
+        if completed:
+            # Count the totals as they stand now the row is locked, not as first read
+            sale.refresh_from_db()
+            record_sale(sale)
+            if sale.pos_session_id:
+                sale.pos_session.update_sales_totals(sale)
 
     # Get sale items
     items = sale.items.all()
@@ -393,14 +531,16 @@ def cancel_sale(request, sale_id):
     sale = get_object_or_404(Sale, id=sale_id)
 
     if request.method == 'POST':
-        # Return items to inventory
-        for item in sale.items.all():
-            inventory = Inventory.objects.get(product=item.product, branch=sale.branch)
-            inventory.quantity += item.quantity
-            inventory.save()
-
-        # Delete the sale
-        sale.delete()
+        # Return items to inventory and delete the sale
+        quantities = dict(sale.items.values('product_id').annotate(total=Sum('quantity')).values_list(
+            'product_id', 'total'))
+        with transaction.atomic():
+            add_stock_bulk(sale.branch_id, quantities, reference_type='sale', reference_id=sale.id,
+                           user=request.user)
+            record_sale(sale, reverse=True)
+            if sale.pos_session_id:
+                sale.pos_session.update_sales_totals(sale, reverse=True)
+            sale.delete()
 
         messages.success(request, f'Sale #{sale.invoice_number} has been cancelled.')
         return redirect('staff_portal:pos')
@@ -412,6 +552,10 @@ def cancel_sale(request, sale_id):
     return render(request, 'staff_portal/sales/cancel.html', context)
 
 
+# Newest first. Leading with the trading day lets one index serve both the date filter and the order
+SALES_HISTORY_ORDER = ['-business_date', '-sale_date', '-pk']
+
+
 @login_required
 @permission_required('accounts.can_access_staff_portal', raise_exception=True)
 def sales_history(request):
@@ -432,21 +576,45 @@ def sales_history(request):
     # Base queryset
     sales = Sale.objects.filter(branch=branch, is_completed=True)
 
-    # Apply filters
+    # Apply filters; dates are the branch's trading days, stored so the range is an index scan
     if date_from:
-        sales = sales.filter(sale_date__date__gte=date_from)
+        sales = sales.filter(business_date__gte=date_from)
     if date_to:
-        sales = sales.filter(sale_date__date__lte=date_to)
+        sales = sales.filter(business_date__lte=date_to)
     if payment_method:
         sales = sales.filter(payment_method=payment_method)
     if only_mine:
         sales = sales.filter(staff=request.user)
 
-    # Order by most recent
-    sales = sales.order_by('-sale_date')
+    # ?export=csv or ?export=excel streams every matching sale instead of rendering the page
+    export_format = request.GET.get('export')
+    if export_format in exports.CONTENT_TYPES:
+        return exports.streaming_response(exports.SALE_HEADER, exports.sale_rows(sales.order_by(*SALES_HISTORY_ORDER)),
+                                          export_format, f'sales-{branch.pk}-{branch.today():%Y%m%d}')
+
+    # Most recent first, one page at a time
+    try:
+        page = pagination.paginate(sales.select_related('customer'), SALES_HISTORY_ORDER,
+                                   request.GET.get('cursor'), request.GET.get('limit'))
+    except pagination.InvalidCursor as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'status': 'success',
+            'results': [{
+                'id': sale.id,
+                'invoice_number': sale.invoice_number,
+                'sale_date': sale.sale_date.isoformat(),
+                'customer': sale.customer.name if sale.customer else None,
+                'payment_method': sale.payment_method,
+                'total_amount': str(sale.total_amount),
+            } for sale in page],
+            **page.cursors(),
+        })
 
     context = {
-        'sales': sales,
+        'sales': page,
+        'page': page,
         'date_from': date_from,
         'date_to': date_to,
         'payment_method': payment_method,
@@ -511,12 +679,32 @@ def inventory_list(request):
             Q(product__barcode__icontains=search)
         )
 
+    try:
+        page = pagination.paginate(inventory_items.select_related('product'), ['product__name', 'pk'],
+                                   request.GET.get('cursor'), request.GET.get('limit'))
+    except pagination.InvalidCursor as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'status': 'success',
+            'results': [{
+                'id': item.id,
+                'product_id': item.product_id,
+                'name': item.product.name,
+                'sku': item.product.sku,
+                'quantity': item.quantity,
+                'reorder_level': item.reorder_level,
+            } for item in page],
+            **page.cursors(),
+        })
+
     # Get categories for filter
     from inventory.models import Category
     categories = Category.objects.all()
 
     context = {
-        'inventory_items': inventory_items,
+        'inventory_items': page,
+        'page': page,
         'categories': categories,
         'selected_category': category,
         'stock_status': stock_status,
@@ -571,23 +759,38 @@ def customer_list(request):
     # Get filter parameters
     search = request.GET.get('search')
 
-    # Base queryset
-    customers = Customer.objects.all()
-
     # Apply filters
     if search:
-        customers = customers.filter(
-            Q(name__icontains=search) |
-            Q(email__icontains=search) |
-            Q(phone_number__icontains=search)
+        # The search walks its own index order, so it only pages forwards
+        customers, next_cursor = customer_search.search_customers(
+            search, limit=request.GET.get('limit'), cursor=request.GET.get('cursor')
         )
-
-    # Order by recent
-    customers = customers.order_by('-created_at')
+        page = pagination.KeysetPage(customers, next_cursor, None)
+    else:
+        # Order by recent
+        try:
+            page = pagination.paginate(Customer.objects.all(), ['-created_at', '-pk'],
+                                       request.GET.get('cursor'), request.GET.get('limit'))
+        except pagination.InvalidCursor as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'status': 'success',
+            'results': [{
+                'id': customer.id,
+                'name': customer.name,
+                'email': customer.email,
+                'phone_number': customer.phone_number,
+            } for customer in page],
+            **page.cursors(),
+        })
 
     context = {
-        'customers': customers,
+        'customers': page,
+        'page': page,
         'search': search,
+        'next_cursor': page.next_cursor,
     }
 
     return render(request, 'staff_portal/customers/list.html', context)
@@ -0,0 +1,153 @@
+import threading
+from bisect import bisect_left, insort
+
+from django.conf import settings
+
+from .catalog import bump_catalog_version, catalog_version
+from .models import Product
+from .search import TOKEN_RE
+
+MAX_LIMIT = 20
+
+
+def _fold(text):
+    return ' '.join(TOKEN_RE.findall((text or '').lower()))
+
+
+class SortedTerms:
+    """Sorted (term, product id) pairs answering prefix queries with bisect"""
+
+    def __init__(self, pairs=()):
+        self.pairs = sorted(pairs)
+
+    def add(self, term, product_id):
+        insort(self.pairs, (term, product_id))
+
+    def remove(self, term, product_id):
+        index = bisect_left(self.pairs, (term, product_id))
+        if index < len(self.pairs) and self.pairs[index] == (term, product_id):
+            del self.pairs[index]
+
+    def scan(self, prefix):
+        index = bisect_left(self.pairs, (prefix,))
+        while index < len(self.pairs):
+            term, product_id = self.pairs[index]
+            if not term.startswith(prefix):
+                return
+            yield product_id
+            index += 1
+
+
+class AutocompleteIndex:
+    """
+    Per-process typeahead over active product names, SKUs and model numbers.
+
+    Matches are tried in three tiers, each a sorted array: the start of the
+    product name, the start of any later word in the name, then SKU and
+    model number. The index is loaded with one query on first use, kept
+    current by product save/delete signals, and rebuilt when the shared
+    catalogue version moves on without this process having seen the change,
+    for example after a bulk import or an edit served by another worker.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = None
+        self.products = {}
+        self.tiers = (SortedTerms(), SortedTerms(), SortedTerms())
+
+    @staticmethod
+    def _terms(entry):
+        name = _fold(entry['name'])
+        words = name.split(' ')
+        return (
+            {name},
+            {' '.join(words[i:]) for i in range(1, len(words))},
+            {term for term in (_fold(entry['sku']), _fold(entry['model_number'])) if term},
+        )
+
+    def _add(self, entry):
+        self.products[entry['id']] = entry
+        for tier, terms in zip(self.tiers, self._terms(entry)):
+            for term in terms:
+                tier.add(term, entry['id'])
+
+    def _remove(self, product_id):
+        entry = self.products.pop(product_id, None)
+        if entry is not None:
+            for tier, terms in zip(self.tiers, self._terms(entry)):
+                for term in terms:
+                    tier.remove(term, product_id)
+
+    def rebuild(self, version=None):
+        version = catalog_version() if version is None else version
+        rows = Product.objects.filter(is_active=True).values_list(
+            'id', 'name', 'sku', 'selling_price', 'product_type', 'phone__model_number')
+
+        products = {}
+        tiers = ([], [], [])
+        for product_id, name, sku, price, product_type, model_number in rows:
+            entry = {'id': product_id, 'name': name, 'sku': sku, 'price': float(price),
+                     'product_type': product_type, 'model_number': model_number}
+            products[product_id] = entry
+            for pairs, terms in zip(tiers, self._terms(entry)):
+                pairs.extend((term, product_id) for term in terms)
+
+        with self._lock:
+            self.products = products
+            self.tiers = tuple(SortedTerms(pairs) for pairs in tiers)
+            self.version = version
+
+    def ensure_current(self):
+        version = catalog_version()
+        if version != self.version:
+            self.rebuild(version)
+
+    def complete(self, prefix, limit=10):
+        """Top `limit` products whose name, a later name word, SKU or model number starts with `prefix`"""
+        prefix = _fold(prefix)
+        if not prefix:
+            return []
+        self.ensure_current()
+
+        results = []
+        seen = set()
+        with self._lock:
+            for tier in self.tiers:
+                for product_id in tier.scan(prefix):
+                    if product_id not in seen:
+                        seen.add(product_id)
+                        results.append(self.products[product_id])
+                        if len(results) == limit:
+                            return [dict(entry) for entry in results]
+        return [dict(entry) for entry in results]
+
+    def apply(self, product, deleted=False):
+        """Fold one committed product change into the index and publish a new catalogue version"""
+        with self._lock:
+            if self.version is not None:
+                previous = self.products.get(product.pk)
+                self._remove(product.pk)
+                if not deleted and product.is_active:
+                    self._add({
+                        'id': product.pk,
+                        'name': product.name,
+                        'sku': product.sku,
+                        'price': float(product.selling_price),
+                        'product_type': product.product_type,
+                        # A save through the Product base class does not carry the phone fields
+                        'model_number': getattr(product, 'model_number',
+                                                previous['model_number'] if previous else None),
+                    })
+
+            version = bump_catalog_version()
+            if self.version is not None:
+                # Only skip the rebuild when no other process changed the catalogue in between
+                self.version = version if version == self.version + 1 else None
+
+
+index = AutocompleteIndex()
+
+
+def default_limit():
+    return getattr(settings, 'AUTOCOMPLETE_LIMIT', 10)
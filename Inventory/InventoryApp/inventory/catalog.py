@@ -0,0 +1,28 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import CatalogVersion
+
+# The stamp lives in the database rather than the cache: the default cache is
+# private to each process, and cache increments are not atomic across workers
+STAMP_ID = 1
+
+
+def catalog_version():
+    """Current catalogue version stamp, shared by every worker through one database row"""
+    version = CatalogVersion.objects.filter(pk=STAMP_ID).values_list('version', flat=True).first()
+    return 1 if version is None else version
+
+
+def bump_catalog_version():
+    """Mark the catalogue as changed so other workers rebuild their in-memory copies"""
+    stamp = CatalogVersion.objects.filter(pk=STAMP_ID)
+    with transaction.atomic():
+        if not stamp.update(version=F('version') + 1):
+            try:
+                with transaction.atomic():
+                    return CatalogVersion.objects.create(pk=STAMP_ID, version=2).version
+            except IntegrityError:
+                # Another worker made the first change at the same moment
+                stamp.update(version=F('version') + 1)
+        return stamp.values_list('version', flat=True).get()
@@ -74,7 +74,7 @@ class InventoryForm(forms.ModelForm):
 class BranchForm(forms.ModelForm):
     class Meta:
         model = Branch
-        fields = ('name', 'address', 'phone_number', 'email', 'manager', 'is_active')
+        fields = ('name', 'address', 'phone_number', 'email', 'manager', 'is_active', 'time_zone', 'day_cutoff')
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -0,0 +1,92 @@
+import random
+import time
+import uuid
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from inventory import scan
+from inventory.models import Branch, Brand, Category, Inventory, Product
+
+
+class Command(BaseCommand):
+    help = 'Scan a stream of barcodes through the till fast path and compare it with a plain ORM lookup'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=20000, help='Products in the synthetic catalogue')
+        parser.add_argument('--scans', type=int, default=100000, help='Codes to scan')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        total = options['products']
+        scans = options['scans']
+        rng = random.Random(options['seed'])
+
+        tag = uuid.uuid4().hex[:8]
+        category = Category.objects.create(name=f'bench-{tag}')
+        brand = Brand.objects.create(name=f'bench-{tag}')
+        branch = Branch.objects.create(name=f'bench-{tag}', address='-', phone_number='-')
+
+        try:
+            products = Product.objects.bulk_create([
+                Product(product_type='accessory', name=f'Bench {tag} #{i}', sku=f'BENCH-{tag}-{i}',
+                        barcode=f'{tag}{i:08d}', category=category, brand=brand, cost_price=1, selling_price=2)
+                for i in range(total)
+            ])
+            Inventory.objects.bulk_create([
+                Inventory(product=product, branch=branch, quantity=50) for product in products
+            ])
+
+            # Till traffic is skewed: a few hundred fast movers make up most scans
+            weights = [1 / (rank + 1) for rank in range(total)]
+            codes = [product.barcode for product in rng.choices(products, weights=weights, k=scans)]
+            codes += [f'{tag}-unknown-{i}' for i in range(scans // 100)]
+            rng.shuffle(codes)
+
+            scan.cache.clear()
+            timings = []
+            queries = []
+            with connection.execute_wrapper(lambda execute, sql, *rest: queries.append(sql) or execute(sql, *rest)):
+                started = time.perf_counter()
+                for code in codes:
+                    scan_started = time.perf_counter()
+                    scan.scan(code, branch)
+                    timings.append(time.perf_counter() - scan_started)
+                elapsed = time.perf_counter() - started
+
+            # Baseline: what check_barcode did before, on a sample of the same stream
+            sample = codes[:min(len(codes), 5000)]
+            started = time.perf_counter()
+            for code in sample:
+                product = Product.objects.filter(barcode=code).first()
+                if product is not None:
+                    product.inventory.filter(branch=branch).first()
+            baseline = (time.perf_counter() - started) / len(sample)
+
+            timings.sort()
+            stats = scan.cache.stats()
+            self.stdout.write(f'Scans:            {len(codes)} over {total} products')
+            self.stdout.write(f'Fast path:        {elapsed:.2f} s, {elapsed / len(codes) * 1e6:.0f} us/scan, '
+                              f'p95 {timings[int(len(timings) * 0.95) - 1] * 1e6:.0f} us, '
+                              f'{len(queries) / len(codes):.2f} queries/scan')
+            self.stdout.write(f'ORM baseline:     {baseline * 1e6:.0f} us/scan')
+            self.stdout.write(f"Cache:            {stats['hits']} hits, {stats['misses']} misses, "
+                              f"{stats['evictions']} evictions, hit rate {stats['hit_rate']}")
+
+            # A price change must reach the till on the very next scan
+            product = Product.objects.get(pk=products[0].pk)
+            scan.scan(product.barcode, branch)
+            product.selling_price = 3
+            product.save()
+            if scan.scan(product.barcode, branch)['selling_price'] != Decimal('3.00'):
+                raise CommandError('Scan cache served a stale price after a product save')
+            if len(queries) > len(codes):
+                raise CommandError('Scans issued more than one query each')
+            self.stdout.write(self.style.SUCCESS('One query per scan; product saves invalidate cached entries'))
+        finally:
+            branch.delete()
+            Product.objects.filter(category=category).delete()
+            category.delete()
+            brand.delete()
+            scan.cache.clear()
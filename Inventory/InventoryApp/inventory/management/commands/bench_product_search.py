@@ -0,0 +1,98 @@
+import random
+import statistics
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory import search
+from inventory.models import Branch, Brand, Category, Inventory, Product
+
+WORDS = (
+    'galaxy pixel iphone redmi note pro max ultra lite plus mini case cover tempered glass screen protector '
+    'charger fast usb cable type lightning wireless earbuds headphone power bank memory card silicone leather '
+    'magnetic wallet clear black white blue red gold silver green purple'
+).split()
+
+
+class Command(BaseCommand):
+    help = 'Time POS product lookups against a large synthetic catalogue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=200000, help='Products in the synthetic catalogue')
+        parser.add_argument('--queries', type=int, default=2000, help='Lookups to time')
+        parser.add_argument('--target-ms', type=float, default=20.0, help='Fail when p95 latency exceeds this')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            raise CommandError('The configured database has no full-text index')
+
+        total = options['products']
+        rng = random.Random(options['seed'])
+
+        tag = uuid.uuid4().hex[:8]
+        category = Category.objects.create(name=f'bench-{tag}')
+        brands = [Brand.objects.create(name=f'{name} {tag}') for name in ('Samsung', 'Tecno', 'Infinix', 'Oraimo')]
+        branch = Branch.objects.create(name=f'bench-{tag}', address='-', phone_number='-')
+
+        try:
+            self.stdout.write(f'Loading {total} products...')
+            names = []
+            for start in range(0, total, 10000):
+                batch = []
+                for i in range(start, min(start + 10000, total)):
+                    name = ' '.join(rng.sample(WORDS, 4)).title() + f' {i % 997}'
+                    names.append(name)
+                    batch.append(Product(
+                        product_type=rng.choice(('phone', 'accessory')), name=name, sku=f'SKU-{tag}-{i:06d}',
+                        barcode=f'{tag}{i:010d}', category=category, brand=rng.choice(brands),
+                        cost_price=1, selling_price=2,
+                    ))
+                products = Product.objects.bulk_create(batch)
+                Inventory.objects.bulk_create([
+                    Inventory(product=product, branch=branch, quantity=rng.randint(0, 20)) for product in products
+                ])
+
+            started = time.perf_counter()
+            search.rebuild_index()
+            self.stdout.write(f'Index rebuilt in {time.perf_counter() - started:.2f} s')
+
+            # What cashiers type: partial names, a brand, a scanned barcode or a SKU
+            queries = []
+            for _ in range(options['queries']):
+                i = rng.randrange(total)
+                kind = rng.random()
+                if kind < 0.5:
+                    words = names[i].split()
+                    queries.append(' '.join(words[:rng.randint(1, 3)])[:rng.randint(3, 20)])
+                elif kind < 0.7:
+                    queries.append(f'{rng.choice(brands).name.split()[0]} {rng.choice(WORDS)[:3]}')
+                elif kind < 0.85:
+                    queries.append(f'{tag}{i:010d}')
+                else:
+                    queries.append(f'SKU-{tag}-{i:06d}')
+
+            timings = []
+            hits = 0
+            for query in queries:
+                started = time.perf_counter()
+                results = search.search_products(branch, query)
+                timings.append((time.perf_counter() - started) * 1000)
+                hits += bool(results)
+
+            timings.sort()
+            p50 = statistics.median(timings)
+            p95 = timings[int(len(timings) * 0.95) - 1]
+            self.stdout.write(f'Queries:          {len(queries)} ({hits} with results)')
+            self.stdout.write(f'Latency:          p50 {p50:.2f} ms, p95 {p95:.2f} ms, max {timings[-1]:.2f} ms')
+
+            if p95 > options['target_ms']:
+                raise CommandError(f"p95 {p95:.2f} ms is over the {options['target_ms']} ms target")
+            self.stdout.write(self.style.SUCCESS('Search latency is within target'))
+        finally:
+            branch.delete()
+            Product.objects.filter(category=category).delete()
+            category.delete()
+            for brand in brands:
+                brand.delete()
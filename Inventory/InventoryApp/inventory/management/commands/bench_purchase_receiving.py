@@ -0,0 +1,77 @@
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from inventory.models import Branch, Brand, Category, Inventory, Product, Purchase, PurchaseItem, Supplier
+from inventory.receiving import receive_purchase
+
+
+class Command(BaseCommand):
+    help = 'Time receiving a large container shipment and check that receipts are idempotent'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, default=2000, help='Purchase order lines in the shipment')
+        parser.add_argument('--quantity', type=int, default=24, help='Units ordered per line')
+
+    def handle(self, *args, **options):
+        lines = options['lines']
+        quantity = options['quantity']
+
+        tag = uuid.uuid4().hex[:8]
+        category = Category.objects.create(name=f'bench-{tag}')
+        brand = Brand.objects.create(name=f'bench-{tag}')
+        branch = Branch.objects.create(name=f'bench-{tag}', address='-', phone_number='-')
+        supplier = Supplier.objects.create(name=f'bench-{tag}', phone_number='-')
+
+        try:
+            products = Product.objects.bulk_create([
+                Product(product_type='accessory', name=f'Bench {tag} #{i}', sku=f'BENCH-{tag}-{i}',
+                        category=category, brand=brand, cost_price=1, selling_price=2)
+                for i in range(lines)
+            ])
+            # Half the products already have a row at this branch, half need one created
+            Inventory.objects.bulk_create([
+                Inventory(product=product, branch=branch, quantity=1) for product in products[::2]
+            ])
+            purchase = Purchase.objects.create(supplier=supplier, branch=branch)
+            PurchaseItem.objects.bulk_create([
+                PurchaseItem(purchase=purchase, product=product, quantity=quantity, unit_price=1,
+                             total_price=quantity)
+                for product in products
+            ])
+            items = list(purchase.items.values_list('id', flat=True))
+
+            # First truck brings half of every line, the second brings the rest
+            partial = {item_id: quantity // 2 for item_id in items}
+            with CaptureQueriesContext(connection) as partial_queries:
+                started = time.perf_counter()
+                receive_purchase(purchase, None, partial)
+                partial_elapsed = time.perf_counter() - started
+
+            with CaptureQueriesContext(connection) as full_queries:
+                started = time.perf_counter()
+                receive_purchase(purchase, None)
+                full_elapsed = time.perf_counter() - started
+
+            replayed = receive_purchase(purchase, None)
+            on_hand = sum(Inventory.objects.filter(branch=branch).values_list('quantity', flat=True))
+            expected = lines * quantity + len(products[::2])
+            purchase.refresh_from_db()
+
+            self.stdout.write(f'Lines:            {lines}')
+            self.stdout.write(f'Partial receipt:  {partial_elapsed * 1000:.1f} ms, {len(partial_queries)} queries')
+            self.stdout.write(f'Final receipt:    {full_elapsed * 1000:.1f} ms, {len(full_queries)} queries')
+            self.stdout.write(f'Status:           {purchase.status}')
+
+            if replayed or on_hand != expected or purchase.status != 'received':
+                raise CommandError(f'Receiving is not idempotent: expected {expected} units on hand, found {on_hand}')
+            self.stdout.write(self.style.SUCCESS('Replayed receipt added no stock'))
+        finally:
+            branch.delete()
+            supplier.delete()
+            Product.objects.filter(category=category).delete()
+            category.delete()
+            brand.delete()
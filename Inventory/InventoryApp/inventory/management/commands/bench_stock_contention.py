@@ -0,0 +1,98 @@
+import threading
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+
+from inventory.models import Branch, Brand, Category, Inventory, Product
+from inventory.stock import InsufficientStockError, deduct_stock
+
+
+class Command(BaseCommand):
+    help = 'Run N parallel sellers against a single SKU and verify no stock is lost or oversold'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sellers', type=int, default=8, help='Number of concurrent sellers')
+        parser.add_argument('--stock', type=int, default=1000, help='Starting quantity of the SKU')
+        parser.add_argument('--quantity', type=int, default=1, help='Units taken per sale')
+
+    def handle(self, *args, **options):
+        sellers = options['sellers']
+        stock = options['stock']
+        quantity = options['quantity']
+        if sellers < 1 or quantity < 1:
+            raise CommandError('--sellers and --quantity must be positive')
+
+        branch, product = self._create_fixture(stock)
+        sold = [0] * sellers
+        retries = [0] * sellers
+        barrier = threading.Barrier(sellers)
+
+        def seller(index):
+            barrier.wait()
+            try:
+                while True:
+                    try:
+                        deduct_stock(product.pk, branch.pk, quantity)
+                    except InsufficientStockError:
+                        break
+                    except OperationalError:
+                        # SQLite reports writer contention as a lock timeout
+                        retries[index] += 1
+                        continue
+                    sold[index] += quantity
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=seller, args=(i,)) for i in range(sellers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        remaining = Inventory.objects.get(product=product, branch=branch).quantity
+        total_sold = sum(sold)
+        sales = total_sold // quantity
+
+        try:
+            self.stdout.write(f'Sellers:        {sellers}')
+            self.stdout.write(f'Sales:          {sales} ({sales / elapsed:.0f}/s)')
+            self.stdout.write(f'Units sold:     {total_sold}')
+            self.stdout.write(f'Units left:     {remaining}')
+            self.stdout.write(f'Lock retries:   {sum(retries)}')
+            self.stdout.write(f'Elapsed:        {elapsed:.3f}s')
+
+            if total_sold + remaining != stock or remaining >= quantity:
+                raise CommandError(
+                    f'Stock mismatch: started with {stock}, sold {total_sold}, {remaining} left'
+                )
+            self.stdout.write(self.style.SUCCESS('No lost updates or oversells detected'))
+        finally:
+            self._drop_fixture(branch, product)
+
+    def _create_fixture(self, stock):
+        tag = uuid.uuid4().hex[:8]
+        category = Category.objects.create(name=f'bench-{tag}')
+        brand = Brand.objects.create(name=f'bench-{tag}')
+        branch = Branch.objects.create(name=f'bench-{tag}', address='-', phone_number='-')
+        product = Product.objects.create(
+            product_type='accessory',
+            name=f'Bench SKU {tag}',
+            sku=f'BENCH-{tag}',
+            category=category,
+            brand=brand,
+            cost_price=1,
+            selling_price=2,
+        )
+        Inventory.objects.create(product=product, branch=branch, quantity=stock, reorder_level=0)
+        return branch, product
+
+    def _drop_fixture(self, branch, product):
+        category, brand = product.category, product.brand
+        product.delete()
+        branch.delete()
+        category.delete()
+        brand.delete()
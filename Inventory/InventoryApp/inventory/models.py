@@ -1,10 +1,14 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Q
 from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.utils import timezone
+import datetime
 import uuid
+import zoneinfo
 
 
 class Category(models.Model):
@@ -39,6 +43,11 @@ class Brand(models.Model):
         return self.name
 
 
+def validate_time_zone(value):
+    if value and value not in zoneinfo.available_timezones():
+        raise ValidationError(f'{value} is not a known time zone, e.g. Africa/Lagos')
+
+
 class Branch(models.Model):
     """Model for store branches"""
     name = models.CharField(max_length=100)
@@ -48,6 +57,10 @@ class Branch(models.Model):
     manager = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True,
                                 related_name='managed_branches')
     is_active = models.BooleanField(default=True)
+    # Blank means the site TIME_ZONE. Changing either of these needs backfill_business_dates
+    time_zone = models.CharField(max_length=64, blank=True, default='', validators=[validate_time_zone])
+    day_cutoff = models.TimeField(default=datetime.time(0, 0),
+                                  help_text='Local time the trading day ends; earlier sales count to the day before')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -58,6 +71,49 @@ class Branch(models.Model):
     def __str__(self):
         return self.name
 
+    def zone(self):
+        return zoneinfo.ZoneInfo(self.time_zone) if self.time_zone else timezone.get_default_timezone()
+
+    def business_date(self, moment):
+        """The trading day `moment` is reported under at this branch"""
+        local = timezone.localtime(moment, self.zone())
+        cutoff = datetime.timedelta(hours=self.day_cutoff.hour, minutes=self.day_cutoff.minute,
+                                    seconds=self.day_cutoff.second)
+        return (local - cutoff).date()
+
+    def today(self):
+        return self.business_date(timezone.now())
+
+    @classmethod
+    def business_days(cls):
+        """Today's trading day at every branch, as {date: [branch ids]}; branches differ only across zones"""
+        days = {}
+        for branch in cls.objects.only('time_zone', 'day_cutoff').order_by():
+            days.setdefault(branch.today(), []).append(branch.pk)
+        return days
+
+
+class DocumentSequence(models.Model):
+    """Per-branch, per-day counters used to number invoices and purchase orders"""
+    name = models.CharField(max_length=20)
+    branch = models.ForeignKey(Branch, on_delete=models.CASCADE, related_name='document_sequences')
+    day = models.DateField()
+    last_value = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('name', 'branch', 'day')
+
+    def __str__(self):
+        return f"{self.name} {self.day} at {self.branch_id}: {self.last_value}"
+
+
+class CatalogVersion(models.Model):
+    """Single row counting catalogue changes, so every worker can tell when its in-memory copies are stale"""
+    version = models.PositiveBigIntegerField(default=1)
+
+    def __str__(self):
+        return f"Catalogue version {self.version}"
+
 
 class Product(models.Model):
     """Base model for all products (abstract)"""
@@ -78,10 +134,14 @@ class Product(models.Model):
     image = models.ImageField(upload_to='product_images/', blank=True, null=True)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)  # Watermark for report caching
 
     class Meta:
         ordering = ['name']
+        indexes = [
+            models.Index(fields=['name']),
+            models.Index(fields=['is_active'], condition=Q(is_active=True), name='product_active'),
+        ]
 
     def __str__(self):
         return f"{self.name} - {self.sku}"
@@ -152,19 +212,101 @@ class Inventory(models.Model):
     quantity = models.PositiveIntegerField(default=0)
     reorder_level = models.PositiveIntegerField(default=5)
     last_restock_date = models.DateTimeField(blank=True, null=True)
+    # Weighted average landed cost of the units on hand; unset until the first costed receipt
+    average_cost = models.DecimalField(max_digits=12, decimal_places=4, blank=True, null=True)
 
     class Meta:
         verbose_name_plural = 'Inventories'
         unique_together = ('product', 'branch')
+        indexes = [
+            # Only the rows at or below their reorder level, for the low stock counts
+            models.Index(fields=['branch', 'quantity'], condition=Q(quantity__lte=F('reorder_level')),
+                         name='inventory_low_stock'),
+        ]
 
     def __str__(self):
         return f"{self.product.name} at {self.branch.name} - {self.quantity} units"
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        writes_quantity = update_fields is None or 'quantity' in update_fields
+
+        with transaction.atomic():
+            if self._state.adding or not writes_quantity:
+                previous_quantity = 0 if self._state.adding else self.quantity
+            else:
+                # Read the balance under a row lock rather than trusting the value this instance was loaded
+                # with: a sale committed since then is overwritten here, and must be written off in the ledger
+                previous_quantity = Inventory.objects.select_for_update().filter(pk=self.pk).values_list(
+                    'quantity', flat=True).first() or 0
+
+            super().save(*args, **kwargs)
+
+            # Direct edits (forms, admin) bypass inventory.stock, so record them as adjustments
+            delta = self.quantity - previous_quantity
+            if delta:
+                StockMovement.objects.create(
+                    product_id=self.product_id,
+                    branch_id=self.branch_id,
+                    movement_type='adjustment',
+                    quantity=delta,
+                    reference_type='inventory',
+                    reference_id=self.pk,
+                )
+
     def is_low_stock(self):
         """Check if inventory is below reorder level"""
         return self.quantity <= self.reorder_level
 
 
+class StockMovement(models.Model):
+    """Append-only ledger of every change to a branch's stock"""
+    MOVEMENT_TYPE_CHOICES = (
+        ('sale', 'Sale'),
+        ('return', 'Return'),
+        ('purchase', 'Purchase Receipt'),
+        ('adjustment', 'Adjustment'),
+        ('transfer_in', 'Transfer In'),
+        ('transfer_out', 'Transfer Out'),
+    )
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_movements')
+    branch = models.ForeignKey(Branch, on_delete=models.CASCADE, related_name='stock_movements')
+    movement_type = models.CharField(max_length=20, choices=MOVEMENT_TYPE_CHOICES)
+    quantity = models.IntegerField()  # Signed: negative when stock leaves the branch
+    reference_type = models.CharField(max_length=50, blank=True, null=True)
+    reference_id = models.PositiveIntegerField(blank=True, null=True)
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True,
+                                   related_name='stock_movements')
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'branch', 'created_at']),
+            models.Index(fields=['created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.get_movement_type_display()} {self.quantity:+d} of {self.product_id} at {self.branch_id}"
+
+
+class StockCheckpoint(models.Model):
+    """Ledger balance of a product at a branch, frozen at a point in time"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_checkpoints')
+    branch = models.ForeignKey(Branch, on_delete=models.CASCADE, related_name='stock_checkpoints')
+    as_of = models.DateTimeField()
+    quantity = models.IntegerField()
+
+    class Meta:
+        unique_together = ('product', 'branch', 'as_of')
+        indexes = [
+            models.Index(fields=['as_of']),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} at {self.branch_id} as of {self.as_of}: {self.quantity}"
+
+
 class Supplier(models.Model):
     """Model for product suppliers"""
     name = models.CharField(max_length=100)
@@ -185,6 +327,7 @@ class Purchase(models.Model):
     """Model for tracking purchases from suppliers"""
     STATUS_CHOICES = (
         ('pending', 'Pending'),
+        ('partial', 'Partially Received'),
         ('received', 'Received'),
         ('canceled', 'Canceled'),
     )
@@ -192,6 +335,7 @@ class Purchase(models.Model):
     supplier = models.ForeignKey(Supplier, on_delete=models.CASCADE, related_name='purchases')
     branch = models.ForeignKey(Branch, on_delete=models.CASCADE, related_name='purchases')
     purchase_date = models.DateTimeField(default=timezone.now)
+    business_date = models.DateField(editable=False)  # The branch's trading day, set on save
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
     reference_number = models.CharField(max_length=50, unique=True)
     notes = models.TextField(blank=True, null=True)
@@ -201,17 +345,25 @@ class Purchase(models.Model):
                                     related_name='received_purchases')
     total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)  # Watermark for report caching
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['branch', 'business_date', 'purchase_date']),
+            models.Index(fields=['business_date', 'purchase_date']),
+        ]
 
     def __str__(self):
         return f"PO-{self.reference_number} ({self.supplier.name})"
 
     def save(self, *args, **kwargs):
-        # Auto-generate reference number if not provided
+        self.business_date = self.branch.business_date(self.purchase_date)
+
+        # Auto-generate reference number if not provided, numbered within the branch's trading day
         if not self.reference_number:
-            last_purchase = Purchase.objects.order_by('-id').first()
-            last_id = last_purchase.id if last_purchase else 0
-            self.reference_number = f"PO-{str(last_id + 1).zfill(6)}"
+            from .sequences import next_value
+            number = next_value('purchase', self.branch_id, self.business_date)
+            self.reference_number = f"PO-{self.branch_id:03d}-{self.business_date:%Y%m%d}-{number:04d}"
 
         super().save(*args, **kwargs)
 
@@ -221,17 +373,49 @@ class PurchaseItem(models.Model):
     purchase = models.ForeignKey(Purchase, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='purchase_items')
     quantity = models.PositiveIntegerField()
+    received_quantity = models.PositiveIntegerField(default=0)
     unit_price = models.DecimalField(max_digits=10, decimal_places=2)
     total_price = models.DecimalField(max_digits=12, decimal_places=2)
 
     def __str__(self):
         return f"{self.product.name} ({self.quantity}) - {self.purchase.reference_number}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored total so save() only applies the difference
+        instance._stored_total_price = instance.__dict__.get('total_price')
+        return instance
+
     def save(self, *args, **kwargs):
         # Auto-calculate the total price
         self.total_price = self.quantity * self.unit_price
-        super().save(*args, **kwargs)
 
-        # Update the purchase total
-        self.purchase.total_amount = sum(item.total_price for item in self.purchase.items.all())
-        self.purchase.save()
+        if self._state.adding:
+            previous_total = 0
+        else:
+            previous_total = getattr(self, '_stored_total_price', None)
+            if previous_total is None:
+                previous_total = PurchaseItem.objects.filter(pk=self.pk).values_list('total_price', flat=True).first() or 0
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+            # Update the purchase total
+            self._apply_to_purchase(self.total_price - previous_total)
+
+        self._stored_total_price = self.total_price
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            self._apply_to_purchase(-self.total_price)
+        return result
+
+    def _apply_to_purchase(self, delta):
+        """Shift the purchase total by `delta` without re-reading its items"""
+        if delta:
+            Purchase.objects.filter(pk=self.purchase_id).update(
+                total_amount=F('total_amount') + delta,
+                updated_at=timezone.now(),
+            )
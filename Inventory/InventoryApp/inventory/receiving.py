@@ -0,0 +1,71 @@
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Purchase, PurchaseItem
+from .stock import add_stock_bulk, grouped_case
+
+
+class ReceivingError(ValueError):
+    """Raised when a purchase cannot be received"""
+
+
+def receive_purchase(purchase, user, received=None):
+    """
+    Book a delivery against a purchase order.
+
+    `received` maps purchase item ids to the cumulative quantity delivered so
+    far; omit it to receive everything still outstanding. Because the counts
+    are totals rather than increments, replaying the same receipt is a no-op,
+    and quantities beyond what was ordered are ignored.
+
+    Every line is booked with a fixed number of bulk statements regardless of
+    the size of the order, and no per-row model signals are sent. Each line's
+    unit price is folded into the branch's weighted average cost. Returns a
+    {product_id: quantity} map of the stock added by this call.
+    """
+    with transaction.atomic():
+        # Serialize receipts of the same order so two clerks cannot both book it
+        purchase = Purchase.objects.select_for_update().get(pk=purchase.pk)
+        if purchase.status == 'canceled':
+            raise ReceivingError(f"Purchase {purchase.reference_number} has been canceled")
+
+        items = list(purchase.items.values_list('id', 'product_id', 'quantity', 'received_quantity', 'unit_price'))
+        if not items:
+            raise ReceivingError(f"Purchase {purchase.reference_number} has no items")
+
+        increments = {}
+        added = {}
+        costs = {}
+        fully_received = True
+        anything_received = False
+        for item_id, product_id, ordered, already_received, unit_price in items:
+            target = ordered if received is None else min(ordered, received.get(item_id, already_received))
+            increment = max(0, target - already_received)
+            if increment:
+                increments[item_id] = increment
+                added[product_id] = added.get(product_id, 0) + increment
+                costs[product_id] = costs.get(product_id, 0) + increment * unit_price
+            if already_received + increment < ordered:
+                fully_received = False
+            if already_received + increment:
+                anything_received = True
+
+        if increments:
+            PurchaseItem.objects.filter(pk__in=increments).update(
+                received_quantity=F('received_quantity') + grouped_case('pk', increments)
+            )
+            add_stock_bulk(purchase.branch_id, added, movement_type='purchase', reference_type='purchase',
+                           reference_id=purchase.pk, user=user, restocked=True, costs=costs)
+
+        if fully_received:
+            status = 'received'
+        elif anything_received:
+            status = 'partial'
+        else:
+            status = purchase.status
+
+        if status != purchase.status or increments:
+            Purchase.objects.filter(pk=purchase.pk).update(status=status, received_by=user, updated_at=timezone.now())
+
+    return added
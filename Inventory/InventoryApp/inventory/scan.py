@@ -0,0 +1,144 @@
+import threading
+from collections import OrderedDict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection
+
+from .models import Inventory, Product
+
+
+class ScanCache:
+    """
+    Bounded LRU mapping scanned codes to product details.
+
+    Each entry remembers the product's updated_at as its version, which
+    Product.save() bumps, and the stock lookup made on every scan reads it
+    back, so an entry edited by another process is noticed on its next scan. Saves in
+    this process also evict their entries straight away via signals.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._entries = OrderedDict()
+        self._by_product = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    def get(self, code):
+        with self._lock:
+            entry = self._entries.get(code)
+            if entry is not None:
+                self._entries.move_to_end(code)
+            return entry
+
+    def put(self, code, entry):
+        with self._lock:
+            self._entries[code] = entry
+            self._entries.move_to_end(code)
+            self._by_product.setdefault(entry['id'], set()).add(code)
+            while len(self._entries) > self.capacity:
+                old_code, old_entry = self._entries.popitem(last=False)
+                self._forget(old_code, old_entry['id'])
+                self.evictions += 1
+
+    def count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def invalidate(self, product_id):
+        with self._lock:
+            for code in self._by_product.pop(product_id, ()):
+                self._entries.pop(code, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_product.clear()
+            self.hits = self.misses = self.stale = self.evictions = 0
+
+    def _forget(self, code, product_id):
+        codes = self._by_product.get(product_id)
+        if codes is not None:
+            codes.discard(code)
+            if not codes:
+                del self._by_product[product_id]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'capacity': self.capacity,
+            'hits': self.hits,
+            'misses': self.misses,
+            'stale': self.stale,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+CENTS = Decimal('0.01')
+
+cache = ScanCache(getattr(settings, 'BARCODE_CACHE_SIZE', 10000))
+
+
+PRODUCTS = Product._meta.db_table
+INVENTORY = Inventory._meta.db_table
+
+# The till calls these once per beep, so they are kept as plain SQL rather than rebuilt by the ORM
+VERSION_SQL = (
+    f"SELECT p.updated_at, (SELECT i.quantity FROM {INVENTORY} i WHERE i.product_id = p.id AND i.branch_id = %s) "
+    f"FROM {PRODUCTS} p WHERE p.id = %s AND p.is_active"
+)
+RESOLVE_SQL = (
+    f"SELECT p.id, p.name, p.sku, p.barcode, p.selling_price, p.product_type, p.updated_at, "
+    f"(SELECT i.quantity FROM {INVENTORY} i WHERE i.product_id = p.id AND i.branch_id = %s) "
+    f"FROM {PRODUCTS} p WHERE (p.barcode = %s OR p.sku = %s) AND p.is_active LIMIT 1"
+)
+
+
+def scan(code, branch):
+    """
+    Resolve a scanned barcode or SKU to the product and its stock at `branch`.
+
+    Returns None for unknown or inactive codes. Every call costs one indexed
+    query: a cache hit reads the product's version and the branch's stock by
+    primary key, a miss resolves the code through the unique barcode/SKU
+    indexes and reads the stock in the same statement.
+    """
+    branch_id = getattr(branch, 'pk', branch)
+    code = code.strip()
+
+    with connection.cursor() as cursor:
+        entry = cache.get(code)
+        if entry is not None:
+            cursor.execute(VERSION_SQL, [branch_id, entry['id']])
+            row = cursor.fetchone()
+            if row is not None and row[0] == entry['version']:
+                cache.count('hits')
+                return dict(entry, quantity=row[1] or 0)
+            cache.count('stale')
+            cache.invalidate(entry['id'])
+
+        cache.count('misses')
+        cursor.execute(RESOLVE_SQL, [branch_id, code, code])
+        row = cursor.fetchone()
+
+    if row is None:
+        return None
+
+    product_id, name, sku, barcode, price, product_type, version, quantity = row
+    entry = {
+        'id': product_id,
+        'name': name,
+        'sku': sku,
+        'barcode': barcode,
+        'selling_price': Decimal(str(price)).quantize(CENTS),
+        'product_type': product_type,
+        'version': version,
+    }
+    cache.put(code, entry)
+    return dict(entry, quantity=quantity or 0)
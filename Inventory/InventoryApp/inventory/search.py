@@ -0,0 +1,195 @@
+import re
+
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.db.models import Q
+
+from .models import Brand, Inventory, Phone, Product
+
+FTS_TABLE = 'inventory_product_fts'
+
+# Column weights for bm25(): name, sku, barcode, brand, model number
+RANK_WEIGHTS = (10.0, 6.0, 6.0, 3.0, 4.0)
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def is_available():
+    """Whether the database can serve searches from the FTS5 index"""
+    return connection.vendor == 'sqlite'
+
+
+def ensure_index():
+    """Create the full-text index table if it does not exist yet"""
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            "name, sku, barcode, brand, model_number, "
+            "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3 4')"
+        )
+
+
+def _source_sql(where):
+    """SELECT producing one index row per product matched by `where`"""
+    return (
+        f"SELECT p.{Product._meta.pk.column}, p.name, p.sku, COALESCE(p.barcode, ''), b.name, "
+        f"COALESCE(ph.model_number, '') "
+        f"FROM {Product._meta.db_table} p "
+        f"JOIN {Brand._meta.db_table} b ON b.id = p.brand_id "
+        f"LEFT JOIN {Phone._meta.db_table} ph ON ph.product_ptr_id = p.id "
+        f"WHERE {where}"
+    )
+
+
+def index_products(product_ids=None, brand_id=None):
+    """
+    Refresh the index rows for the given products, or for every product of a brand.
+
+    Called from the Product and Brand signals; bulk loads go through
+    rebuild_index() instead.
+    """
+    if not is_available():
+        return
+
+    if brand_id is not None:
+        where, params = 'p.brand_id = %s', [brand_id]
+    else:
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        placeholders = ', '.join(['%s'] * len(product_ids))
+        where, params = f'p.id IN ({placeholders})', product_ids
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {FTS_TABLE} WHERE rowid IN (SELECT p.id FROM {Product._meta.db_table} p WHERE {where})",
+            params,
+        )
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, name, sku, barcode, brand, model_number) {_source_sql(where)}",
+            params,
+        )
+
+
+def remove_products(product_ids):
+    """Drop deleted products from the index"""
+    product_ids = list(product_ids)
+    if not is_available() or not product_ids:
+        return
+    placeholders = ', '.join(['%s'] * len(product_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})", product_ids)
+
+
+def rebuild_index():
+    """Recreate the whole index from the catalogue and return the number of rows indexed"""
+    if not is_available():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+        ensure_index()
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, name, sku, barcode, brand, model_number) {_source_sql('1 = 1')}"
+        )
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+        cursor.execute(f"SELECT COUNT(*) FROM {FTS_TABLE}")
+        return cursor.fetchone()[0]
+
+
+def build_match(query):
+    """
+    Turn free text typed at the till into an FTS5 MATCH expression.
+
+    Every word must match, and the last one may be a prefix of a longer
+    term so results narrow as the cashier types.
+    """
+    tokens = TOKEN_RE.findall(query)
+    if not tokens:
+        return None
+    terms = [f'"{token}"' for token in tokens[:-1]]
+    terms.append(f'"{tokens[-1]}"*')
+    return ' '.join(terms)
+
+
+def _result(product_id, name, sku, barcode, price, product_type, image, quantity):
+    return {
+        'id': product_id,
+        'name': name,
+        'sku': sku,
+        'barcode': barcode,
+        'price': float(price),
+        'quantity_available': quantity,
+        'product_type': dict(Product.PRODUCT_TYPE_CHOICES).get(product_type, product_type),
+        'image_url': default_storage.url(image) if image else None,
+    }
+
+
+def search_products(branch, query, limit=20):
+    """
+    Return the best matching in-stock products at a branch, most relevant first.
+
+    A scanned barcode or typed SKU is answered straight from its unique
+    index. Anything else goes through the full-text index; price, stock and
+    product type come back in the same query. Every in-stock match is
+    scored with bm25 and SQLite keeps only the best `limit` while sorting,
+    so an old but exact product still beats newer partial matches.
+    On databases without FTS5 a plain substring search is used instead.
+    """
+    branch_id = getattr(branch, 'pk', branch)
+    match = build_match(query)
+    if match is None:
+        return []
+
+    exact = _search_exact(branch_id, query.strip())
+    if exact:
+        return exact
+
+    if not is_available():
+        return _search_fallback(branch_id, query, limit)
+
+    rank = ', '.join(str(weight) for weight in RANK_WEIGHTS)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT p.id, p.name, p.sku, p.barcode, p.selling_price, p.product_type, p.image, i.quantity "
+            f"FROM {FTS_TABLE} f "
+            f"JOIN {Product._meta.db_table} p ON p.id = f.rowid "
+            f"JOIN {Inventory._meta.db_table} i ON i.product_id = p.id AND i.branch_id = %s "
+            f"WHERE {FTS_TABLE} MATCH %s AND p.is_active AND i.quantity > 0 "
+            f"ORDER BY bm25({FTS_TABLE}, {rank}) LIMIT %s",
+            [branch_id, match, limit],
+        )
+        rows = cursor.fetchall()
+
+    return [_result(*row) for row in rows]
+
+
+def _search_exact(branch_id, code):
+    if not code or any(char.isspace() for char in code):
+        return []
+    rows = Inventory.objects.filter(
+        Q(product__barcode=code) | Q(product__sku=code),
+        branch_id=branch_id,
+        quantity__gt=0,
+        product__is_active=True,
+    ).values_list(
+        'product_id', 'product__name', 'product__sku', 'product__barcode', 'product__selling_price',
+        'product__product_type', 'product__image', 'quantity',
+    )[:2]
+    return [_result(*row) for row in rows]
+
+
+def _search_fallback(branch_id, query, limit):
+    rows = Inventory.objects.filter(
+        Q(product__name__icontains=query) |
+        Q(product__sku__icontains=query) |
+        Q(product__barcode__icontains=query),
+        branch_id=branch_id,
+        quantity__gt=0,
+        product__is_active=True,
+    ).order_by('product__name').values_list(
+        'product_id', 'product__name', 'product__sku', 'product__barcode', 'product__selling_price',
+        'product__product_type', 'product__image', 'quantity',
+    )[:limit]
+    return [_result(*row) for row in rows]
@@ -0,0 +1,94 @@
+import datetime
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import DocumentSequence
+
+# Values already reserved in the database but not yet handed out by this
+# process, keyed by (name, branch_id, day) -> [[next_value, last_value], ...]
+# with the lowest block first
+_blocks = {}
+_blocks_lock = threading.Lock()
+
+
+def _block_size():
+    return max(1, getattr(settings, 'DOCUMENT_SEQUENCE_BLOCK_SIZE', 1))
+
+
+def allocate_values(name, branch, count, day=None):
+    """
+    Reserve `count` consecutive values of a sequence and return them as a range.
+
+    The counter row is bumped with a single F() update, so concurrent callers
+    always receive disjoint ranges. Rows are created lazily the first time a
+    branch numbers a document on a given day.
+    """
+    branch_id = getattr(branch, 'pk', branch)
+    day = day or timezone.localdate()
+    counters = DocumentSequence.objects.filter(name=name, branch_id=branch_id, day=day)
+
+    with transaction.atomic():
+        updated = counters.update(last_value=F('last_value') + count)
+        if not updated:
+            try:
+                with transaction.atomic():
+                    DocumentSequence.objects.create(name=name, branch_id=branch_id, day=day, last_value=count)
+                return range(1, count + 1)
+            except IntegrityError:
+                # Another worker created today's row first
+                counters.update(last_value=F('last_value') + count)
+        last = counters.values_list('last_value', flat=True).get()
+
+    return range(last - count + 1, last + 1)
+
+
+def next_value(name, branch, day=None):
+    """
+    Return the next value of a per-branch, per-day sequence.
+
+    With DOCUMENT_SEQUENCE_BLOCK_SIZE above 1, each process reserves a block
+    of values at a time and hands them out from memory. A block only becomes
+    reusable once the transaction that reserved it has committed, so a
+    rollback can never leak values another process will also receive.
+    Values still unused when the process exits are never handed out, which
+    leaves gaps in the numbering.
+    """
+    branch_id = getattr(branch, 'pk', branch)
+    day = day or timezone.localdate()
+    key = (name, branch_id, day)
+
+    with _blocks_lock:
+        blocks = _blocks.get(key)
+        if blocks:
+            block = blocks[0]
+            value = block[0]
+            if value >= block[1]:
+                blocks.pop(0)
+                if not blocks:
+                    del _blocks[key]
+            else:
+                block[0] += 1
+            return value
+
+    size = _block_size()
+    values = allocate_values(name, branch_id, size, day)
+    if size > 1:
+        transaction.on_commit(lambda: _store_block(key, values[1], values[-1]))
+    return values[0]
+
+
+def _store_block(key, first, last):
+    with _blocks_lock:
+        # Days roll over, so drop blocks that can no longer be used. Branch trading
+        # days can trail the site date by a zone offset plus a late cutoff.
+        oldest = timezone.localdate() - datetime.timedelta(days=2)
+        for stale in [k for k in _blocks if k[2] < oldest]:
+            del _blocks[stale]
+        # Threads that found no block each reserved their own; keep them all so no value is skipped
+        blocks = _blocks.setdefault(key, [])
+        blocks.append([first, last])
+        blocks.sort()
@@ -0,0 +1,47 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from . import autocomplete, scan, search
+from .models import Accessory, Brand, Phone, Product
+
+
+@receiver(post_migrate)
+def create_search_index(sender, **kwargs):
+    """Create the product search index once the inventory tables exist"""
+    if sender.name == 'inventory':
+        search.ensure_index()
+
+
+# Receivers name their senders: a post_delete listener without one turns off
+# the ORM's fast delete for every model in the project.
+
+# Saving a phone or accessory only signals the subclass, so each one is connected
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Phone)
+@receiver(post_save, sender=Accessory)
+def index_product(sender, instance, raw=False, **kwargs):
+    """Keep the search indexes and scan cache in step with product edits, including phones and accessories"""
+    if not raw:
+        search.index_products([instance.pk])
+        scan.cache.invalidate(instance.pk)
+        # The typeahead lives in memory, so it must not see changes that get rolled back
+        transaction.on_commit(partial(autocomplete.index.apply, instance))
+
+
+# Deleting a phone or accessory deletes its Product row too, which signals here
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    """Drop deleted products from the search indexes and scan cache"""
+    search.remove_products([instance.pk])
+    scan.cache.invalidate(instance.pk)
+    transaction.on_commit(partial(autocomplete.index.apply, instance, deleted=True))
+
+
+@receiver(post_save, sender=Brand)
+def reindex_brand(sender, instance, created, raw=False, **kwargs):
+    """Brand names are searchable, so a rename re-indexes the brand's products"""
+    if not created and not raw:
+        search.index_products(brand_id=instance.pk)
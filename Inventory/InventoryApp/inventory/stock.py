@@ -0,0 +1,272 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import (Case, DecimalField, ExpressionWrapper, F, FloatField, Max, OuterRef,
+                              PositiveIntegerField, Q, Subquery, Sum, Value, When)
+from django.db.models.functions import Cast, Coalesce, Round
+from django.dispatch import Signal
+from django.utils import timezone
+
+from .models import Inventory, Product, StockCheckpoint, StockMovement
+
+COST_FIELD = DecimalField(max_digits=12, decimal_places=4)
+COST_STEP = Decimal('0.0001')
+
+# Sent with branch_id and product_ids after balances change. The bulk updates
+# here bypass Inventory.save, so listeners cannot rely on post_save.
+stock_changed = Signal()
+
+
+class InsufficientStockError(ValueError):
+    """Raised when a branch does not hold enough stock to cover a request"""
+
+    def __init__(self, product_id, branch_id, requested, available=None):
+        self.product_id = product_id
+        self.branch_id = branch_id
+        self.requested = requested
+        self.available = available
+        if available is None:
+            message = f"Not enough stock available for product #{product_id}."
+        else:
+            message = f"Not enough stock available. Only {available} units in stock."
+        super().__init__(message)
+
+
+def grouped_case(lookup, values, output_field=None):
+    """
+    Build a CASE expression mapping keys to per-key values for a batched update.
+
+    Keys that share a value collapse into a single WHEN ... IN (...) branch,
+    which keeps the expression small when many lines move the same quantity.
+    """
+    groups = {}
+    for key, value in values.items():
+        groups.setdefault(value, []).append(key)
+
+    return Case(
+        *[When(**{f'{lookup}__in': keys}, then=Value(value)) for value, keys in groups.items()],
+        output_field=output_field or PositiveIntegerField(),
+    )
+
+
+def unit_costs(branch, product_ids):
+    """
+    Return {product_id: cost} for what one unit currently costs a branch.
+
+    That is the branch's weighted average cost, or the product's list cost
+    price where nothing costed has been received there yet.
+    """
+    branch_id = getattr(branch, 'pk', branch)
+    average = Inventory.objects.filter(branch_id=branch_id, product_id=OuterRef('pk')).values('average_cost')
+    costs = Product.objects.filter(pk__in=product_ids).annotate(
+        unit_cost=Coalesce(Subquery(average), 'cost_price', output_field=COST_FIELD),
+    ).values_list('pk', 'unit_cost')
+    return {product_id: cost.quantize(COST_STEP) for product_id, cost in costs}
+
+
+def _record_movements(branch_id, deltas, movement_type, reference_type=None, reference_id=None, user=None):
+    """Append one ledger row per product in `deltas` with a single bulk insert"""
+    now = timezone.now()
+    StockMovement.objects.bulk_create([
+        StockMovement(
+            product_id=product_id,
+            branch_id=branch_id,
+            movement_type=movement_type,
+            quantity=delta,
+            reference_type=reference_type,
+            reference_id=reference_id,
+            created_by=user,
+            created_at=now,
+        )
+        for product_id, delta in deltas.items() if delta
+    ])
+
+
+def deduct_stock(product, branch, quantity, movement_type='sale', reference_type=None, reference_id=None,
+                 user=None):
+    """
+    Take `quantity` units of a product out of a branch's inventory.
+
+    The availability check and the decrement are a single conditional
+    UPDATE, so concurrent sellers can never drive the balance below zero
+    or lose each other's writes.
+    """
+    product_id = getattr(product, 'pk', product)
+    branch_id = getattr(branch, 'pk', branch)
+
+    with transaction.atomic():
+        updated = Inventory.objects.filter(
+            product_id=product_id,
+            branch_id=branch_id,
+            quantity__gte=quantity,
+        ).update(quantity=F('quantity') - quantity)
+
+        if updated:
+            _record_movements(branch_id, {product_id: -quantity}, movement_type, reference_type, reference_id, user)
+            stock_changed.send(Inventory, branch_id=branch_id, product_ids=[product_id])
+
+    if not updated:
+        # Only read the row back on the failure path to report what is left
+        available = Inventory.objects.filter(
+            product_id=product_id, branch_id=branch_id
+        ).values_list('quantity', flat=True).first()
+        raise InsufficientStockError(product_id, branch_id, quantity, available or 0)
+
+
+def deduct_stock_bulk(branch, quantities, movement_type='sale', reference_type=None, reference_id=None,
+                      user=None, ledger=None):
+    """
+    Take several products out of a branch's inventory in one statement.
+
+    `quantities` maps product ids to the number of units to remove. Either
+    every row is decremented or, if any product is short, none are.
+
+    By default one ledger row is written per product. Callers booking many
+    documents at once can pass their own unsaved StockMovement rows in
+    `ledger` so each document keeps its own reference.
+    """
+    branch_id = getattr(branch, 'pk', branch)
+    if not quantities:
+        return
+
+    condition = Q()
+    for product_id, quantity in quantities.items():
+        condition |= Q(product_id=product_id, quantity__gte=quantity)
+
+    delta = grouped_case('product_id', quantities)
+
+    try:
+        with transaction.atomic():
+            updated = Inventory.objects.filter(condition, branch_id=branch_id).update(
+                quantity=F('quantity') - delta
+            )
+            if updated != len(quantities):
+                raise InsufficientStockError(None, branch_id, None)
+
+            if ledger is not None:
+                StockMovement.objects.bulk_create(ledger)
+            else:
+                _record_movements(
+                    branch_id,
+                    {product_id: -quantity for product_id, quantity in quantities.items()},
+                    movement_type, reference_type, reference_id, user,
+                )
+            stock_changed.send(Inventory, branch_id=branch_id, product_ids=list(quantities))
+    except InsufficientStockError:
+        # Work out which line was short now that the partial update is undone
+        on_hand = dict(Inventory.objects.filter(
+            branch_id=branch_id, product_id__in=quantities
+        ).values_list('product_id', 'quantity'))
+        for product_id, quantity in quantities.items():
+            available = on_hand.get(product_id, 0)
+            if available < quantity:
+                raise InsufficientStockError(product_id, branch_id, quantity, available)
+        raise
+
+
+def add_stock_bulk(branch, quantities, movement_type='return', reference_type=None, reference_id=None,
+                   user=None, restocked=False, costs=None):
+    """
+    Put several products into a branch's inventory.
+
+    Missing inventory rows are created with one bulk insert, balances are
+    raised with one batched update, and the ledger rows are appended with
+    one more bulk insert. No per-row model signals are sent.
+
+    `costs` maps product ids to the total landed cost of the units being
+    added; those products' weighted average cost is rolled forward in the
+    same update. Products without a cost keep their average, as returns
+    re-enter stock at the cost they left with.
+    """
+    branch_id = getattr(branch, 'pk', branch)
+    quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity}
+    if not quantities:
+        return
+
+    delta = grouped_case('product_id', quantities)
+    changes = {'quantity': F('quantity') + delta}
+    if restocked:
+        changes['last_restock_date'] = timezone.now()
+    if costs:
+        # SET expressions see the balance from before this update, i.e. the units already on hand
+        list_cost = Product.objects.filter(pk=OuterRef('product_id')).values('cost_price')
+        on_hand_value = F('quantity') * Coalesce('average_cost', Subquery(list_cost), output_field=COST_FIELD)
+        # A float divisor stops SQLite from truncating when every operand happens to be whole
+        units_after = Cast(F('quantity') + delta, FloatField())
+        changes['average_cost'] = Case(
+            When(product_id__in=list(costs), then=Round(ExpressionWrapper(
+                (on_hand_value + grouped_case('product_id', costs, COST_FIELD)) / units_after,
+                output_field=COST_FIELD,
+            ), 4)),
+            default=F('average_cost'),
+            output_field=COST_FIELD,
+        )
+
+    with transaction.atomic():
+        Inventory.objects.bulk_create(
+            [Inventory(product_id=product_id, branch_id=branch_id, quantity=0) for product_id in quantities],
+            ignore_conflicts=True,
+        )
+        Inventory.objects.filter(branch_id=branch_id, product_id__in=quantities).update(**changes)
+        _record_movements(branch_id, quantities, movement_type, reference_type, reference_id, user)
+        stock_changed.send(Inventory, branch_id=branch_id, product_ids=list(quantities))
+
+
+def restore_stock(product, branch, quantity, movement_type='return', reference_type=None, reference_id=None,
+                  user=None):
+    """Put `quantity` units of a product back into a branch's inventory"""
+    product_id = getattr(product, 'pk', product)
+    add_stock_bulk(branch, {product_id: quantity}, movement_type, reference_type, reference_id, user)
+
+
+def transfer_stock(product, from_branch, to_branch, quantity, user=None):
+    """Move stock between branches, recording both legs of the transfer"""
+    product_id = getattr(product, 'pk', product)
+    from_branch_id = getattr(from_branch, 'pk', from_branch)
+    to_branch_id = getattr(to_branch, 'pk', to_branch)
+
+    with transaction.atomic():
+        deduct_stock(product_id, from_branch_id, quantity, 'transfer_out', 'branch', to_branch_id, user)
+        # The units arrive carrying the sending branch's average cost
+        cost = unit_costs(from_branch_id, [product_id])[product_id]
+        add_stock_bulk(to_branch_id, {product_id: quantity}, 'transfer_in', 'branch', from_branch_id, user,
+                       restocked=True, costs={product_id: cost * quantity})
+
+
+def balances_as_of(when, branch=None, product_ids=None):
+    """
+    Return {(product_id, branch_id): quantity} as of `when`.
+
+    Starts from the latest checkpoint at or before `when` and only sums the
+    ledger rows written after it, so the cost depends on the checkpoint
+    interval rather than on the age of the ledger.
+    """
+    checkpoints = StockCheckpoint.objects.filter(as_of__lte=when)
+    movements = StockMovement.objects.filter(created_at__lte=when)
+    if branch is not None:
+        checkpoints = checkpoints.filter(branch=branch)
+        movements = movements.filter(branch=branch)
+    if product_ids is not None:
+        checkpoints = checkpoints.filter(product_id__in=product_ids)
+        movements = movements.filter(product_id__in=product_ids)
+
+    balances = {}
+    checkpoint_at = checkpoints.aggregate(latest=Max('as_of'))['latest']
+    if checkpoint_at:
+        for product_id, branch_id, quantity in checkpoints.filter(as_of=checkpoint_at).values_list(
+                'product_id', 'branch_id', 'quantity'):
+            balances[(product_id, branch_id)] = quantity
+        movements = movements.filter(created_at__gt=checkpoint_at)
+
+    for product_id, branch_id, total in movements.values('product_id', 'branch_id').annotate(
+            total=Sum('quantity')).values_list('product_id', 'branch_id', 'total'):
+        balances[(product_id, branch_id)] = balances.get((product_id, branch_id), 0) + total
+
+    return balances
+
+
+def stock_as_of(product, branch, when):
+    """Return a product's stock at a branch as it stood at `when`"""
+    product_id = getattr(product, 'pk', product)
+    branch_id = getattr(branch, 'pk', branch)
+    return balances_as_of(when, branch_id, [product_id]).get((product_id, branch_id), 0)
@@ -1,3 +1,371 @@
-from django.test import TestCase
+import datetime
+import os
+import threading
+from decimal import Decimal
 
-# Create your tests here.
+import unittest
+
+from django.db import OperationalError, connection
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from . import autocomplete, catalog, scan, search, sequences
+from .models import (
+    Branch, Brand, CatalogVersion, Category, DocumentSequence, Inventory, Product, Purchase, PurchaseItem,
+    StockCheckpoint, StockMovement, Supplier,
+)
+from .receiving import ReceivingError, receive_purchase
+from .stock import InsufficientStockError, deduct_stock, restore_stock, stock_as_of, transfer_stock
+
+
+def create_stock(quantity, name='Charger'):
+    """A branch holding `quantity` units of one product"""
+    branch = Branch.objects.create(name='Main', address='1 Road', phone_number='08030000000')
+    product = Product.objects.create(
+        product_type='accessory', name=name, sku=name.upper(), category=Category.objects.create(name='Accessories'),
+        brand=Brand.objects.create(name='Acme'), cost_price=Decimal('5'), selling_price=Decimal('10'),
+    )
+    Inventory.objects.create(product=product, branch=branch, quantity=quantity)
+    return branch, product
+
+
+def on_hand(branch, product):
+    return Inventory.objects.get(branch=branch, product=product).quantity
+
+
+def run_in_threads(count, target):
+    """Start `count` threads on target(index) together and wait for them all"""
+    barrier = threading.Barrier(count)
+
+    def run(index):
+        barrier.wait()
+        try:
+            target(index)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+class DeductStockTests(TestCase):
+    def setUp(self):
+        self.branch, self.product = create_stock(5)
+
+    def test_deducts_and_records_the_sale(self):
+        deduct_stock(self.product, self.branch, 3, reference_type='sale', reference_id=7)
+
+        self.assertEqual(on_hand(self.branch, self.product), 2)
+        movement = StockMovement.objects.get(movement_type='sale')
+        self.assertEqual((movement.quantity, movement.reference_id), (-3, 7))
+
+    def test_short_stock_is_left_alone(self):
+        with self.assertRaises(InsufficientStockError) as raised:
+            deduct_stock(self.product, self.branch, 6)
+
+        self.assertEqual(raised.exception.available, 5)
+        self.assertEqual(on_hand(self.branch, self.product), 5)
+        self.assertFalse(StockMovement.objects.filter(movement_type='sale').exists())
+
+
+class ConcurrentDeductionTests(TransactionTestCase):
+    """Parallel sellers against one SKU must neither oversell nor lose a sale"""
+
+    def test_parallel_sellers(self):
+        branch, product = create_stock(20)
+        sold = [0] * 4
+
+        def seller(index):
+            while True:
+                try:
+                    deduct_stock(product.pk, branch.pk, 1)
+                except InsufficientStockError:
+                    return
+                except OperationalError:
+                    # SQLite reports writer contention as a lock timeout
+                    continue
+                sold[index] += 1
+
+        run_in_threads(len(sold), seller)
+
+        self.assertEqual(sum(sold), 20)
+        self.assertEqual(on_hand(branch, product), 0)
+        self.assertEqual(StockMovement.objects.filter(movement_type='sale').count(), 20)
+
+
+class DocumentNumberTests(TransactionTestCase):
+    """Numbers drawn from many threads at once are never repeated and never skipped"""
+
+    def setUp(self):
+        sequences._blocks.clear()
+        self.addCleanup(sequences._blocks.clear)
+        self.branch = Branch.objects.create(name='Main', address='1 Road', phone_number='08030000000')
+        self.day = timezone.localdate()
+
+    def draw(self, threads=4, per_thread=25):
+        drawn = [[] for _ in range(threads)]
+
+        def writer(index):
+            while len(drawn[index]) < per_thread:
+                try:
+                    drawn[index].append(sequences.next_value('invoice', self.branch.pk, self.day))
+                except OperationalError:
+                    # SQLite reports writer contention as a lock timeout; nothing was reserved
+                    continue
+
+        run_in_threads(threads, writer)
+        return [value for values in drawn for value in values]
+
+    def reserved(self):
+        return DocumentSequence.objects.get(name='invoice', branch=self.branch, day=self.day).last_value
+
+    @override_settings(DOCUMENT_SEQUENCE_BLOCK_SIZE=1)
+    def test_one_value_per_round_trip(self):
+        drawn = self.draw()
+
+        self.assertEqual(sorted(drawn), list(range(1, 101)))
+        self.assertEqual(self.reserved(), 100)
+
+    @override_settings(DOCUMENT_SEQUENCE_BLOCK_SIZE=7)
+    def test_blocks(self):
+        drawn = self.draw()
+
+        self.assertEqual(len(set(drawn)), 100)
+        # Every reserved value was handed out or is still waiting in this process's blocks
+        waiting = [value for first, last in sequences._blocks.get(('invoice', self.branch.pk, self.day), [])
+                   for value in range(first, last + 1)]
+        self.assertEqual(sorted(drawn + waiting), list(range(1, self.reserved() + 1)))
+
+    @override_settings(DOCUMENT_SEQUENCE_BLOCK_SIZE=3)
+    def test_purchase_references(self):
+        supplier = Supplier.objects.create(name='Wholesale', phone_number='08030000001')
+        references = [[] for _ in range(4)]
+
+        def writer(index):
+            while len(references[index]) < 10:
+                try:
+                    purchase = Purchase.objects.create(supplier=supplier, branch=self.branch, total_amount=1)
+                except OperationalError:
+                    continue
+                references[index].append(purchase.reference_number)
+
+        run_in_threads(len(references), writer)
+
+        numbers = [reference for batch in references for reference in batch]
+        self.assertEqual(len(set(numbers)), 40)
+        self.assertEqual(Purchase.objects.count(), 40)
+
+
+class LedgerTests(TestCase):
+    """The ledger replayed from a checkpoint must agree with the materialized balance"""
+
+    def setUp(self):
+        self.branch, self.product = create_stock(10)
+
+    def assertLedgerMatches(self, quantity):
+        self.assertEqual(on_hand(self.branch, self.product), quantity)
+        self.assertEqual(stock_as_of(self.product, self.branch, timezone.now()), quantity)
+
+    def test_every_change_is_recorded(self):
+        other = Branch.objects.create(name='Annex', address='2 Road', phone_number='08030000002')
+        Inventory.objects.create(product=self.product, branch=other, quantity=0)
+
+        deduct_stock(self.product, self.branch, 4)
+        restore_stock(self.product, self.branch, 1)
+        transfer_stock(self.product, self.branch, other, 2)
+
+        self.assertLedgerMatches(5)
+        self.assertEqual(stock_as_of(self.product, other, timezone.now()), 2)
+
+    def test_edit_after_a_sale_keeps_the_ledger_in_step(self):
+        # The instance still holds the balance from before the sale
+        inventory = Inventory.objects.get(branch=self.branch, product=self.product)
+        deduct_stock(self.product, self.branch, 2)
+        inventory.quantity = 8
+        inventory.save()
+
+        self.assertLedgerMatches(8)
+        # Only the opening balance; the edit wrote what the sale had already left
+        self.assertEqual(StockMovement.objects.filter(movement_type='adjustment').count(), 1)
+
+    def test_sales_after_a_checkpoint(self):
+        checkpoint_at = timezone.now()
+        StockCheckpoint.objects.create(product=self.product, branch=self.branch, as_of=checkpoint_at,
+                                       quantity=stock_as_of(self.product, self.branch, checkpoint_at))
+        deduct_stock(self.product, self.branch, 3)
+
+        self.assertLedgerMatches(7)
+        self.assertEqual(stock_as_of(self.product, self.branch, checkpoint_at), 10)
+
+    def test_reconcile(self):
+        # A change that bypassed the ledger entirely
+        Inventory.objects.filter(branch=self.branch, product=self.product).update(quantity=12)
+
+        call_command('create_stock_checkpoints', '--reconcile', stdout=open(os.devnull, 'w'))
+
+        self.assertLedgerMatches(12)
+
+
+class ReceivingTests(TestCase):
+    def setUp(self):
+        self.branch, self.product = create_stock(10)
+        supplier = Supplier.objects.create(name='Wholesale', phone_number='08030000001')
+        self.purchase = Purchase.objects.create(supplier=supplier, branch=self.branch, total_amount=0)
+        self.line = PurchaseItem.objects.create(purchase=self.purchase, product=self.product, quantity=10,
+                                                unit_price=Decimal('8'), total_price=0)
+
+    def test_partial_then_full_delivery(self):
+        self.assertEqual(receive_purchase(self.purchase, None, {self.line.pk: 4}), {self.product.pk: 4})
+        self.purchase.refresh_from_db()
+        self.assertEqual(self.purchase.status, 'partial')
+
+        # Counts are cumulative, so the rest of the order is 10, not 6 more
+        self.assertEqual(receive_purchase(self.purchase, None, {self.line.pk: 10}), {self.product.pk: 6})
+        self.purchase.refresh_from_db()
+        self.assertEqual(self.purchase.status, 'received')
+
+        inventory = Inventory.objects.get(branch=self.branch, product=self.product)
+        self.assertEqual(inventory.quantity, 20)
+        # Ten on hand at the list cost of 5, ten received at 8
+        self.assertEqual(inventory.average_cost, Decimal('6.5'))
+        self.assertEqual(stock_as_of(self.product, self.branch, timezone.now()), 20)
+
+    def test_replay_and_over_delivery_add_nothing(self):
+        receive_purchase(self.purchase, None)
+
+        self.assertEqual(receive_purchase(self.purchase, None), {})
+        self.assertEqual(receive_purchase(self.purchase, None, {self.line.pk: 15}), {})
+        self.assertEqual(on_hand(self.branch, self.product), 20)
+
+    def test_canceled_purchase(self):
+        Purchase.objects.filter(pk=self.purchase.pk).update(status='canceled')
+
+        with self.assertRaises(ReceivingError):
+            receive_purchase(self.purchase, None)
+        self.assertEqual(on_hand(self.branch, self.product), 10)
+
+
+@unittest.skipUnless(search.is_available(), 'Ranking needs the FTS5 index')
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        self.branch, self.product = create_stock(3, name='Pixel')
+        self.product.barcode = '4006381333931'
+        self.product.save()
+
+    def add_products(self, names, quantity=5):
+        brand, category = self.product.brand, self.product.category
+        for name in names:
+            sku = f'SKU{Product.objects.count()}'
+            product = Product.objects.create(product_type='accessory', name=name, sku=sku, category=category,
+                                             brand=brand, cost_price=1, selling_price=2)
+            Inventory.objects.create(product=product, branch=self.branch, quantity=quantity)
+
+    def names(self, query, limit=20):
+        return [result['name'] for result in search.search_products(self.branch, query, limit=limit)]
+
+    def test_best_match_wins_over_newer_products(self):
+        # More newer products mention the word, among many others, than a candidate window would hold
+        products = Product.objects.bulk_create([
+            Product(product_type='accessory', name=f'Silicone Leather Wallet Cover Case For Pixel {n}', sku=f'CASE{n}',
+                    category=self.product.category, brand=self.product.brand, cost_price=1, selling_price=2)
+            for n in range(600)
+        ])
+        Inventory.objects.bulk_create([Inventory(product=product, branch=self.branch, quantity=1)
+                                       for product in products])
+        search.rebuild_index()
+
+        self.assertEqual(self.names('pixel', limit=1), ['Pixel'])
+        self.assertEqual(len(self.names('pixel', limit=1000)), 601)
+
+    def test_prefixes_and_codes(self):
+        self.add_products(['Pixie Lamp', 'Power Bank'])
+        self.add_products(['Pixel Sold Out'], quantity=0)
+
+        self.assertEqual(sorted(self.names('pix')), ['Pixel', 'Pixie Lamp'])
+        self.assertEqual(self.names('4006381333931'), ['Pixel'])
+        self.assertEqual(self.names('SKU2'), ['Power Bank'])
+        self.assertEqual(self.names('  '), [])
+
+
+class ScanTests(TestCase):
+    def setUp(self):
+        scan.cache.clear()
+        self.addCleanup(scan.cache.clear)
+        self.branch, self.product = create_stock(5)
+        Product.objects.filter(pk=self.product.pk).update(barcode='4006381333931')
+
+    def test_hits_read_current_stock(self):
+        self.assertEqual(scan.scan(' 4006381333931 ', self.branch)['quantity'], 5)
+        deduct_stock(self.product, self.branch, 2)
+
+        entry = scan.scan('4006381333931', self.branch)
+
+        self.assertEqual((entry['id'], entry['selling_price'], entry['quantity']), (self.product.pk, Decimal('10'), 3))
+        self.assertEqual((scan.cache.hits, scan.cache.misses), (1, 1))
+
+    def test_edit_elsewhere_is_noticed(self):
+        scan.scan('CHARGER', self.branch)
+        # Another worker reprices the product; this process gets no signal
+        Product.objects.filter(pk=self.product.pk).update(selling_price=Decimal('12'),
+                                                          updated_at=timezone.now() + datetime.timedelta(seconds=1))
+
+        self.assertEqual(scan.scan('CHARGER', self.branch)['selling_price'], Decimal('12'))
+        self.assertEqual(scan.cache.stale, 1)
+
+    def test_unknown_and_inactive_codes(self):
+        self.assertIsNone(scan.scan('nothing', self.branch))
+        self.product.is_active = False
+        self.product.save()
+
+        self.assertIsNone(scan.scan('CHARGER', self.branch))
+
+    def test_least_recently_used_code_is_evicted(self):
+        cache = scan.ScanCache(2)
+        for code in ('a', 'b'):
+            cache.put(code, {'id': 1})
+        cache.get('a')
+        cache.put('c', {'id': 2})
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.stats()['size'], cache.evictions), (2, 1))
+        cache.invalidate(1)
+        self.assertIsNone(cache.get('a'))
+
+
+class AutocompleteTests(TestCase):
+    def setUp(self):
+        self.branch, self.product = create_stock(1, name='Galaxy Buds')
+        for name, sku in (('Buds Case', 'BC-1'), ('Galaxy Charger', 'GAL-CH')):
+            Product.objects.create(product_type='accessory', name=name, sku=sku, category=self.product.category,
+                                   brand=self.product.brand, cost_price=1, selling_price=2)
+        self.index = autocomplete.AutocompleteIndex()
+
+    def names(self, prefix, index=None):
+        return [entry['name'] for entry in (index or self.index).complete(prefix)]
+
+    def test_name_starts_rank_before_words_and_codes(self):
+        self.assertEqual(self.names('bud'), ['Buds Case', 'Galaxy Buds'])
+        self.assertEqual(self.names('gal'), ['Galaxy Buds', 'Galaxy Charger'])
+        self.assertEqual(self.names('gal ch'), ['Galaxy Charger'])
+        self.assertEqual(self.names('bc'), ['Buds Case'])
+        self.assertEqual(self.names('  '), [])
+
+    def test_edits_reach_every_worker(self):
+        # This index stands in for another worker that loaded the catalogue earlier
+        self.assertEqual(self.names('gal'), ['Galaxy Buds', 'Galaxy Charger'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = 'Pixel Buds'
+            self.product.save()
+
+        self.assertEqual(self.names('pix'), ['Pixel Buds'])
+        self.assertEqual(self.names('pix', autocomplete.index), ['Pixel Buds'])
+
+    def test_version_stamp(self):
+        self.assertEqual(catalog.catalog_version(), 1)
+        self.assertEqual([catalog.bump_catalog_version() for _ in range(3)], [2, 3, 4])
+        self.assertEqual(CatalogVersion.objects.get().version, 4)
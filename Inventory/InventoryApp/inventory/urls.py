@@ -9,4 +9,5 @@ urlpatterns = [
     path('api/inventory/', views.inventory_list_api, name='inventory_list_api'),
     path('api/inventory/<int:pk>/', views.inventory_detail_api, name='inventory_detail_api'),
     path('api/check-barcode/<str:barcode>/', views.check_barcode, name='check_barcode'),
+    path('api/scan-stats/', views.scan_stats, name='scan_stats'),
 ]
\ No newline at end of file
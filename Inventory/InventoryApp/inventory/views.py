@@ -1,3 +1,42 @@
 from django.shortcuts import render
+from django.contrib.auth.decorators import login_required, permission_required
+from django.http import JsonResponse
 
-# Create your views here.
+from . import scan
+
+
+@login_required
+@permission_required('accounts.can_access_staff_portal', raise_exception=True)
+def check_barcode(request, barcode):
+    """Resolve a scanned barcode or SKU at the till API view"""
+    # Get user's branch
+    branch = request.user.branch
+
+    if not branch:
+        return JsonResponse({'status': 'error', 'message': 'You are not assigned to any branch'}, status=400)
+
+    product = scan.scan(barcode, branch)
+    if product is None:
+        return JsonResponse({'status': 'error', 'exists': False, 'message': 'No product with this code'},
+                            status=404)
+
+    return JsonResponse({
+        'status': 'success',
+        'exists': True,
+        'product': {
+            'id': product['id'],
+            'name': product['name'],
+            'sku': product['sku'],
+            'barcode': product['barcode'],
+            'price': float(product['selling_price']),
+            'product_type': product['product_type'],
+            'quantity_available': product['quantity'],
+        },
+    })
+
+
+@login_required
+@permission_required('accounts.can_access_staff_portal', raise_exception=True)
+def scan_stats(request):
+    """Hit and miss counters for this worker's scan cache API view"""
+    return JsonResponse({'status': 'success', 'cache': scan.cache.stats()})